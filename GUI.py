@@ -1,28 +1,47 @@
 #!/usr/bin/env python3
 
+from startup_profile import StartupProfile # first, so that the imports below are timed
 import sys
 import os
+import argparse
 import json
 import math
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QPushButton, QVBoxLayout, QGridLayout,
     QGroupBox, QLabel,  QFileDialog, QCheckBox, QLineEdit, QDoubleSpinBox,
-    QComboBox, QInputDialog
+    QComboBox, QInputDialog, QCompleter, QPlainTextEdit
 )
 from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QThread, QObject
-from PyQt6.QtGui import QCloseEvent
+from PyQt6.QtGui import QCloseEvent, QFontDatabase
 import time
+from dataclasses import replace, asdict, fields
 
-from Library import Controller, STEP_PER_REVOLUTION
+from Library import STEP_PER_REVOLUTION
+import commands
+from acquisition import AcquisitionWorker, DaemonWorker
+from telemetry import ControllerStatus
 from PyQt6.QtWidgets import QSpacerItem, QSizePolicy
 
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS, ASYNCHRONOUS
+from influx_writer import InfluxWriter
+from widget_renderer import WidgetRenderer
+from target_index import TargetIndex
+from spin_down import SpinDown, STALLED, TIMEOUT, CANCELLED
+from waiters import WaiterRegistry, positionStable
+from motion_profile import seekHomeMove, qx4Slew, jogRamp
+import wheel_log
+import metrics
+from sequence import SequenceRunner, loadSchedule
 
 ########################################################################################################
 
 NTARGET = 16
-DEFAULT_POS_UPDATE_INTERVAL = 1000  # milliseconds
+RENDER_INTERVAL = 100 # milliseconds, at most 10 repaints per second of the tick displays
+SPIN_DOWN_TIMEOUT = 60.0 # sec, the stop sweep / stop spin gives up waiting
+STARTUP_TIMEOUT = 20.0 # sec, --startup-time reports what it has by then
+METRICS_INTERVAL = 1000 # milliseconds, refresh of the metrics panel
+METRICS_EXPORT_INTERVAL = 10000 # milliseconds, metrics written to InfluxDB
+
+log = wheel_log.getLogger("gui")
 
 class TargetButton(QPushButton):
     def __init__(self, text, parent=None):
@@ -75,12 +94,53 @@ class RDoubleSpinBox(QDoubleSpinBox):
         self.setStyleSheet("color: black;")
 
 
+class MetricsPanel(QWidget):
+    """Live view of metrics.REGISTRY, the latency per command and the error counters."""
+    def __init__(self, registry, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Metrics")
+        self.registry = registry
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        self.text.setMinimumSize(620, 360)
+        layout.addWidget(self.text)
+
+        self.bnReset = QPushButton("Reset")
+        self.bnReset.clicked.connect(self.Reset)
+        layout.addWidget(self.bnReset)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.Refresh)
+
+    def Refresh(self):
+        self.text.setPlainText(self.registry.format())
+
+    def Reset(self):
+        self.registry.reset()
+        self.Refresh()
+
+    def showEvent(self, event):
+        self.Refresh()
+        self.timer.start(METRICS_INTERVAL) # refreshed only while shown
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+
 #########################################################################################################
 #########################################################################################################
 #########################################################################################################
 #########################################################################################################
 class TargetWheelControl(QWidget):
-    def __init__(self):
+    def __init__(self, daemon=None, startup=None):
+        # daemon: (host, port) of a wheel_daemon to use instead of a controller connection of our own
+        # startup: StartupProfile of --startup-time, or None
         super().__init__()
         self.setWindowTitle("Target Wheel Control")
         # self.setStyleSheet("background-color : #FFD7FB")
@@ -94,41 +154,84 @@ class TargetWheelControl(QWidget):
         self.button_clicked_id = None # which target button is clicked
 
         self.influxToken = None
-        self.write_api = None
-
-        self.controller = Controller()
-
-        self.init_ui()
-
-        self.Load_program_setting()
-
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.Update_Position)
-        self.updateTimeInterval = DEFAULT_POS_UPDATE_INTERVAL  # milliseconds
-
-        self.Connect_Server()
+        self.influxWriter = None
+        self.controllers = [] # "controllers" of programSettings.json, for controller_pool, kept as is
+        self.lastStatus = None # "last_status" of programSettings.json, until a controller status comes in
+        self.logLevels = {}
+        self.startup = startup
+        self.metrics = metrics.REGISTRY # also recorded by the Controller of the worker, see metrics.py
+        self.metricsPanel = None
+        self.metricsTimer = QTimer()
+        self.metricsTimer.timeout.connect(self.ExportMetrics)
+
+        # all controller I/O runs in the acquisition worker thread, the GUI only sees snapshots
+        self.status = ControllerStatus()
+        self.daemon = daemon
+        if daemon is None:
+            self.worker = AcquisitionWorker() # poll rates follow self.state, see SetState
+        else:
+            self.worker = DaemonWorker(*daemon) # same signals, the daemon does the I/O
+        self.worker.telemetryReady.connect(self.OnTelemetry)
+        self.worker.statusReady.connect(self.OnStatusReady)
+        self.worker.commandFinished.connect(self.OnCommandFinished)
+        self.worker.connectionEvent.connect(self.OnConnectionEvent)
+
+        # the per-tick displays are only repainted when their text or style changed
+        self.renderer = WidgetRenderer()
+        self.renderTimer = QTimer()
+        self.renderTimer.timeout.connect(self.Render)
+        self.renderTimer.timeout.connect(self.UpdateInfluxStatus)
+        self.renderTimer.start(RENDER_INTERVAL)
 
-        self.timer.start(self.updateTimeInterval) 
         self.pauseUpdate = False
-        self.askPosFromEncoder = True
+        self.enableSignals = True
+        self.waiters = WaiterRegistry() # completion waits on the telemetry stream, see WaitFor
+        self.renderTimer.timeout.connect(self.waiters.checkTimeouts) # the timeouts fire without telemetry too, e.g. disconnected
+        self.spinDown = None # SpinDown of the stop sweep / stop spin in progress
+        self.motion = None # motion_profile Move / Ramp of the move in progress, see ExpectMotion
+        self.sequence = None # SequenceRunner of the target sequence in progress, see RunSequence
 
         self.isQX4Locking = False
         self.isAllSweepEnabled = False
 
         self.state = 0 # 0: idle, 1: spin, 2: sweep, 3: set target pos, 4: seek home
 
+        self.targetIndex = TargetIndex() # rebuilt whenever the target positions change, see UpdateTargetIndex
+
+        self.init_ui()
+        self.UpdateTargetIndex()
+
+        self.Load_program_setting() # shows the last known state until the controller answers
+
+        # the connect and status refresh run in the worker thread, the Influx probe in the writer
+        # thread, the window is shown meanwhile and they fill it in as they finish
+        self.worker.start()
+        self.Connect_Server()
+        QTimer.singleShot(0, self.StartInflux)
+        self.MarkStartup('constructed')
+
     def closeEvent(self, event: QCloseEvent):
-        if self.fileName is None or self.fileName == "":
-            self.save_targets_click()
-        else:
-            self.save_targets_info()
-        self.Save_program_settings()
-        self.controller.send_message("SK")
-        self.controller.send_message('IO7')
-        self.controller.send_message('RLO0') 
-        self.controller.disconnect()
+        measuring = self.startup is not None # a --startup-time run leaves the wheel, targets and settings as they are
+        if not measuring:
+            if self.fileName is None or self.fileName == "":
+                self.save_targets_click()
+            else:
+                self.save_targets_info()
+            self.Save_program_settings()
+        self.renderTimer.stop()
+        self.metricsTimer.stop()
+        if self.metricsPanel is not None:
+            self.metricsPanel.close()
+        self.waiters.cancelAll()
+        if self.daemon is None and not measuring: # the daemon keeps the wheel going for its other clients
+            self.worker.submit('send_message', "SK")
+            self.worker.submit('send_message', 'IO7')
+            self.worker.submit('send_message', 'RLO0')
+        self.worker.shutdown() # disconnect and wait for the worker thread to end
+        if self.influxWriter is not None:
+            self.influxWriter.stop() # flush, or spool, what is still queued
         event.accept()  # Optional: confirm you want to close
-        print("============= Program Ended.")
+        log.info("============= Program Ended.")
 
     ######################################################################################## GUI
     def init_ui(self):
@@ -243,6 +346,11 @@ class TargetWheelControl(QWidget):
         self.fileNameLineEdit.setReadOnly(True)
         target_layout.addWidget(self.fileNameLineEdit, row, 5, 1, 5)
 
+        row += 1
+        self.bnSequence = QPushButton("Run Sequence")
+        self.bnSequence.clicked.connect(self.RunSequence)
+        target_layout.addWidget(self.bnSequence, row, 1, 1, 4)
+
         #&########## Servers
         server_group = QGroupBox("Servers")
         server_layout = QGridLayout()
@@ -273,6 +381,10 @@ class TargetWheelControl(QWidget):
         server_layout.addWidget(QLabel("Token File:"), 5, 0)
         server_layout.addWidget(self.leinfluxToken, 5, 1, 1, 5)
 
+        self.bnMetrics = QPushButton("Metrics")
+        self.bnMetrics.clicked.connect(self.ShowMetrics)
+        server_layout.addWidget(self.bnMetrics, 6, 4, 1, 2)
+
         #&########## Indicator for Sweeping
         self.indicator = QPushButton("")
         self.indicator.setEnabled(False)
@@ -402,6 +514,7 @@ class TargetWheelControl(QWidget):
         row = 0
         self.leSendMsg = QLineEdit()
         self.leSendMsg.returnPressed.connect(self.Send_Message)
+        self.leSendMsg.setCompleter(QCompleter(commands.names()))  # see commands.py
         manual_layout.addWidget(QLabel("Send CMD : "), row, 0)
         manual_layout.addWidget(self.leSendMsg, row, 1, 1, 2)
 
@@ -548,7 +661,7 @@ class TargetWheelControl(QWidget):
     ################################################################################################################
     def Load_program_setting(self):
         if not os.path.exists("programSettings.json"):
-            print("programSettings.json not found, creating default.")
+            log.info("programSettings.json not found, creating default.")
             default = [{"IP": "192.168.0.1", "Port": 7776, "target_file": "",
                         "url": "http://localhost:8086", "bucket": "", "org": "", "token_file": ""}]
             with open("programSettings.json", "w") as file:
@@ -558,11 +671,14 @@ class TargetWheelControl(QWidget):
             with open("programSettings.json", "r") as file:
                 data = json.load(file)[0]
         except (FileNotFoundError, json.JSONDecodeError, IndexError) as e:
-            print(f"Error loading programSettings.json: {e}")
+            log.warning("Error loading programSettings.json: %s", e)
             return
 
         self.leIP.setText(data["IP"])
         self.lePort.setText(str(data["Port"]))
+        self.controllers = data.get("controllers", [])
+        self.logLevels = data.get("log_levels", {}) # per category, see wheel_log
+        wheel_log.setLevels(self.logLevels)
 
         self.fileName = data["target_file"]
         self.fileNameLineEdit.setText(self.fileName)
@@ -578,44 +694,85 @@ class TargetWheelControl(QWidget):
             try:
                 with open(token_file, "r") as tf:
                     self.influxToken = tf.read().strip()
-                    print(f"Loaded InfluxDB token from '{token_file}'.")
+                    log.info("Loaded InfluxDB token from '%s'.", token_file)
             except Exception as e:
-                print(f"Could not read token file '{token_file}': {e}")
+                log.warning("Could not read token file '%s': %s", token_file, e)
                 self.influxToken = None
                 self.leinfluxToken.setText("Fail to load token file.")
         else:
             self.influxToken = None
             self.leinfluxToken.setText("No token file specified.")
 
-        if self.influxToken is not None:
-            self.write_client = InfluxDBClient(
-                url=self.leinfluxAddress.text(),
-                org=self.leinfluxOrg.text(),
-                token=self.influxToken)
-            self.write_api = self.write_client.write_api(write_options=SYNCHRONOUS)
+        self.lastStatus = data.get("last_status")
+        if self.lastStatus:
+            self.ShowLastStatus()
 
-            try:
-                # quick write test to verify connectivity and bucket/org access
-                test_point = Point("connection_test").field("value", 1)
-                self.write_api.write(bucket=self.leinfluxBucket.text(), org=self.leinfluxOrg.text(), record=test_point)
-                print("InfluxDB: connection and write test succeeded.")
-            except Exception as e:
-                print(f"InfluxDB: connection or write test failed: {e}")
-                self.write_api = None
+    def StartInflux(self):
+        if self.influxToken is None:
+            return
+        # batches, spools while the server is down and replays, all in its own thread,
+        # the client import and the first ping are done there too, see UpdateInfluxStatus
+        self.influxWriter = InfluxWriter(
+            url=self.leinfluxAddress.text(),
+            org=self.leinfluxOrg.text(),
+            bucket=self.leinfluxBucket.text(),
+            token=self.influxToken)
+        self.influxWriter.start()
+        self.metricsTimer.start(METRICS_EXPORT_INTERVAL)
+        if self.startup is not None:
+            self.startup.expected.append('influx')
+
+    def ExportMetrics(self):
+        if self.influxWriter is not None:
+            self.metrics.writeInflux(self.influxWriter)
+
+    def ShowMetrics(self):
+        if self.metricsPanel is None:
+            self.metricsPanel = MetricsPanel(self.metrics)
+        self.metricsPanel.show()
+        self.metricsPanel.raise_()
+
+    def Render(self): # renderTimer
+        if not self.renderer.isDirty():
+            return
+        start = time.perf_counter()
+        self.renderer.flush()
+        self.metrics.record('gui.render', time.perf_counter() - start)
+
+    def OnTelemetry(self, telemetry): # telemetryReady, timed apart from the I/O, which the worker records as 'poll'
+        start = time.perf_counter()
+        self.Update_Position(telemetry)
+        self.metrics.record('gui.update', time.perf_counter() - start)
+
+    def UpdateInfluxStatus(self):
+        if self.influxWriter is None or not self.influxWriter.probed.is_set():
+            return
+        self.renderer.setStyleSheet(self.leinfluxAddress, "" if self.influxWriter.online else "color: red;")
+        self.MarkStartup('influx')
+
+    def MarkStartup(self, name):
+        if self.startup is not None:
+            self.startup.mark(name)
 
     def Save_program_settings(self):
-        print(f"Save program settings to programSettings.json")
+        log.info("Save program settings to programSettings.json")
         try:
             port = int(self.lePort.text())
         except ValueError:
             port = 7776
+        if self.status.connected: # else keep the one loaded, the controller was not reached this time
+            self.lastStatus = {key: value for key, value in asdict(self.status).items()
+                               if key not in ('connected', 'isQX4Updated')}
         data = [{"IP": self.leIP.text(),
                  "Port": port,
                  "target_file" : self.fileName if self.fileName else "",
                  "url": self.leinfluxAddress.text(),
                  "bucket": self.leinfluxBucket.text(),
                  "org": self.leinfluxOrg.text(),
-                 "token_file": self.leinfluxToken.text()
+                 "token_file": self.leinfluxToken.text(),
+                 "controllers": self.controllers,
+                 "last_status": self.lastStatus,
+                 "log_levels": self.logLevels
                 }]
         with open("programSettings.json", "w") as file:
             json.dump(data, file, indent=2)
@@ -624,17 +781,51 @@ class TargetWheelControl(QWidget):
         ip = self.leIP.text().strip()
         port_text = self.lePort.text().strip()
         if not ip or not port_text:
-            print("IP or Port is empty, skipping connection.")
+            log.info("IP or Port is empty, skipping connection.")
             return
         try:
             port = int(port_text)
         except ValueError:
-            print(f"Invalid port: '{port_text}'")
+            log.warning("Invalid port: '%s'", port_text)
             return
-        self.controller.Connect(ip, port)
-        self.enableSignals = False  # Disable signals-slots during connection
-        self.Display_Status()
-        self.enableSignals = True  # Enable signals-slots after connection
+        self.worker.submit('connect', ip, port)  # Display_Status when the connect is finished
+
+    def SetState(self, state):
+        # 0: idle, 1: spin, 2: sweep, 3: set target pos, 4: seek home
+        if self.spinDown is not None and state != self.state:
+            self.spinDown.cancel()  # another action took over
+        self.state = state
+        self.worker.submit('setState', state)  # per register poll rates, see poll_scheduler
+
+    def OnStatusReady(self, status):
+        self.status = status
+        if status.isQX4Updated:
+            self.UpdateQX4ParametersFromMemory()
+
+    def OnConnectionEvent(self, event): # the worker reconnects by itself, see connection_manager
+        if event.state == 'disconnected':
+            self.message.setText(f"Connection lost. {event.error}")
+        elif event.state == 'reconnecting':
+            self.message.setText(f"Reconnecting in {event.delay:.1f} s (attempt {event.attempt})...")
+        elif event.state == 'connected' and event.downtime > 0:
+            self.message.setText(f"Reconnected after {event.downtime:.1f} s.")
+            self.worker.submit('getStatus', tag='reconnect')
+
+    def OnCommandFinished(self, name, result, tag):
+        if name == 'connect' or tag == 'reconnect':
+            self.MarkStartup('connect')
+            self.enableSignals = False  # Disable signals-slots during connection
+            self.Display_Status()
+            self.enableSignals = True  # Enable signals-slots after connection
+        elif name == 'getStatus':
+            self.Display_Status()
+        elif name in ('stopSpinSweep', 'stopSpin') and self.spinDown is not None:
+            # the spin down is timed from when the controller got the stop
+            self.spinDown.start(self.status.motorVelocity)
+            QTimer.singleShot(int(self.spinDown.timeout * 1000) + 50, self.spinDown.checkTimeout)
+            self.ExpectMotion(jogRamp(self.status, self.status.motorVelocity / 60., 0), ('RUw1', 'IO'), "Stopping")
+        elif tag == 'manual':
+            self.leGetMsg.setText(result if result else "")
 
     #========================================================================================
     def SetEnableGeneralControl(self, enable):
@@ -680,306 +871,286 @@ class TargetWheelControl(QWidget):
 
     #========================================================================================
     def Update_Status(self):
-        if self.controller.connected:
-            self.pauseUpdate = True
-            self.controller.getStatus()
-            self.Display_Status()
-            self.pauseUpdate = False
+        if self.status.connected:
+            self.worker.submit('getStatus')  # Display_Status when the refresh is finished
 
     def Display_Status(self):
-        if self.controller.connected:
-            print("Update Status.")
-
-            print(f"Position: {self.controller.position}, Accel: {self.controller.accelRate}, ")
-            print(f"Deaccel: {self.controller.deaccelRate}, Speed: {self.controller.velocity}, " +
-                  f"Move Distance: {self.controller.moveDistance}, Jog Speed: {self.controller.jogSpeed}, " +
-                  f"Jog Accel: {self.controller.jogAccel}, Sweep Mask: {bin(self.controller.sweepMask)}")
-            print(f"Sweep Offset: {self.controller.spokeOffset}, Spoke Width: {self.controller.spokeWidth}, " +  
-                   f"Sweep Speed: {self.controller.sweepSpeed}, Sweep Cut Off: {self.controller.sweepCutOff}")
-
-            self.EncoderPos.setText(f"{self.controller.position}")
-            self.EncoderModPos.setText(f"{self.controller.position%STEP_PER_REVOLUTION:.0f}")
-            self.EncoderRev.setText(f"{self.controller.position/STEP_PER_REVOLUTION:.2f} [rev]")
-            self.spAccel.setValue(self.controller.accelRate)
-            self.spDeccel.setValue(self.controller.deaccelRate)
-            self.spSpeed.setValue(self.controller.velocity)
-            self.statusSpeed.setText(f"{self.controller.velocity*60:.1f}")
-
-            self.spSpinSpeed.setValue(self.controller.jogSpeed*60.)
-            # self.statusSpinSpeed.setText(f"{self.controller.jogSpeed*60:.1f}")
-            self.spSpinAccel.setValue(self.controller.jogAccel)
-            if self.controller.moveDistance >= 0 :
-                self.cbDirection.setCurrentIndex(0)  # Clockwise
-            else:
-                self.cbDirection.setCurrentIndex(1)
-
-            #=== check current position and set the corresponding 
-            self.UpdateButtonsColor()
+        if self.status.connected:
+            log.info("Update Status.")
 
-            #==== sweep parameters
-            self.spSpokeWidth.setValue(self.controller.spokeWidth)
-            self.spSpokeOffset.setValue(self.controller.spokeOffset)
-            self.spSweepSpeed.setValue(self.controller.sweepSpeed)
-            self.statusSweepSpeed.setText(f"{self.controller.sweepSpeed/60.:.1f}")
-            self.spSweepCutOff.setValue(self.controller.sweepCutOff)
-            self.SetTargetPositionBaseOnSpokeOffset()
-
-            self.SetMaxSweepSpeed()
-
-            #=== sweep mask
-            for i in range(NTARGET):
-                bitPos = 15 - i
-                if self.controller.sweepMask & (1 << bitPos):
-                    self.target_chkBox[i].setChecked(True)
-            if self.controller.sweepMask == (1 << 16) - 1:
-                self.isAllSweepEnabled = True
-                self.chkAll.setStyleSheet("background-color: green")
-                self.chkAll.setText("Disable All")
-
-            #=== other status
-            self.statusTemp.setText(f"{self.controller.temperature:.1f}")
-            self.statusEncVel.setText(f"{self.controller.encoderVelocity:.2f}")
-            self.statusMotVel.setText(f"{self.controller.motorVelocity:.2f}")
-            self.statusTorque.setText(f"{self.controller.torque:.2f}")
-            
-            #=== QX4
-            self.UpdateQX4ParametersFromMemory()
+            log.info("Position: %s, Accel: %s, Deaccel: %s, Speed: %s, Move Distance: %s, Jog Speed: %s, "
+                     "Jog Accel: %s, Sweep Mask: %s", self.status.position, self.status.accelRate,
+                     self.status.deaccelRate, self.status.velocity, self.status.moveDistance,
+                     self.status.jogSpeed, self.status.jogAccel, bin(self.status.sweepMask))
+            log.info("Sweep Offset: %s, Spoke Width: %s, Sweep Speed: %s, Sweep Cut Off: %s",
+                     self.status.spokeOffset, self.status.spokeWidth, self.status.sweepSpeed, self.status.sweepCutOff)
 
-            #=== IO status
-            self.ioStatus.setText(bin(int(self.controller.io_status)))
+            self._showStatus()
 
             #=== FW program status
-            fw_status = self.controller.FWprogram
+            fw_status = self.status.FWprogram
 
             if fw_status > 0 and fw_status < 4: # QX1 is running, i.e. the sweeping is on
-                print("QX1 sweeping is running.")
+                log.info("QX1 sweeping is running.")
                 self.SetEnableGeneralControl(False)
                 self.setEnableSpinControl(False)
                 self.setEnableSweepControl(False, True)
                 self.setEnableTargetControl(False)
-
-                
-                self.updateTimeInterval = 300  # milliseconds
-                self.timer.stop()
-                self.timer.start(self.updateTimeInterval)
+                self.SetState(2)  # Sweeping and Spinning
 
             if fw_status == 4: # QX4 is running, i.e. the position locking is on
-                print("QX4 position locking is running. kill it.")
-                self.controller.stopQX4LockPosition()
+                log.info("QX4 position locking is running. kill it.")
+                self.worker.submit('stopQX4LockPosition')
+
+    def ShowLastStatus(self):
+        # the state saved at the last exit, shown until the controller answers
+        names = {f.name for f in fields(ControllerStatus)}
+        try:
+            last = ControllerStatus(**{key: value for key, value in self.lastStatus.items() if key in names})
+        except TypeError as e:
+            log.warning("Ignoring last_status of programSettings.json: %s", e)
+            return
+        self.status = replace(last, connected=False, isQX4Updated=False, FWprogram=0)
+        self.enableSignals = False
+        self._showStatus()
+        self.enableSignals = True
+        self.message.setText("Last known state, connecting...")
+
+    def _showStatus(self):
+        self._updatePositionDisplay()
+        self.spAccel.setValue(self.status.accelRate)
+        self.spDeccel.setValue(self.status.deaccelRate)
+        self.spSpeed.setValue(self.status.velocity)
+        self.statusSpeed.setText(f"{self.status.velocity*60:.1f}")
+
+        self.spSpinSpeed.setValue(self.status.jogSpeed*60.)
+        # self.statusSpinSpeed.setText(f"{self.status.jogSpeed*60:.1f}")
+        self.spSpinAccel.setValue(self.status.jogAccel)
+        if self.status.moveDistance >= 0 :
+            self.cbDirection.setCurrentIndex(0)  # Clockwise
+        else:
+            self.cbDirection.setCurrentIndex(1)
+
+        #=== check current position and set the corresponding 
+        self.UpdateButtonsColor()
+
+        #==== sweep parameters
+        self.spSpokeWidth.setValue(self.status.spokeWidth)
+        self.spSpokeOffset.setValue(self.status.spokeOffset)
+        self.spSweepSpeed.setValue(self.status.sweepSpeed)
+        self.statusSweepSpeed.setText(f"{self.status.sweepSpeed/60.:.1f}")
+        self.spSweepCutOff.setValue(self.status.sweepCutOff)
+        self.SetTargetPositionBaseOnSpokeOffset()
+
+        self.SetMaxSweepSpeed()
+
+        #=== sweep mask
+        for i in range(NTARGET):
+            bitPos = 15 - i
+            if self.status.sweepMask & (1 << bitPos):
+                self.target_chkBox[i].setChecked(True)
+        if self.status.sweepMask == (1 << 16) - 1:
+            self.isAllSweepEnabled = True
+            self.chkAll.setStyleSheet("background-color: green")
+            self.chkAll.setText("Disable All")
+
+        #=== other status
+        self.renderer.setText(self.statusTemp, f"{self.status.temperature:.1f}")
+        self.renderer.setText(self.statusEncVel, f"{self.status.encoderVelocity:.2f}")
+        self.renderer.setText(self.statusMotVel, f"{self.status.motorVelocity:.2f}")
+        self.renderer.setText(self.statusTorque, f"{self.status.torque:.2f}")
+        
+        #=== IO status
+        self.renderer.setText(self.ioStatus, bin(int(self.status.io_status)))
 
     def UpdateQX4ParametersFromMemory(self):
-        if self.controller.connected and self.controller.isQX4Updated:
-            self.qx4SetPos.setText(f"{self.controller.qx4EncoderDemandPos}")
-            self.qx4UpdateInterval.setText(f"{self.controller.qx4ControUpdate}")
-            self.qx4SlewSpeed.setText(f"{self.controller.qx4SlewSpeed}")
-            self.qx4ServoSpeed.setText(f"{self.controller.qx4ServoSlewSpeed}")
-            self.qx4MotorPos.setText(f"{self.controller.qx4MotorDemandPos}")
-            self.controller.isQX4Updated = False
+        if self.status.connected:
+            self.qx4SetPos.setText(f"{self.status.qx4EncoderDemandPos}")
+            self.qx4UpdateInterval.setText(f"{self.status.qx4ControUpdate}")
+            self.qx4SlewSpeed.setText(f"{self.status.qx4SlewSpeed}")
+            self.qx4ServoSpeed.setText(f"{self.status.qx4ServoSlewSpeed}")
+            self.qx4MotorPos.setText(f"{self.status.qx4MotorDemandPos}")
 
     def UpdateOtherStatus(self):
-        if self.controller.connected:
-            if self.askPosFromEncoder:
-                self.controller.getTemperature(False)
-                self.controller.getEncoderVelocity(False)
-                self.controller.getMotorVelocity(False)
-                self.controller.getTorque(False)
-            self.statusTemp.setText(f"{self.controller.temperature:.1f}")
-            self.statusEncVel.setText(f"{self.controller.encoderVelocity:.3f}")
-            self.statusMotVel.setText(f"{self.controller.motorVelocity:.3f}")
-            self.statusTorque.setText(f"{self.controller.torque:.2f}")
+        if self.status.connected:
+            self.renderer.setText(self.statusTemp, f"{self.status.temperature:.1f}")
+            self.renderer.setText(self.statusEncVel, f"{self.status.encoderVelocity:.3f}")
+            self.renderer.setText(self.statusMotVel, f"{self.status.motorVelocity:.3f}")
+            self.renderer.setText(self.statusTorque, f"{self.status.torque:.2f}")
+
+    def UpdateTargetIndex(self):
+        self.targetIndex.setPositions([int(pos.text()) for pos in self.target_pos])
+        self.targetIndex.names = [btn.text() for btn in self.target_buttons]
 
     def UpdateButtonsColor(self, tolerance = 10): # step
-        current_pos = self.controller.position #absolute position
-        # print(f"Current absolute position: {current_pos}, mod: {current_pos%STEP_PER_REVOLUTION:.0f}")
-        
         target_Boundary_width = STEP_PER_REVOLUTION/NTARGET
-        
-        for i, pos in enumerate(self.target_pos):
-            target_pos = int(pos.text())
-            target_pos = self.controller.ConvertModPositionToAbsolute(target_pos)
 
-            if abs(current_pos - target_pos) < target_Boundary_width/2:
-                self.target_buttons[i].setStyleSheet("background-color: yellow") 
-            else:
-                self.target_buttons[i].setStyleSheet("")
+        # nearest target from the lookup table, see UpdateTargetIndex
+        nearest, distance = self.targetIndex.nearest(self.status.position)
+
+        for i, button in enumerate(self.target_buttons):
+            style = ""
+            if i == nearest:
+                if distance <= tolerance:
+                    style = "background-color: green"
+                    self.button_clicked_id = i
+                elif distance < target_Boundary_width/2:
+                    style = "background-color: yellow"
 
-            if abs(current_pos - target_pos) <= tolerance:
-                self.target_buttons[i].setStyleSheet("background-color: green") 
-                self.button_clicked_id = i
+            self.renderer.setStyleSheet(button, style)
 
-    def Update_Position(self): # see self.updateTimeInterval
-        if not self.controller.connected:
-            self.indicator.setStyleSheet("background-color: red")
+    def Update_Position(self, telemetry): # telemetryReady from the worker, see poll_scheduler
+        self.status = self.status.withTelemetry(telemetry)
+        if not telemetry.connected:
+            self.renderer.setStyleSheet(self.indicator, "background-color: red")
             return
+        if telemetry.valid:
+            self.MarkStartup('telemetry')
 
-        if not self.pauseUpdate:
-            if self.askPosFromEncoder:
-                self.controller.getPosition(False)
-                self.controller.getIOStatus()
-            self.EncoderPos.setText(f"{self.controller.position}") 
-            self.EncoderModPos.setText(f"{self.controller.position%STEP_PER_REVOLUTION:.0f}")
-            self.EncoderRev.setText(f"{self.controller.position/STEP_PER_REVOLUTION:.2f} [rev]")
+        self.waiters.feed(telemetry)
+        if self.spinDown is not None:
+            self.spinDown.feed(telemetry)
 
-            self.ioStatus.setText(bin(int(self.controller.io_status)))
+        self._updatePositionDisplay() # also while paused, waiting for the wheel to settle
+        if not self.pauseUpdate:
+            self.renderer.setText(self.ioStatus, bin(int(self.status.io_status)))
 
             self.UpdateOtherStatus()
             #if ModPos is close to a target, change the button color
             self.UpdateButtonsColor()
             # self.UpdateStateButtons()
 
-            if self.write_api is not None:
-                points = []
-                points.append(Point("Torque").field("value", self.controller.torque))
-                self.write_api.write(bucket=self.leinfluxBucket.text(), org=self.leinfluxOrg.text(), record=points)
+            if self.influxWriter is not None and telemetry.valid:
+                self.influxWriter.writeTelemetry(telemetry)
 
             ## checking sweeping, green indicator when sweeping at set speed, yello when spinning up or down, blue is standby (not sweeping)
             ## by comparing the encoder velocity and the set sweeping speed
             # print(f"Current state: {self.state}")
             if self.state == 2: # QX1 is running, i.e. the sweeping is on
-                enc_vel = self.controller.motorVelocity
-                sweep_speed_rps = self.controller.sweepSpeed
+                enc_vel = self.status.motorVelocity
+                sweep_speed_rps = self.status.sweepSpeed
                 # print(f"Sweeping: enc_vel = {enc_vel:.2f} rpm, sweep_speed_rps = {sweep_speed_rps:.2f} rpm")
                 if abs(enc_vel - sweep_speed_rps) < 0.1 * sweep_speed_rps:
-                    self.indicator.setStyleSheet("background-color: green")  # Sweeping at set speed
+                    self.renderer.setStyleSheet(self.indicator, "background-color: green")  # Sweeping at set speed
                 else:
-                    self.indicator.setStyleSheet("background-color: yellow")  # Spinning up or down
+                    self.renderer.setStyleSheet(self.indicator, "background-color: yellow")  # Spinning up or down
             elif self.state == 1: 
                 # when it is spinging, also compare the spinning speed with the encoder velocity
                 spin_speed_rps = self.spSpinSpeed.value()
-                # print(f"Spinning: enc_vel = {self.controller.motorVelocity:.2f} rpm, spin_speed_rps = {spin_speed_rps:.2f} rpm")
-                diff = abs(self.controller.motorVelocity - spin_speed_rps)
+                # print(f"Spinning: enc_vel = {self.status.motorVelocity:.2f} rpm, spin_speed_rps = {spin_speed_rps:.2f} rpm")
+                diff = abs(self.status.motorVelocity - spin_speed_rps)
                 if diff < 0.1 * spin_speed_rps and spin_speed_rps > 0:
-                    self.indicator.setStyleSheet("background-color: green")  # Spinning at set speed
+                    self.renderer.setStyleSheet(self.indicator, "background-color: green")  # Spinning at set speed
                 else:
-                    self.indicator.setStyleSheet("background-color: yellow")  # Spinning up or down
+                    self.renderer.setStyleSheet(self.indicator, "background-color: yellow")  # Spinning up or down
             else:
-                self.indicator.setStyleSheet("background-color: blue")  # QX4 locking
-
-            QApplication.processEvents()  # Process events to update the UI
+                self.renderer.setStyleSheet(self.indicator, "background-color: blue")  # QX4 locking
 
     #======================================================================================== General Control
     def SetAccel(self):
         if self.enableSignals:
             accel = self.spAccel.value()
-            self.controller.setAccelRate(accel)
-            print(f"Acceleration set to {accel:.3f} [r/s^2]")
+            self.worker.submit('setAccelRate', accel)
+            log.info("Acceleration set to %.3f [r/s^2]", accel)
     
     def SetSpeed(self):
         if self.enableSignals:
             speed = self.spSpeed.value()
-            self.controller.setVelocity(speed)
+            self.worker.submit('setVelocity', speed)
             self.statusSpeed.setText(f"{speed*60:.1f} [rpm]")
-            print(f"Speed set to {speed:.1f} [r/s] = {speed*60:.1f} [rpm]")
+            log.info("Speed set to %.1f [r/s] = %.1f [rpm]", speed, speed*60)
 
     def SetDeaccel(self):
         if self.enableSignals:
             deaccel = self.spDeccel.value()
-            self.controller.setDeaccelRate(deaccel)
-            print(f"Deacceleration set to {deaccel:.3f} [r/s^2]")
+            self.worker.submit('setDeaccelRate', deaccel)
+            log.info("Deacceleration set to %.3f [r/s^2]", deaccel)
 
     def _updatePositionDisplay(self):
-        self.EncoderPos.setText(f"{self.controller.position}")
-        self.EncoderModPos.setText(f"{self.controller.position%STEP_PER_REVOLUTION:.0f}")
-        self.EncoderRev.setText(f"{self.controller.position/STEP_PER_REVOLUTION:.2f} [rev]")
-
-    def CheckPostionStable(self, on_complete=None, wait_time=10, update_interval=200, stable_threshold=5):
-        if not self.controller.connected:
-            return
+        self.renderer.setText(self.EncoderPos, f"{self.status.position}")
+        self.renderer.setText(self.EncoderModPos, f"{self.status.position%STEP_PER_REVOLUTION:.0f}")
+        self.renderer.setText(self.EncoderRev, f"{self.status.position/STEP_PER_REVOLUTION:.2f} [rev]")
 
-        self.pauseUpdate = True
-        self._stability_ctx = {
-            'start_time': time.time(),
-            'old_position': self.controller.position,
-            'stable_count': 0,
-            'wait_time': wait_time,
-            'stable_threshold': stable_threshold,
-            'on_complete': on_complete,
-        }
-        self._stabilityTimer = QTimer(self)
-        self._stabilityTimer.timeout.connect(self._checkStabilityTick)
-        self._stabilityTimer.start(update_interval)
-
-    def _checkStabilityTick(self):
-        ctx = self._stability_ctx
-        self.controller.getPosition()
-        self._updatePositionDisplay()
+    def WaitFor(self, predicate, timeout=None, name=""):
+        """concurrent.futures.Future resolved from the telemetry stream, see waiters.py.
 
-        current_position = self.controller.position
-        print(f"Current position: {current_position}, Old position: {ctx['old_position']} | count : {ctx['stable_count']}")
+        The done callbacks run in the GUI thread, from Update_Position or the render timer for the timeouts.
+        """
+        return self.waiters.wait(predicate, timeout, name)
 
-        if abs(current_position - ctx['old_position']) < 1:
-            ctx['stable_count'] += 1
-            if ctx['stable_count'] >= ctx['stable_threshold']:
-                print("Position Stable.")
-                self._finishStabilityCheck()
-                return
-        else:
-            ctx['stable_count'] = 0
-        ctx['old_position'] = current_position
+    def ExpectMotion(self, profile, keys=('RUe1',), what=""):
+        """Poll keys densely around the predicted end of profile (motion_profile) only, and show the ETA."""
+        self.motion = profile
+        if not math.isfinite(profile.eta):
+            return
+        self.worker.submit('expect', profile.eta, keys)
+        if what:
+            self.message.setText(f"{what}, ETA {profile.remaining():.1f} s.")
 
-        if time.time() - ctx['start_time'] >= ctx['wait_time']:
-            print("Home position not found within timeout.")
-            self._finishStabilityCheck()
+    def CheckPostionStable(self, on_complete=None, wait_time=10, stable_threshold=5):
+        # stable when the last stable_threshold position reads did not move
+        if not self.status.connected:
+            return
 
-    def _finishStabilityCheck(self):
-        self._stabilityTimer.stop()
-        self._stabilityTimer.deleteLater()
+        self.pauseUpdate = True
+        future = self.WaitFor(positionStable(stable_threshold), wait_time, "position stable")
+        future.add_done_callback(lambda f: self._finishStabilityCheck(f, on_complete))
 
-        self.controller.getPosition()
-        self._updatePositionDisplay()
+    def _finishStabilityCheck(self, future, on_complete):
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            log.info("Position Stable at %s.", future.result().position)
+        else:
+            log.warning("Home position not found within timeout.")
 
         self.pauseUpdate = False
-        self.updateTimeInterval = DEFAULT_POS_UPDATE_INTERVAL
-        self.timer.stop()
-        self.timer.start(self.updateTimeInterval)
-        print("End of check position stable.")
+        log.info("End of check position stable.")
 
-        on_complete = self._stability_ctx.get('on_complete')
-        self._stability_ctx = None
         if on_complete:
             on_complete()
 
     def SeekHome(self):
-        if self.controller.connected:
+        if self.status.connected:
             self.SetEnableGeneralControl(False)
             self.setEnableSpinControl(False)
             self.setEnableSweepControl(False)
-            self.state = 4
-            self.controller.seekHome()
+            self.SetState(4)  # fast position polling for the stability check
+            self.worker.submit('seekHome')
+            self.ExpectMotion(seekHomeMove(self.status), what="Seeking home")
             self.CheckPostionStable(on_complete=self._onSeekHomeComplete)
 
     def _onSeekHomeComplete(self):
-        self.state = 0
+        self.worker.submit('clearExpectation')
+        if self.motion is not None:
+            log.info("Seek home done, predicted %.2f s.", self.motion.duration)
+        self.SetState(0)
         self.SetEnableGeneralControl(True)
         self.setEnableSpinControl(True)
         self.setEnableSweepControl(True)
             
             
     def ZeroEncoderPosition(self):
-        if self.controller.connected:
-            print("Resetting encoder position to 0...")
-            self.controller.setEncoderPosition(0)  # Set the encoder position to 0
-            time.sleep(0.1)  
-            self.controller.getPosition()
-            self.EncoderPos.setText(f"{self.controller.position}") 
-            self.EncoderModPos.setText(f"{self.controller.position%STEP_PER_REVOLUTION:.0f}")
-            self.EncoderRev.setText(f"{self.controller.position/STEP_PER_REVOLUTION:.2f} [rev]")
-            QApplication.processEvents()  # Process events to update the UI
+        if self.status.connected:
+            log.info("Resetting encoder position to 0...")
+            self.worker.submit('setEncoderPosition', 0)  # Set the encoder position to 0, the next poll shows it
 
 
     def Send_Message(self):
-        self.timer.stop()  # Stop the timer to prevent updates during message sending
-        self.leGetMsg.setText(self.controller.send_message(self.leSendMsg.text()))
+        # the reply is shown by OnCommandFinished
+        message = self.leSendMsg.text().strip()
+        if commands.isValid(message):
+            self.worker.submit('send_message', message, tag='manual')
+        else:
+            self.leGetMsg.setText("invalid message")  # not in the command table, not sent
         self.leSendMsg.selectAll()
-        time.sleep(0.1)  # Wait a bit to ensure the command is processed
-        self.timer.start(self.updateTimeInterval)  # Restart the timer with the original interval
 
     #======================================================================================== Target Control
     def Target_picked(self, id):
         if self.target_buttons[id].isChangeNameMode:
             self.target_names[id] = self.target_buttons[id].name
-            print(f"Change Target Name: {self.target_names[id]}, id : {id}")
-            QApplication.processEvents()  # Process events to update the UI
+            self.targetIndex.names[id] = self.target_names[id]
+            log.info("Change Target Name: %s, id : %s", self.target_names[id], id)
             return
 
         # Remove focus from all buttons after click
@@ -987,9 +1158,9 @@ class TargetWheelControl(QWidget):
 
         #=== change color
         if  self.button_clicked_id != id:
-            self.target_buttons[id].setStyleSheet("background-color: green")
+            self.renderer.setStyleSheet(self.target_buttons[id], "background-color: green")
             if self.button_clicked_id is not None:
-                self.target_buttons[self.button_clicked_id].setStyleSheet("")
+                self.renderer.setStyleSheet(self.target_buttons[self.button_clicked_id], "")
 
             self.button_clicked_id = id
 
@@ -998,13 +1169,18 @@ class TargetWheelControl(QWidget):
         
         if self.isQX4Locking :
             self.qx4SetPos.setText(f"{target_position}")
-            self.controller.setQX4EncoderDemandPos(target_position)
+            self.worker.submit('setQX4EncoderDemandPos', target_position)
+            start = time.monotonic()
 
         else: #start QX4 locking
             self.bnLockPos.click()
-            time.sleep(1.0)  # Wait a bit to ensure the command is processed
+            self.worker.submit('sleep', 1.0)  # Wait a bit in the worker to ensure the command is processed
             self.qx4SetPos.setText(f"{target_position}")
-            self.controller.setQX4EncoderDemandPos(target_position)
+            self.worker.submit('setQX4EncoderDemandPos', target_position)
+            start = time.monotonic() + 1.0
+
+        self.ExpectMotion(qx4Slew(self.status, target_position, now=start),
+                          what=f"Moving to target position {target_position}")
 
 
     def SetPosition(self, id):
@@ -1025,34 +1201,38 @@ class TargetWheelControl(QWidget):
             self.target_pos[idx].setText(f"{int(pp)}")
             self.target_rev[idx].setText(f"{pp / STEP_PER_REVOLUTION:.2f}")
 
+        self.UpdateTargetIndex()
+
         if self.isQX4Locking:
             self.qx4SetPos.setText(f"{pos}")
-            self.controller.setQX4EncoderDemandPos(int(pos))
+            self.worker.submit('setQX4EncoderDemandPos', int(pos))
 
     def Sweep_picked(self, id):
-        self.timer.stop()  # Stop the timer to prevent updates during sweep selection
-        print("Old Sweep Mask: %s | 0x%04X | %d" % (bin(self.controller.sweepMask), self.controller.sweepMask, self.controller.sweepMask ))
+        mask = self.status.sweepMask
+        log.info("Old Sweep Mask: %s | 0x%04X | %d", bin(mask), mask, mask)
         bitPos = 15 - id
         if self.target_chkBox[id].isChecked():
-            print(f"Sweep Target : {self.target_names[id]}, id : {id}")
-            self.controller.sweepMask |= (1 << bitPos)  # Set the bit for the target
+            log.info("Sweep Target : %s, id : %s", self.target_names[id], id)
+            mask |= (1 << bitPos)  # Set the bit for the target
         else:
-            print(f"Uncheck Sweep Target : {self.target_names[id]}, id : {id}")
-            self.controller.sweepMask &= ~(1 << bitPos)  # Unset the bit for the target
+            log.info("Uncheck Sweep Target : %s, id : %s", self.target_names[id], id)
+            mask &= ~(1 << bitPos)  # Unset the bit for the target
 
-        print("New Sweep Mask: %s | 0x%04X | %d" % (bin(self.controller.sweepMask), self.controller.sweepMask, self.controller.sweepMask))
+        log.info("New Sweep Mask: %s | 0x%04X | %d", bin(mask), mask, mask)
 
         if self.isAllSweepEnabled:
             self.isAllSweepEnabled = False
             self.chkAll.setStyleSheet("")
             self.chkAll.setText("Enable All")
 
-        self.controller.setSweepMask(self.controller.sweepMask)
-        time.sleep(0.1)  # Wait a bit to ensure the command is processed
-        self.timer.start(self.updateTimeInterval)  # Restart the timer with the original interval
+        self.SetSweepMask(mask)
+
+    def SetSweepMask(self, mask):
+        # keep the local copy so quick clicks build on each other before the worker reports back
+        self.status = replace(self.status, sweepMask=mask)
+        self.worker.submit('setSweepMask', mask)
 
     def setAllSweepTargets(self):
-        self.timer.stop()
         self.enableSignals = False  # Disable signals-slots during sweep selection
         if not self.isAllSweepEnabled:
             self.isAllSweepEnabled = True
@@ -1061,50 +1241,45 @@ class TargetWheelControl(QWidget):
             for i in range(NTARGET):
                 self.target_chkBox[i].setChecked(True)
             tempMask = (1 << 16) - 1  # Set all bits to 1
-            self.controller.setSweepMask(tempMask)
+            self.SetSweepMask(tempMask)
         else:
             self.isAllSweepEnabled = False
-            print("Uncheck all targets from sweep.")
+            log.info("Uncheck all targets from sweep.")
             self.chkAll.setStyleSheet("")
             self.chkAll.setText("Enable All")
             for i in range(NTARGET):
                 self.target_chkBox[i].setChecked(False)
-            self.controller.setSweepMask(0)
+            self.SetSweepMask(0)
         self.enableSignals = True  # Enable signals-slots after sweep selection 
-        time.sleep(0.1)  # Wait a bit to ensure the command is processed
-        self.timer.start(self.updateTimeInterval)  # Restart the timer with the original interval
 
 
     def LockPosition(self):
-        if self.controller.connected:
+        if self.status.connected:
 
             if not self.isQX4Locking:
                 self.isQX4Locking = True
                 self.bnLockPos.setStyleSheet("background-color: green")
 
-                self.controller.startQX4LockPosition()
-
-                time.sleep(0.5)  # Wait a bit to ensure the command is processed
-                self.UpdateQX4ParametersFromMemory()
+                # the QX4 parameters are shown by OnStatusReady when the worker is done
+                self.worker.submit('startQX4LockPosition')
 
                 self.SetEnableGeneralControl(False)
                 self.setEnableSpinControl(False)
                 self.setEnableSweepControl(False)
 
-                self.state = 3  # set target position
+                self.SetState(3)  # set target position
 
             else:
                 self.isQX4Locking = False
                 self.bnLockPos.setStyleSheet("")
 
-                self.controller.stopQX4LockPosition()
-                self.UpdateQX4ParametersFromMemory()
+                self.worker.submit('stopQX4LockPosition')
 
                 self.SetEnableGeneralControl(True)
                 self.setEnableSpinControl(True)
                 self.setEnableSweepControl(True)
 
-                self.state = 0  # idle
+                self.SetState(0)  # idle
 
     #======================================================================================== Sweep Control
     def SetMaxSweepSpeed(self):
@@ -1117,17 +1292,17 @@ class TargetWheelControl(QWidget):
         maxSpeed = math.floor(maxSpeed / 0.25) * 0.25
         self.spSweepSpeed.setMaximum(maxSpeed)
         self.spSweepSpeed.setStyleSheet("color: black;")
-        print(f"Spoke Width set to {self.spSpokeWidth.value():.0f}, max sweep speed: {maxSpeed:.2f} rpm")
+        log.info("Spoke Width set to %.0f, max sweep speed: %.2f rpm", self.spSpokeWidth.value(), maxSpeed)
 
 
     def SetSpokeWidth(self):
         if self.enableSignals:
-            self.controller.setSpokeWidth(self.spSpokeWidth.value())
+            self.worker.submit('setSpokeWidth', self.spSpokeWidth.value())
             self.SetMaxSweepSpeed()
 
     def SetSpokeOffset(self):
         if self.enableSignals:
-            self.controller.setSpokeOffset(self.spSpokeOffset.value())
+            self.worker.submit('setSpokeOffset', self.spSpokeOffset.value())
             self.SetTargetPositionBaseOnSpokeOffset()
 
     def SetTargetPositionBaseOnSpokeOffset(self):
@@ -1142,24 +1317,25 @@ class TargetWheelControl(QWidget):
             self.target_pos[i].setText(f"{int(new_pos)}")
             # print(f"Target {i} position set to {int(new_pos)} steps.")
             self.target_rev[i].setText(f"{new_pos / STEP_PER_REVOLUTION:.3f}")
+        self.UpdateTargetIndex()
 
     def SetSweepSpeed(self):
         if self.enableSignals:
-            self.controller.setSweepSpeed( self.spSweepSpeed.value())
+            self.worker.submit('setSweepSpeed', self.spSweepSpeed.value())
             self.statusSweepSpeed.setText(f"{self.spSweepSpeed.value()/60.:.3f}")
 
     def SetSweepCutOff(self):
         if self.enableSignals:
-            self.controller.setSweepCutOff(self.spSweepCutOff.value())
+            self.worker.submit('setSweepCutOff', self.spSweepCutOff.value())
 
     def StartSweep(self):
-        if self.controller.connected:
+        if self.status.connected:
             self.SetEnableGeneralControl(False)
             self.setEnableSpinControl(False)
             self.setEnableSweepControl(False, True)
             self.setEnableTargetControl(False)
 
-            self.state = 2  # Sweeping and Spinning
+            self.SetState(2)  # Sweeping and Spinning
 
             # if self.cbSweepDirection.currentIndex() == 0:
             #     print("Starting sweep and spin in clockwise direction.")
@@ -1168,64 +1344,56 @@ class TargetWheelControl(QWidget):
             #     print("Starting sweep and spin in counterclockwise direction.")
             #     self.controller.send_message("DI-100")
 
-            self.controller.send_message("DI100")
-            self.controller.startSpinSweep()
-        
-            self.updateTimeInterval = 300 
-            self.timer.stop()
-            self.timer.start(self.updateTimeInterval)
+            self.worker.submit('send_message', "DI100")
+            self.worker.submit('startSpinSweep')
 
     def StopSweep(self):
-        if self.controller.connected:
-            origin_speed = self.controller.sweepSpeed
-            self.controller.stopSpinSweep()
+        if self.spinDown is not None: # already stopping, a second SpinDown would finish the sweep again on its timeout
+            return
+        if self.status.connected:
+            # the spin down is followed on every telemetry, QX1 sets IO bits 0b111 when it ends
+            origin_speed = self.status.sweepSpeed
+            self.spinDown = SpinDown(on_progress=self._onSweepStopProgress,
+                                     on_complete=lambda result: self._finishStopSweep(result, origin_speed),
+                                     timeout=SPIN_DOWN_TIMEOUT, io_mask=0b111)
+            self.worker.submit('stopSpinSweep')  # starts the spin down when done, see OnCommandFinished
 
             self.direction_label.setText("Stopping... Please wait")
             self.direction_label.setStyleSheet("color: red;")
 
-            self.timer.stop() 
-
-            while True:
-                old_velocity = self.controller.motorVelocity
-                self.Update_Position()
-                new_velocity = self.controller.motorVelocity
-                status = int(self.controller.io_status) & 0b111
-                print(f"Waiting for sweep to stop... IO status: {status:03b}")
-                    
-                if status  == 7:  # 00000111 in decimal
-                    self.controller.isSpinning = False
-                    break
-
-                if new_velocity > 1 and abs(new_velocity - old_velocity) < 0.1:
-                    print("Velocity not changing, forcing stop.")
-                    break
+    def _onSweepStopProgress(self, progress):
+        log.info("Waiting for sweep to stop... %.2f rpm, IO status: %s", progress.velocity, format(progress.io_status & 0b111, '03b'))
+        self.direction_label.setText(f"Stopping... {progress.velocity:.1f} rpm")
 
-                time.sleep(0.3)
-                QApplication.processEvents()  # Process events to update the UI
-
-            self.controller.send_message("SK") 
-            self.controller.send_message('IO7')
-            self.controller.send_message('RLO0') 
-            #restore the original speed
-            self.controller.setSweepSpeed(origin_speed)
+    def _finishStopSweep(self, result, origin_speed):
+        self.spinDown = None
+        if result.reason == CANCELLED:
+            return
+        if result.reason == STALLED:
+            log.warning("Velocity not changing, forcing stop.")
+        elif result.reason == TIMEOUT:
+            log.warning("Sweep did not stop within %.0f s, forcing stop.", SPIN_DOWN_TIMEOUT)
+        else:
+            log.info("Sweep stopped in %.2f s from %.1f rpm, predicted %.2f s.", result.duration, result.startVelocity, self.motion.duration)
+        self.message.setText(f"Sweep stop: {result.reason}, {result.duration:.2f} s.")
+        self.worker.submit('clearExpectation')
 
-            self.direction_label.setStyleSheet("color: blue;")
-            self.direction_label.setText("Only Positive Direction")
+        #kill QX1 and restore the original speed
+        self.worker.submit('finishSpinSweep', origin_speed)
 
-            self.state = 0  # Idle
+        self.direction_label.setStyleSheet("color: blue;")
+        self.direction_label.setText("Only Positive Direction")
 
-            self.Update_Status()
+        self.SetState(0)  # Idle
 
-            self.SetEnableGeneralControl(True)
-            self.setEnableSpinControl(True)
-            self.setEnableSweepControl(True, True)
-            self.setEnableTargetControl(True)
+        self.Update_Status()
 
-            self.updateTimeInterval = DEFAULT_POS_UPDATE_INTERVAL 
-            self.timer.stop()
-            self.timer.start(self.updateTimeInterval)
+        self.SetEnableGeneralControl(True)
+        self.setEnableSpinControl(True)
+        self.setEnableSweepControl(True, True)
+        self.setEnableTargetControl(True)
 
-            self.UpdateButtonsColor()
+        self.UpdateButtonsColor()
 
 
 
@@ -1233,18 +1401,18 @@ class TargetWheelControl(QWidget):
     def SetSpinSpeed(self):
         if self.enableSignals:
             speed = self.spSpinSpeed.value()
-            self.controller.setJogSpeed(speed/60.)
+            self.worker.submit('setJogSpeed', speed/60.)
             # self.statusSpinSpeed.setText(f"{speed*60:.1f}")
-            print(f"Spin Speed set to {speed:.2f} [rpm] = {speed/60.:.3f} [r/s]")
+            log.info("Spin Speed set to %.2f [rpm] = %.3f [r/s]", speed, speed/60.)
 
     def SetSpinAccel(self):
         if self.enableSignals:
             accel = self.spSpinAccel.value()
-            self.controller.setJogAccel(accel)
-            print(f"Spin Acceleration set to {accel:.3f} [r/s^2]")
+            self.worker.submit('setJogAccel', accel)
+            log.info("Spin Acceleration set to %.3f [r/s^2]", accel)
 
     def StartSpin(self):
-        if self.controller.connected:
+        if self.status.connected:
 
             self.SetEnableGeneralControl(False)
             self.setEnableSpinControl(False, True)
@@ -1253,11 +1421,7 @@ class TargetWheelControl(QWidget):
 
             QApplication.focusWidget().clearFocus()
 
-            self.state = 1  # Spinning
-
-            self.updateTimeInterval = 300 
-            self.timer.stop()
-            self.timer.start(self.updateTimeInterval)  # Restart the timer with the new interval
+            self.SetState(1)  # Spinning
 
             # if self.cbDirection.currentIndex() == 0:
             #    print("Starting spin in clockwise direction.")
@@ -1266,24 +1430,25 @@ class TargetWheelControl(QWidget):
             #     print("Starting spin in counterclockwise direction.")
             #     self.controller.send_message("DI-100")
 
-            self.controller.send_message("DI100")   # ALWAYS POSITIVE NUMBER
-            self.controller.startSpin()
+            self.worker.submit('send_message', "DI100")   # ALWAYS POSITIVE NUMBER
+            self.worker.submit('startSpin')
+            self.ExpectMotion(jogRamp(self.status, 0, self.status.jogSpeed), ('RUw1',), "Spinning up")
 
             self.pauseUpdate = False            
 
     def StopSpin(self):
-        if self.controller.connected:
+        if self.spinDown is not None: # already stopping
+            return
+        if self.status.connected:
 
-            self.state = 0  # Idle  
-            self.controller.stopSpin()
+            # stays in the spin state (poll rates, indicator) until the wheel stopped, see _onSpinStopped
+            self.spinDown = SpinDown(on_complete=self._onSpinStopped, timeout=SPIN_DOWN_TIMEOUT,
+                                     velocity_threshold=0.5, stall_tolerance=None)
+            self.worker.submit('stopSpin')  # starts the spin down when done, see OnCommandFinished
             QApplication.focusWidget().clearFocus()
 
             self.pauseUpdate = False
 
-            self.updateTimeInterval = 500 
-            self.timer.stop()
-            self.timer.start(self.updateTimeInterval)  # Restart the timer with the new interval
-
             self.SetEnableGeneralControl(True)
             self.setEnableSpinControl(True, True)
             self.setEnableSweepControl(True)
@@ -1291,26 +1456,96 @@ class TargetWheelControl(QWidget):
 
             self.UpdateButtonsColor()
 
+    def _onSpinStopped(self, result):
+        self.spinDown = None
+        if result.reason == CANCELLED:
+            return
+        if result.reason == TIMEOUT:
+            log.warning("Spin did not stop within %.0f s.", SPIN_DOWN_TIMEOUT)
+        else:
+            log.info("Spin stopped in %.2f s from %.1f rpm, predicted %.2f s.", result.duration, result.startVelocity, self.motion.duration)
+        self.message.setText(f"Spin stop: {result.reason}, {result.duration:.2f} s.")
+        self.worker.submit('clearExpectation')
+        self.SetState(0)  # Idle
+
     #======================================================================================== QX4 Control
     def SetQX4Position(self):
         if self.enableSignals:
             pos = int(self.qx4SetPos.text())
-            self.controller.setQX4EncoderDemandPos(pos)
+            self.worker.submit('setQX4EncoderDemandPos', pos)
 
     def SetQX4UpdateInterval(self):
         if self.enableSignals:
             interval = int(self.qx4UpdateInterval.text())
-            self.controller.setQX4ControUpdate(interval)
+            self.worker.submit('setQX4ControUpdate', interval)
 
     def SetQX4SlewSpeed(self):
         if self.enableSignals:
             speed = int(self.qx4SlewSpeed.text())
-            self.controller.setQX4SlewSpeed(speed)
+            self.worker.submit('setQX4SlewSpeed', speed)
 
     def SetQX4ServoSpeed(self):
         if self.enableSignals:
             speed = int(self.qx4ServoSpeed.text())
-            self.controller.setQX4ServoSlewSpeed(speed)
+            self.worker.submit('setQX4ServoSlewSpeed', speed)
+
+    #======================================================================================== Target Sequence
+    def RunSequence(self):
+        if self.sequence is not None:
+            self.sequence.cancel() # a sweep step ramps down first, see _onSequenceFinished
+            if self.sequence is not None: # still ramping down
+                self.bnSequence.setEnabled(False)
+            return
+        if not self.status.connected:
+            return
+        fileName, _ = QFileDialog.getOpenFileName(self, "Open Sequence", "", "Sequence Files (*.json *.yaml *.yml)")
+        if fileName == "" or fileName is None:
+            return
+        self.UpdateTargetIndex()
+        try:
+            steps = loadSchedule(fileName, self.targetIndex)
+        except (OSError, ValueError, KeyError, ImportError) as e:
+            log.warning("Cannot load sequence %s: %s", fileName, e)
+            self.message.setText(f"Cannot load sequence: {e}")
+            return
+
+        self.SetEnableGeneralControl(False)
+        self.setEnableSpinControl(False)
+        self.setEnableSweepControl(False)
+        self.setEnableTargetControl(False)
+        self.bnSequence.setText("Stop Sequence")
+        self.bnSequence.setStyleSheet("background-color: green")
+
+        log.info("Run sequence %s, %s steps.", fileName, len(steps))
+        self.sequence = SequenceRunner(steps, self.targetIndex, self.worker.submit, self.waiters, lambda: self.status,
+                                       set_state=self.SetState, on_step=self._onSequenceStep,
+                                       on_finished=self._onSequenceFinished, qx4=self.isQX4Locking)
+        self.sequence.start()
+
+    def _onSequenceStep(self, index, item):
+        step = item.step
+        if step.isSweep:
+            self.message.setText(f"Sequence {index + 1}/{len(self.sequence.steps)}: sweep, {step.dwell:g} s.")
+        else:
+            self.message.setText(f"Sequence {index + 1}/{len(self.sequence.steps)}: {self.targetIndex.name(step.target)}, {step.dwell:g} s.")
+
+    def _onSequenceFinished(self, ok, reason):
+        runner, self.sequence = self.sequence, None
+        log.info("Sequence %s.", reason)
+        if runner.deadTimes:
+            log.info("Dead time between dwells: mean %.2f s, max %.2f s", sum(runner.deadTimes) / len(runner.deadTimes), max(runner.deadTimes))
+        self.message.setText(f"Sequence {reason}.")
+        self.bnSequence.setText("Run Sequence")
+        self.bnSequence.setStyleSheet("")
+        self.bnSequence.setEnabled(True)
+
+        # the QX4 lock is left holding the last target, as after LockPosition
+        self.isQX4Locking = runner.qx4
+        self.bnLockPos.setStyleSheet("background-color: green" if runner.qx4 else "")
+        self.SetEnableGeneralControl(not runner.qx4)
+        self.setEnableSpinControl(not runner.qx4)
+        self.setEnableSweepControl(not runner.qx4)
+        self.setEnableTargetControl(True)
 
     #======================================================================================== Load/Save Target Names
     def load_targets_click(self):
@@ -1319,9 +1554,9 @@ class TargetWheelControl(QWidget):
 
     def save_targets_click(self):
         self.fileName, _ = QFileDialog.getSaveFileName(self, "Save Target Names", "", "JSON Files (*.json)")
-        print(f"Save to file: |{self.fileName}|")
+        log.info("Save to file: |%s|", self.fileName)
         if self.fileName == "" or self.fileName is None:
-            print("No file name specified. Targets not saved.")
+            log.info("No file name specified. Targets not saved.")
             return
         self.save_targets_info()
 
@@ -1331,7 +1566,7 @@ class TargetWheelControl(QWidget):
         
     def load_targets_info(self):
 
-        print(f"Load from file: |{self.fileName}|")
+        log.info("Load from file: |%s|", self.fileName)
 
         if self.fileName is not None and self.fileName != "":
             try:
@@ -1345,8 +1580,9 @@ class TargetWheelControl(QWidget):
                             if isinstance(idx, int) and 0 <= idx < len(self.target_buttons):
                                 self.target_buttons[idx].setText(name)
                                 self.target_pos[idx].setText(pos)
+                self.UpdateTargetIndex()
             except (FileNotFoundError, json.JSONDecodeError) as e:
-                print(f"Error loading targets position: {e}")
+                log.warning("Error loading targets position: %s", e)
                 self.fileName = None
                 self.fileNameLineEdit.setText("")
                 return
@@ -1362,11 +1598,43 @@ class TargetWheelControl(QWidget):
             with open(self.fileName, "w") as file:
                 json.dump(data, file, indent=2)
 
-            print(f"Targets name and position saved to {self.fileName}")
+            log.info("Targets name and position saved to %s", self.fileName)
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = TargetWheelControl()
+    parser = argparse.ArgumentParser(description="Target wheel control GUI")
+    parser.add_argument("--daemon", nargs="?", const="", metavar="HOST[:PORT]",
+                        help="use a running wheel_daemon.py instead of connecting to the controller")
+    parser.add_argument("--startup-time", nargs="?", const="", metavar="FILE",
+                        help="print the time to each startup step and quit, append it to FILE (JSON lines)")
+    args, qt_args = parser.parse_known_args()
+
+    daemon = None
+    if args.daemon is not None:
+        from wheel_daemon import DEFAULT_HOST, DEFAULT_PORT
+        host, colon, port = args.daemon.rpartition(":")
+        if not colon: # HOST alone
+            host, port = port, ""
+        daemon = (host or DEFAULT_HOST, int(port) if port else DEFAULT_PORT)
+
+    startup = None
+    if args.startup_time is not None:
+        startup = StartupProfile(['shown', 'connect', 'telemetry'])
+        startup.mark('imported')
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = TargetWheelControl(daemon, startup)
     window.show()
+
+    if startup is not None:
+        def reportStartup():
+            if window.isHidden(): # already reported
+                return
+            print(startup.report())
+            if args.startup_time:
+                startup.save(args.startup_time)
+            window.close()
+        startup.on_complete = reportStartup
+        QTimer.singleShot(0, lambda: startup.mark('shown'))
+        QTimer.singleShot(int(STARTUP_TIMEOUT * 1000), reportStartup)
     sys.exit(app.exec())
@@ -1,19 +1,152 @@
 import socket
-# import threading
+import threading
 import time
 import math
+import logging
+
+import commands
+from commands import FRAME_HEADER, FRAME_END
+from connection_manager import ConnectionManager, DISCONNECTED, tuneSocket
+from control_loop import ControlLoop, PID, moveTime
+import wheel_log
+import metrics
 
 STEP_PER_REVOLUTION = 8192  # Number of steps per revolution for the stepper motor
 
-class Controller():
+# queued to the log thread, see wheel_log, print() held up every round trip on a slow terminal
+log = wheel_log.getLogger("controller")
+iolog = wheel_log.getLogger("io")
+connlog = wheel_log.getLogger("conn")
+pidlog = wheel_log.getLogger("pid")
+
+# registers read by getQX4Parameters, R6, R7, R8, R9, R;
+QX4_PARAMETER_KEYS = ['RU61', 'RU71', 'RU81', 'RU91', 'RU;1']
+# registers read by getStatus
+STATUS_KEYS = ['CM', 'JS', 'JA', 'AM', 'AC', 'DE', 'VE', 'DI',
+               'RU11', 'RU21', 'RU31', 'RU41', 'RU51',
+               'RUe1', 'RUt1', 'RUv1', 'RUw1', 'RUx1',
+               'IO', 'RUp1'] + QX4_PARAMETER_KEYS
+# registers read every GUI tick by getTelemetry
+TELEMETRY_KEYS = ['RUe1', 'IO', 'RUt1', 'RUv1', 'RUw1', 'RUx1']
+# parameters that only change when we write them, kept in the RegisterCache
+STATIC_KEYS = frozenset(['CM', 'JS', 'JA', 'AM', 'AC', 'DE', 'VE', 'DI',
+                         'RU11', 'RU21', 'RU31', 'RU41', 'RU51',
+                         'RU61', 'RU71', 'RU81', 'RU91'])
+STATIC_MAX_AGE = 300.0 # sec, static parameters are read again after this, in case another client changed them
+PID_PERIOD = 0.05 # sec, PID_pos_control iteration period
+PID_TELEMETRY_EVERY = 20 # iterations, PID_pos_control reads the other telemetry registers this often
+TRACE_ON_LOSS = 10 # last TX/RX lines logged with a connection loss
+
+class FrameReader():
+    """Buffered reader that splits the controller byte stream into replies.
+
+    Every reply is framed as b'\\x00\\x07<payload>\\r'. TCP may deliver several
+    replies in one segment or one reply over several segments, so data is
+    collected with recv_into() into a preallocated buffer and handed out one
+    frame at a time. readFrame() returns a memoryview into that buffer, which
+    is only valid until the next read.
+    """
+    def __init__(self, sock=None, size=4096):
+        self.sock = sock
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0 # first unread byte
+        self._end = 0   # end of received data
+
+    def attach(self, sock):
+        self.sock = sock
+        self.clear()
+
+    def clear(self):
+        self._start = 0
+        self._end = 0
+
+    def pending(self):
+        return self._end - self._start
+
+    def readFrame(self):
+        while True:
+            idx = self._buffer.find(FRAME_END, self._start, self._end)
+            if idx >= 0:
+                frame = self._view[self._start:idx]
+                self._start = idx + 1
+                if frame[:2] == FRAME_HEADER:
+                    frame = frame[2:]
+                return frame
+            self._fill()
+
+    def readMessage(self):
+        return str(self.readFrame(), 'utf-8', 'ignore')
+
+    def _fill(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            if self._start == 0:
+                # no '\r' in a full buffer, the stream is garbage, drop it
+                self.clear()
+            else:
+                # move the partial frame to the front of the buffer
+                size = self._end - self._start
+                self._view[:size] = self._view[self._start:self._end]
+                self._start, self._end = 0, size
+
+        n = self.sock.recv_into(self._view[self._end:])
+        if n == 0:
+            raise ConnectionError("connection closed by peer")
+        self._end += n
+
+class RegisterCache():
+    """Last known register values, with provenance and time.
+
+    Every entry is (value, provenance, time.monotonic()), the value in the
+    units of the register query (e.g. RU41 in 0.25 rpm), the provenance
+    READ or WRITTEN. Used by Controller to skip writes of the value the
+    controller already holds, and to skip re-reading static parameters.
+    """
+    READ = 'read'
+    WRITTEN = 'written'
+
     def __init__(self):
-        super().__init__()
-        self.IP = '192.168.203.68'
-        self.port = 7776
-        self.sock = None
-        self.connected = False
-        self.last_message = None
+        self._entries = {}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def record(self, key, value, provenance):
+        self._entries[key] = (value, provenance, time.monotonic())
+
+    def entry(self, key):
+        return self._entries.get(key)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        return default if entry is None else entry[0]
+
+    def isValid(self, key, max_age=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        return max_age is None or time.monotonic() - entry[2] < max_age
+
+    def matches(self, key, value):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] == value
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+class ControllerState():
+    """Last known controller parameters and the helpers that interpret replies.
 
+    Shared by the blocking Controller and the asyncio AsyncController, so both
+    keep the same attribute names and units.
+    """
+    def __init__(self):
+        super().__init__()
         self.isSpinning = False
         self.jogSpeed = 0.0 # rev/sec
         self.jogAccel = 0.0 # rev/sec/sec
@@ -53,50 +186,210 @@ class Controller():
         self.qx4SlewSpeed = 0 # in 0.25 rpm /unit, R8
         self.qx4ServoSlewSpeed = 0 # in 0.25 rpm /unit, R9
         self.qx4MotorDemandPos = 0  # R;
-        
+
+    def _applyStatus(self, values):
+        # values : dict of STATUS_KEYS -> number, from a status batch
+        self.commandMode = values['CM']
+
+        # jogging parameters
+        self.jogSpeed = float(values['JS']) # rev/sec
+        self.jogAccel = float(values['JA'])
+
+        # point to point movement parameters
+        self.maxAccel = float(values['AM']) # rev/sec/sec, 0.167 - 5461.167
+        self.accelRate = float(values['AC']) # rev/sec/sec
+        self.deaccelRate = float(values['DE']) # rev/sec/sec
+        self.velocity = float(values['VE']) # rev/sec
+        self.moveDistance = float(values['DI']) # steps
+
+        self.sweepMask = int(values['RU11']) # sweep bit
+        self.spokeWidth = int(values['RU21'])  # spoke with in steps
+        self.spokeOffset = int(values['RU31']) 
+        self.sweepSpeed = int(values['RU41']) / 4.#  rpm
+        self.sweepCutOff = int(values['RU51']) / 4. #  rpm
+
+        self.position = int(values['RUe1']) # encoder position
+
+        self.temperature = float(values['RUt1']) / 10 # temperature in C
+        self.encoderVelocity = float(values['RUv1']) / 4. #  rpm 
+        self.motorVelocity = float(values['RUw1']) / 4. #  rpm 
+        self.torque_ref = float(values['RUx1'])
+        self.torque = 0.0 # reset torque to zero
+
+        self.io_status = int(values['IO']) & 0xFF # 8-bit status
+        self.FWprogram = int(values['RUp1'])
+        self._applyQX4Parameters([values[key] for key in QX4_PARAMETER_KEYS])
+
+    def _applyTelemetry(self, values, keys=TELEMETRY_KEYS):
+        # values : list in keys order, keys : any subset of TELEMETRY_KEYS
+        if any(math.isnan(v) for v in values):
+            return False
+        for key, value in zip(keys, values):
+            if key == 'RUe1':
+                self.position = int(value)
+            elif key == 'IO':
+                self.io_status = int(value) & 0xFF
+            elif key == 'RUt1':
+                self.temperature = value / 10 # temperature in C
+            elif key == 'RUv1':
+                self.encoderVelocity = value / 4. # in rpm
+            elif key == 'RUw1':
+                self.motorVelocity = value / 4. # in rpm
+            elif key == 'RUx1':
+                self.torque = value - self.torque_ref
+        return True
+
+    def _applyQX4Parameters(self, values):
+        self.qx4EncoderDemandPos = float(values[0]) # R6
+        self.qx4ControUpdate = float(values[1]) # 100 us/ unit, R7
+        self.qx4SlewSpeed = float(values[2]) # in 0.25 rpm /unit, R8    
+        self.qx4ServoSlewSpeed = float(values[3]) # in 0.25 rpm /unit, R9
+        self.qx4MotorDemandPos = float(values[4]) #
+        self.isQX4Updated = True
+
+    def ConvertModPositionToAbsolute(self, target_position):
+        current_mod_position = self.position % STEP_PER_REVOLUTION
+        diff = target_position - current_mod_position
+        if diff > STEP_PER_REVOLUTION / 2:
+            diff -= STEP_PER_REVOLUTION
+        elif diff < -STEP_PER_REVOLUTION / 2:
+            diff += STEP_PER_REVOLUTION
+        target_position = self.position + diff
+        return target_position
+
+    @staticmethod
+    def parseNumber(reply):
+        if reply and '=' in reply:
+            temp = reply.split('=')[1].strip()
+            # Check if temp is a number
+            try:
+                temp = float(temp)
+            except ValueError:
+                return math.nan           
+            return temp
+        else:
+            return math.nan
+
+    @staticmethod
+    def checkValidMessage(message):
+        # O(1) lookup in the command table, see commands.py
+        return commands.isValid(message)
+
+class Controller(ControllerState):
+    def __init__(self):
+        super().__init__()
+        self.IP = '192.168.203.68'
+        self.port = 7776
+        self.sock = None
+        self.connected = False
+        self.last_message = None
+        self.reader = FrameReader()
+        self.cache = RegisterCache() # see _writeRegister and getStatus
+
+        # socket I/O from the caller and the ConnectionManager thread
+        self.ioLock = threading.RLock()
+        self.manager = None # ConnectionManager, started by Connect, stopped by disconnect
+        self.connectionListeners = [] # callback(ConnectionEvent), see addConnectionListener
+        self.lastActivity = 0.0 # time.monotonic() of the last reply
+        self.heartbeatRTT = math.nan # sec
+        self.pidStats = None # LoopStats of the last PID_pos_control
+        self.trace = wheel_log.TraceBuffer() # the last TX/RX, whatever the log levels
+        self.metrics = metrics.REGISTRY # latency per command and error counters, see metrics.py
 
     def __del__(self):
         # Destructor to ensure cleanup
-        print("Controller object is being destroyed. Disconnecting...")
+        connlog.info("Controller object is being destroyed. Disconnecting...")
         self.disconnect()
 
+    def addConnectionListener(self, callback):
+        """callback(ConnectionEvent) on connect, loss and every reconnect attempt."""
+        self.connectionListeners.append(callback)
+
     def Connect(self, IP, port):
+        self.disconnect()
         self.IP = IP
         self.port = port
 
-        # connect to server
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(1.0) # 1 sec
-        try:
-            self.sock.connect((self.IP, self.port))
-            self.connected = True
-        except Exception as e:
-            print("Connect error:", e)
-
         # # Start the receiving thread
         # if self.connected :
         #     receive_thread = threading.Thread(target=self.__receive_messages, daemon=True)
         #     receive_thread.start()
 
         # self.send_message('RE') 
-        time.sleep(0.1)
         # self.seekHome()
-        self.getStatus()
 
-    def disconnect(self):
-        self.connected = False
+        # from now on the link is kept up in the background, see ConnectionManager
+        self.manager = ConnectionManager(self)
+        if self._open():
+            time.sleep(0.1)
+            self.getStatus()
+            if self.connected: # not lost again during the status refresh
+                self.manager.connectionMade()
+        else:
+            self.manager.connectionLost("connect failed")
+        self.manager.start()
+
+    def _open(self):
+        # one connect attempt, True when connected
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(1.0) # 1 sec
+        tuneSocket(sock)
         try:
-            if self.sock:
+            sock.connect((self.IP, self.port))
+        except Exception as e:
+            connlog.warning("Connect error: %s", e)
+            sock.close()
+            return False
+        with self.ioLock:
+            self._closeSocket()
+            self.sock = sock
+            self.reader.attach(sock)
+            self.cache.invalidate() # could be another controller, or a restarted one
+            self.lastActivity = time.monotonic()
+            self.connected = True
+        return True
+
+    def _closeSocket(self):
+        self.connected = False
+        if self.sock:
+            try:
                 self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass # already reset by the peer
+            try:
                 self.sock.close()
-                print("Disconnected from server.")
-        except Exception as e:
-            print("Error while disconnecting:", e)
+                connlog.info("Disconnected from server.")
+            except Exception as e:
+                connlog.warning("Error while disconnecting: %s", e)
         self.sock = None
 
+    def _connectionLost(self, error):
+        # no reconnect here, the caller fails fast and the ConnectionManager reconnects
+        with self.ioLock:
+            self._closeSocket()
+            self.last_message = None
+        connlog.warning("Connection lost: %s, last TX/RX:\n%s", error, self.trace.format(TRACE_ON_LOSS))
+        if self.manager is not None:
+            self.manager.connectionLost(error)
+
+    def disconnect(self):
+        manager, self.manager = self.manager, None
+        if manager is not None:
+            manager.stop()
+        with self.ioLock:
+            self._closeSocket()
+        if manager is not None:
+            manager.notify(DISCONNECTED, error="disconnected by user")
+
+    def heartbeat(self):
+        """Cheap query to check an idle link, see ConnectionManager."""
+        start = time.monotonic()
+        if self.send_message('IO', False) is not None and self.connected:
+            self.heartbeatRTT = time.monotonic() - start
+
     def seekHome(self):
         if self.connected:
-            print("Seeking home position...")
+            log.info("Seeking home position...")
 
             direction = -1* math.sin(2*math.pi * self.position / STEP_PER_REVOLUTION)
             if direction >= 0:
@@ -112,7 +405,7 @@ class Controller():
             
     def setEncoderPosition(self, position):
         if self.connected and self.isSpinning == False:
-            print(f"Setting encoder position to {position}...")
+            log.info("Setting encoder position to %s...", position)
             self.send_message(f'EP{position}')
 
     def getIOStatus(self):
@@ -124,69 +417,58 @@ class Controller():
         if self.connected:
             self.FWprogram = int(self.queryNumber('RUp1', False))
 
-    def getStatus(self):
+    def getStatus(self, full=False):
         if self.connected:
-            self.commandMode = self.queryNumber('CM', False)
-
-            # jogging parameters
-            #check self.spinSpin is number
-            self.jogSpeed = float(self.queryNumber('JS',False)) # rev/sec
-            self.jogAccel = float(self.queryNumber('JA',False))
-
-            # point to point movement parameters
-            self.maxAccel = float(self.queryNumber('AM',False)) # rev/sec/sec, 0.167 - 5461.167
-            self.accelRate = float(self.queryNumber('AC',False)) # rev/sec/sec
-            self.deaccelRate = float(self.queryNumber('DE',False)) # rev/sec/sec
-            self.velocity = float(self.queryNumber('VE',False)) # rev/sec
-            self.moveDistance = float(self.queryNumber('DI',False)) # steps
-
-            self.sweepMask = int(self.queryNumber('RU11',False)) # sweep bit
-            self.spokeWidth = int(self.queryNumber('RU21',False))  # spoke with in steps
-            self.spokeOffset = int(self.queryNumber('RU31',False)) 
-            self.sweepSpeed = int(self.queryNumber('RU41',False)) / 4.#  rpm
-            self.sweepCutOff = int(self.queryNumber('RU51',False)) / 4. #  rpm
-
-            self.position = int(self.queryNumber('RUe1',False)) # encoder position
-
-            self.temperature = float(self.queryNumber('RUt1',False)) / 10 # temperature in C
-            self.encoderVelocity = float(self.queryNumber('RUv1',False)) / 4. #  rpm 
-            self.motorVelocity = float(self.queryNumber('RUw1',False)) / 4. #  rpm 
-            self.torque_ref = float(self.queryNumber('RUx1',False))
-            self.torque = 0.0 # reset torque to zero
+            # static parameters still in the cache are not read again, unless full
+            keys = [key for key in STATUS_KEYS
+                    if full or key not in STATIC_KEYS or not self.cache.isValid(key, STATIC_MAX_AGE)]
+            # all status registers go out in one pipelined batch, see queryBatch
+            values = dict(zip(keys, self.queryBatch(keys)))
+            if not self.connected:
+                return
+            for key in STATUS_KEYS:
+                if key not in values:
+                    values[key] = self.cache.get(key)
+            self._applyStatus(values)
 
             # firmware set the minimm sweep speed to 6 rpm
             if self.sweepSpeed < 6 :
                 self.sweepSpeed = 6.0
                 self.setSweepSpeed(6.0)
 
-            self.getIOStatus()
-            self.getQX4Parameters()
-            self.getFirmwareProgramStatus()
+    def getTelemetry(self, keys=TELEMETRY_KEYS):
+        """Per-tick readout (position, IO, temperature, velocities, torque) in one batch.
+
+        keys selects a subset of TELEMETRY_KEYS, see poll_scheduler.PollScheduler.
+        """
+        if not self.connected:
+            return False
+        return self._applyTelemetry(self.queryBatch(keys), keys)
 
     def setSweepMask(self, mask : int):
         if self.connected:
             self.sweepMask = mask
-            self.send_message(f'RL1{mask}')
+            self._writeRegister('RL1', mask)
             # print(f'Sweep mask set to {mask:04X}')
     def setSpokeWidth(self, width : int):
         if self.connected:
             self.spokeWidth = width
-            self.send_message(f'RL2{int(width):d}')
+            self._writeRegister('RL2', width)
     def setSpokeOffset(self, width : int):
         if self.connected:
             self.spokeOffset = width
-            self.send_message(f'RL3{int(width):d}')
+            self._writeRegister('RL3', width)
     def setSweepSpeed(self, speed : float):
         if self.connected:
             self.sweepSpeed = speed  # in rpm
-            self.send_message(f'RL4{int(speed * 4):d}')
+            self._writeRegister('RL4', int(speed * 4))
     def setSweepCutOff(self, cutoff : float):
         if self.connected:
             self.sweepCutOff = cutoff # in rpm
-            self.send_message(f'RL5{int(cutoff * 4):d}')
+            self._writeRegister('RL5', int(cutoff * 4))
     def startSpinSweep(self):
         if self.connected:
-            print("Starting spin sweep...")
+            log.info("Starting spin sweep...")
 
             self.send_message('RMNO') #holding motor current
             time.sleep(0.1)
@@ -201,10 +483,19 @@ class Controller():
 
     def stopSpinSweep(self):
         if self.connected:
-            print("Stopping spin sweep...")
+            log.info("Stopping spin sweep...")
             self.setSweepSpeed(0)
             # self.send_message('SK')
 
+    def finishSpinSweep(self, restore_speed):
+        # after the wheel spun down, kill QX1 and restore the sweep speed that stopSpinSweep zeroed
+        if self.connected:
+            self.send_message("SK") 
+            self.send_message('IO7')
+            self.send_message('RLO0') 
+            self.setSweepSpeed(restore_speed)
+            self.isSpinning = False
+
     def getPosition(self, outputMsg=True):
         if self.connected:
             # haha = self.query('RUe1')
@@ -219,7 +510,7 @@ class Controller():
 
     def getTemperature(self, outputMsg=True):
         if self.connected:
-            self.temperaturep = self.queryNumber('RUt1', outputMsg) / 10 # temperature in C
+            self.temperature = self.queryNumber('RUt1', outputMsg) / 10 # temperature in C
             return self.temperature
         else:
             return math.nan
@@ -247,7 +538,7 @@ class Controller():
 
     def reset(self):
         if self.connected:
-            print("Resetting controller...")
+            log.info("Resetting controller...")
             self.send_message('RE')
             time.sleep(0.1)
             self.seekHome()
@@ -255,70 +546,70 @@ class Controller():
 
     def setMaxAccel(self, accel):
         if self.connected:
-            print(f"Setting max acceleration to {accel} rev/sec^2...")
-            self.send_message(f"AM{accel:.3f}")
+            log.info("Setting max acceleration to %s rev/sec^2...", accel)
+            self._writeRegister('AM', accel)
             self.maxAccel = accel
     def setAccelRate(self, accel):
         if self.connected:
-            print(f"Setting acceleration rate to {accel} rev/sec^2...")
-            self.send_message(f"AC{accel:.3f}")
+            log.info("Setting acceleration rate to %s rev/sec^2...", accel)
+            self._writeRegister('AC', accel)
             self.accelRate = accel
     def setDeaccelRate(self, deaccel):
         if self.connected:
-            print(f"Setting deacceleration rate to {deaccel} rev/sec^2...")
-            self.send_message(f"DE{deaccel:.3f}")
+            log.info("Setting deacceleration rate to %s rev/sec^2...", deaccel)
+            self._writeRegister('DE', deaccel)
             self.deaccelRate = deaccel
     def setVelocity(self, velocity):
         if self.connected:
-            print(f"Setting velocity to {velocity} rev/sec...")
-            self.send_message(f"VE{velocity:.1f}")
+            log.info("Setting velocity to %s rev/sec...", velocity)
+            self._writeRegister('VE', velocity)
             self.velocity = velocity
     def setMoveDistance(self, distance : int):
         if self.connected:
-            print(f"Setting move distance to {distance} steps...")
-            self.send_message(f"DI{distance:.0f}")
+            log.info("Setting move distance to %s steps...", distance)
+            self._writeRegister('DI', distance)
             self.moveDistance = distance
             # self.position = int(self.queryNumber('RUe1')) # update position after setting move distance
 
     def setJogSpeed(self, speed : float):
         if self.connected:
-            print(f"Setting spin speed to {speed} rev/sec...")
-            self.send_message(f"JS{speed:.1f}")
+            log.info("Setting spin speed to %s rev/sec...", speed)
+            self._writeRegister('JS', speed)
             self.jogSpeed = speed    
     def setJogAccel(self, accel : float):
         if self.connected:
-            print(f"Setting spin speed to {accel} rev/sec^2...")
-            self.send_message(f"JA{accel:.3f}")
+            log.info("Setting spin speed to %s rev/sec^2...", accel)
+            self._writeRegister('JA', accel)
             self.jogAccel = accel    
     def startSpin(self):
         if self.connected:
-            print("Starting spin...")
+            log.info("Starting spin...")
             self.send_message('CJ')
             self.isSpinning = True
     def stopSpin(self):
         if self.connected:
-            print("Stopping spin...")
+            log.info("Stopping spin...")
             self.send_message('SJ')
             self.isSpinning = False
 
     def setQX4EncoderDemandPos(self, position):
         if self.connected:
-            self.send_message(f"RL6{position}")
+            self._writeRegister('RL6', position)
             self.qx4EncoderDemandPos = position
 
     def setQX4ControUpdate(self, update):
         if self.connected:
-            self.send_message(f"RL7{update}")
+            self._writeRegister('RL7', update)
             self.qx4ControUpdate = update
 
     def setQX4SlewSpeed(self, speed):
         if self.connected:
-            self.send_message(f"RL8{speed}")
+            self._writeRegister('RL8', speed)
             self.qx4SlewSpeed = speed
 
     def setQX4ServoSlewSpeed(self, speed):
         if self.connected:
-            self.send_message(f"RL9{speed}")
+            self._writeRegister('RL9', speed)
             self.qx4ServoSlewSpeed = speed
 
     def getQX4MotorDemandPos(self, position):
@@ -332,23 +623,20 @@ class Controller():
         if not self.connected:
             return
     
-        self.qx4EncoderDemandPos = float(self.queryNumber('RU61',False)) # R6
-        self.qx4ControUpdate = float(self.queryNumber('RU71',False)) # 100 us/ unit, R7
-        self.qx4SlewSpeed = float(self.queryNumber('RU81',False)) # in 0.25 rpm /unit, R8    
-        self.qx4ServoSlewSpeed = float(self.queryNumber('RU91',False)) # in 0.25 rpm /unit, R9
-        self.qx4MotorDemandPos = float(self.queryNumber('RU;1',False)) #
-        self.isQX4Updated = True
+        values = self.queryBatch(QX4_PARAMETER_KEYS)
+        if self.connected:
+            self._applyQX4Parameters(values)
 
     def startQX4LockPosition(self):
         if self.connected:
-            print("Starting QX4 Lock Position...")
+            log.info("Starting QX4 Lock Position...")
             self.send_message('QX4')
             time.sleep(0.1)
             self.getQX4Parameters()
 
     def stopQX4LockPosition(self):
         if self.connected:
-            print("Stopping QX4 Lock Position...")
+            log.info("Stopping QX4 Lock Position...")
             self.send_message('SK')
             self.send_message('IO7')
             self.send_message('RLO0') 
@@ -385,232 +673,208 @@ class Controller():
     #             self.send_message('FL') 
     #             time.sleep(estimatedTime)  # Wait a bit before checking again
 
-    def ConvertModPositionToAbsolute(self, target_position):
-        current_mod_position = self.position % STEP_PER_REVOLUTION
-        diff = target_position - current_mod_position
-        if diff > STEP_PER_REVOLUTION / 2:
-            diff -= STEP_PER_REVOLUTION
-        elif diff < -STEP_PER_REVOLUTION / 2:
-            diff += STEP_PER_REVOLUTION
-        target_position = self.position + diff
-        return target_position
-
-    def PID_pos_control(self, target_position, max_iterations=-1, tolerance=1, Kp=0.5, Ki=0.0, Kd=0.1):
+    def PID_pos_control(self, target_position, max_iterations=-1, tolerance=1, Kp=0.5, Ki=0.0, Kd=0.1,
+                        period=PID_PERIOD, telemetry_every=PID_TELEMETRY_EVERY):
+        """Move to target_position (modulo one revolution) with a PID on the encoder position.
+
+        Runs on a ControlLoop every period sec, until the position was within tolerance for
+        two iterations (max_iterations > 0 only), max_iterations, or stop_PID_control is set
+        from another thread. Each iteration reads the position only, the other telemetry
+        registers are read with it every telemetry_every iterations. DI and FL go out in one
+        batch, and only once the previous move has had time to finish. The PID is only updated
+        then, once per move as in the former 1 s loop, so the gains are per move whatever the
+        period. Returns the LoopStats of the run, also kept in pidStats.
+        """
         if not self.connected:
-            print("Not connected to controller.")
-            return
-
-        previous_error = 0.0
-        history_error = []
-        history_length = 10
-        iteration = 0
+            pidlog.warning("Not connected to controller.")
+            return None
 
         stable_count = 0
         stable_required = 2  # Number of consecutive stable readings required
         max_stepper_speed = 8000  # Define a maximum speed in step
+        move_end = 0.0 # time.monotonic() when the last move should have finished
 
         self.stop_PID_control = False
 
         # convert the target_position to the nearest equivalent absolute position 
         target_position = self.ConvertModPositionToAbsolute(target_position)
-        print(f"Adjusted target absolute position: {target_position}, Rev: {target_position/STEP_PER_REVOLUTION:.2f}")
-
-        while True:
-            if self.stop_PID_control:
-                print("PID control stopped by user.")
-                break
-
-            if max_iterations != -1 and iteration >= max_iterations:
-                print(f"Max iterations reached. Final position: {self.getPosition(outputMsg=False)}, Target position: {target_position}")
-                self.stop_PID_control = True
-                break
-
-            current_position = self.getPosition(outputMsg=False)
-            if math.isnan(current_position):
-                print("Failed to get current position.")
-                return
-        
+        pidlog.info("Adjusted target absolute position: %d, Rev: %.2f", target_position, target_position/STEP_PER_REVOLUTION)
+
+        pid = PID(Kp, Ki, Kd, limit=max_stepper_speed)
+        loop = ControlLoop(period)
+        self.pidStats = loop.stats
+
+        def step(iteration):
+            nonlocal stable_count, move_end
+            keys = TELEMETRY_KEYS if telemetry_every > 0 and iteration % telemetry_every == 0 else ['RUe1']
+            values = self.queryBatch(keys)
+            position = values[keys.index('RUe1')]
+            if math.isnan(position):
+                pidlog.warning("Failed to get current position.")
+                return True
+            self._applyTelemetry(values, keys) # nothing applied when another register is NaN
+            current_position = self.position = int(position)
 
             error = target_position - current_position
-            history_error.append(error)
-            if len(history_error) > history_length:
-                history_error.pop(0)
-            integral = sum(history_error)
-            derivative = error - previous_error
-
-            # PID output
-            output = Kp * error + Ki * integral + Kd * derivative
-
-            # Limit output to max stepper speed (in step)
-            output = int(round(max(-max_stepper_speed, min(max_stepper_speed, output))))
 
             if abs(error) <= tolerance:
                 stable_count += 1
-                print(f"Target position {target_position} reached within tolerance {tolerance}.")
+                if stable_count == 1:
+                    pidlog.info("Target position %d reached within tolerance %d.", target_position, tolerance)
                 if stable_count >= stable_required and max_iterations > 0:
-                    self.stop_PID_control = True
-                    break
+                    return True
             else:
                 stable_count = 0
 
-            print(f"Iteration {iteration}: Current Position: {current_position}, Error: {error}, Output: {output}, Velocity: {self.velocity}")
-
-            # Move the motor by the calculated output (rounded to nearest integer)
-            self.setMoveDistance(output)
-            # counld also set the velocity based on the output
-            # self.setVelocity(0.1) # 0.1 rev per sec
-            # self.setVelocity(min(abs(output)/STEP_PER_REVOLUTION, self.velocity)) # convert output the rev per sec
-            self.send_message('FL')  # Execute the move
-
-            self.temperature = float(self.queryNumber('RUt1',False)) / 10 # temperature in C
-            self.encoderVelocity = float(self.queryNumber('RUv1',False)) # in rev/sec
-            self.motorVelocity = float(self.queryNumber('RUw1',False))
-            self.torque = float(self.queryNumber('RUx1',False))
-
-            previous_error = error
-
-            # Small delay to allow movement to start
-            time.sleep(1.0)
-            iteration += 1
+            # Move the motor by the calculated output, unless the last move is still running
+            now = time.monotonic()
+            if now < move_end:
+                return False
+            output = int(round(pid.update(error)))
+            if output != 0:
+                pidlog.debug("Iteration %d: Current Position: %d, Error: %d, Output: %d, Velocity: %s",
+                             iteration, current_position, error, output, self.velocity)
+                self.queryBatch([commands.text('DI', output), 'FL'])
+                self.moveDistance = output
+                duration = moveTime(output / STEP_PER_REVOLUTION, self.velocity, self.accelRate, self.deaccelRate)
+                move_end = now + (duration if math.isfinite(duration) else 1.0)
+            return False
+
+        iterations = loop.run(step, lambda: self.stop_PID_control or not self.connected, max_iterations)
+        if self.stop_PID_control:
+            pidlog.info("PID control stopped by user.")
+        elif max_iterations != -1 and iterations >= max_iterations:
+            pidlog.info("Max iterations reached. Final position: %d, Target position: %d", self.position, target_position)
+        self.stop_PID_control = True
+        pidlog.info("PID loop: %s", loop.stats)
 
         self.stopSpin()
+        return loop.stats
 
     def get_last_message(self):
         return self.last_message
 
     def queryNumber(self, message, outputMsg=True, timeout=2.0):
         self.send_message(message, outputMsg)
-        if self.last_message and '=' in self.last_message:
-            temp = self.last_message.split('=')[1].strip()
-            # Check if temp is a number
+        value = self.parseNumber(self.last_message)
+        if math.isnan(value) and self.last_message is not None:
+            self.metrics.count('nan_replies')
+        if message in STATIC_KEYS and not math.isnan(value):
+            self.cache.record(message, value, RegisterCache.READ)
+        return value
+
+    def _writeRegister(self, prefix, value, outputMsg=True):
+        """Typed write, e.g. ('VE', 1.5), skipped when the controller already holds the value."""
+        command = commands.WRITE_COMMANDS[prefix]
+        message = command.text(value)
+        register = command.register
+        value = float(message[len(prefix):]) # as sent
+        if register is not None and self.cache.matches(register, value):
+            return None
+        reply = self.send_message(message, outputMsg)
+        if register is not None and reply and reply[0] in '%*': # accepted, or buffered
+            self.cache.record(register, value, RegisterCache.WRITTEN)
+        return reply
+
+    def _invalidateCache(self, message):
+        # a raw write, or a command after which the cached value could be wrong
+        if message.startswith(commands.INVALIDATE_ALL):
+            self.cache.invalidate()
+            return
+        register, _ = commands.writtenRegister(message)
+        if register is not None:
+            self.cache.invalidate(register)
+
+    def queryBatch(self, messages, outputMsg=False):
+        """Pipelined version of queryNumber.
+
+        All the queries are written back-to-back in a single sendall, then the
+        replies are read and matched to the queries in order, so the whole
+        batch costs about one round trip instead of one per query.
+        Returns a list of numbers, NaN for invalid queries or a failed link.
+        """
+        results = [math.nan] * len(messages)
+        valid = [i for i, message in enumerate(messages) if self.checkValidMessage(message)]
+        if not self.connected or not valid:
+            return results
+
+        for i in valid:
+            self._invalidateCache(messages[i]) # writes in the batch, e.g. DI and FL
+        payload = b''.join(commands.frame(messages[i]) for i in valid)
+        with self.ioLock:
+            if not self.connected:
+                return results
             try:
-                temp = float(temp)
-            except ValueError:
-                return math.nan           
-            return temp
-        else:
-            return math.nan
-        
-    def checkValidMessage(self, message):
-        validReadMassages = [ # message that use to read or command
-            'CM', 'JS', 'JA', 'AM', 'AC', 'DE', 'VE', 'DI', 
-            'RUe1', 'CJ', 'SJ', 'SP', 'RE', 'CS',
-            'SHX0H', 'EP', 'RE', 'RL@1', 'QX1', 'SK', 'FL', 'FP',
-            'RU11', 'RUt1', 'RUv1', 'RUw1', 'RUx1', 'RU51',
-            'RU21', 'RU31', 'RU41', 'RU61', 'RU71', 'RU81', 'RU91', 'RU;1', 'QX4', 'IO', 'RMNO'
-        ]
-        validWriteMessages = [ # message that use to write values
-            'AM', 'AC', 'DE', 'VE', 'DI', 'JS', 'JA', 'EP', 'SP',
-            'RL1', 'RL2', 'RL3', 'RL4', 'RL5', 'CS', 'QX1',
-            'RL6', 'RL7', 'RL8', 'RL9', 'IO', 'RLO', 'RUp', 'IO'
-        ]
-
-        for valid_message in validReadMassages:
-            if message == valid_message:
-                return True
-            
-        for valid_message in validWriteMessages:
-            if message.startswith(valid_message):
-                #check the rest of the message is a number
-                try:
-                    value = message[len(valid_message):]
-                    if value.isdigit() or (value.startswith('-') and value[1:].isdigit()) or (value.replace('.', '', 1).isdigit() and value.count('.') < 2):
-                        return True
-                except Exception as e:
-                    return False
-            
-        return False
-
+                level = logging.INFO if outputMsg else logging.DEBUG
+                for i in valid:
+                    self.trace.tx(messages[i])
+                if iolog.isEnabledFor(level):
+                    iolog.log(level, "-> %s", ", ".join(messages[i] for i in valid))
+                start = time.perf_counter()
+                self.sock.sendall(payload)
+                for i in valid:
+                    reply = self.reader.readMessage()
+                    # pipelined, each reply is timed from the batch send, not a round trip of its own
+                    self.metrics.record(metrics.BATCH_PREFIX + commands.mnemonic(messages[i]), time.perf_counter() - start)
+                    self.trace.rx(reply)
+                    iolog.log(level, "<-|%s|", reply)
+                    results[i] = self.parseNumber(reply)
+                    if math.isnan(results[i]) and not (reply and reply[0] in '%*'): # * buffered, % accepted
+                        self.metrics.count('nan_replies')
+                    if messages[i] in STATIC_KEYS and not math.isnan(results[i]):
+                        self.cache.record(messages[i], results[i], RegisterCache.READ)
+                self.last_message = reply
+                self.lastActivity = time.monotonic()
+                self.metrics.record('batch', time.perf_counter() - start)
+            except Exception as e:
+                self.metrics.count('timeouts' if isinstance(e, socket.timeout) else 'errors')
+                connlog.warning("Batch Send/Receive error: %s", e)
+                self._connectionLost(e)
+        return results
 
     def send_message_oneShot(self, message):
+        # fails fast as send_message, the ConnectionManager does the reconnecting
         if not self.checkValidMessage(message):
             return None
+        return self.send_message(message)
 
-        if not self.connected:
-            print("Not connected to server, attempting to connect...")
-            self.Connect(self.IP, self.port)
-            if not self.connected:
-                print("Failed to reconnect")
-                return None
-        
-        try:
-            # Send message
-            binary_prefix = b'\x00\x07'
-            binary_suffix = b'\x0d'
-            full_message = binary_prefix + message.encode('utf-8') + binary_suffix
-            print("->", message)
-            self.sock.sendall(full_message)
-            
-            # Receive response
-            data = self.sock.recv(1024)  # Buffer size of 1024 bytes
-            decoded_message = data[2:-1].decode('utf-8', errors='ignore')
-            print("<-|{}|".format(decoded_message))
-            self.last_message = decoded_message
-            return self.last_message
-                
-        except Exception as e:
-            print("Send/Receive error:", e)
-            self.connected = False
-            self.disconnect()
+    def _transact(self, message):
+        # one command, one framed reply
+        self.sock.sendall(commands.frame(message))
+        return self.reader.readMessage()
 
     def send_message(self, message, outputMsg = True):
         if not self.checkValidMessage(message):
             return "invalid message"
         # print("Sending message:", message)
+        self._invalidateCache(message)
 
+        # fail fast, the ConnectionManager reconnects in the background
         if not self.connected:
-            print("Not connected to server, attempting to connect...")
-            self.Connect(self.IP, self.port)
-            if not self.connected:
-                print("Failed to reconnect")
-                return "Failed to connect"
+            self.last_message = None
+            return None
 
-        try:
-            # Send message
-            binary_prefix = b'\x00\x07'
-            binary_suffix = b'\x0d'
-            full_message = binary_prefix + message.encode('utf-8') + binary_suffix
-            if outputMsg :
-               print("->", message)
-            self.sock.sendall(full_message)
-            
-            # Receive response
-            data = self.sock.recv(1024)  # Buffer size of 1024 bytes
-            decoded_message = data[2:-1].decode('utf-8', errors='ignore')
-            if outputMsg :
-                print("<-|{}|".format(decoded_message))
-            self.last_message = decoded_message
-            return self.last_message
-                
-        except Exception as e:
-            print("Send/Receive error:", e)
-            self.connected = False
-            print("Attempting to reconnect and resend...")
-            self.Connect(self.IP, self.port)
-            
-            if self.connected:
-                try:
-                    # Retry sending message
-                    full_message = binary_prefix + message.encode('utf-8') + binary_suffix
-                    print("->", message)
-                    self.sock.sendall(full_message)
-                    
-                    # Receive response
-                    data = self.sock.recv(1024)
-                    decoded_message = data[2:-1].decode('utf-8', errors='ignore')
-                    print("<-|{}|".format(decoded_message))
-                    self.last_message = decoded_message
-                    return self.last_message
-                except Exception as retry_e:
-                    print("Retry Send/Receive error:", retry_e)
-                    self.connected = False
-                    self.disconnect()
-                    self.last_message = None
-                    return None
-            else:
-                print("Reconnection failed")
+        with self.ioLock:
+            if not self.connected:
                 self.last_message = None
                 return None
+            try:
+                level = logging.INFO if outputMsg else logging.DEBUG
+                iolog.log(level, "-> %s", message)
+                self.trace.tx(message)
+                start = time.perf_counter()
+                self.last_message = self._transact(message)
+                self.metrics.record(commands.mnemonic(message), time.perf_counter() - start)
+                self.lastActivity = time.monotonic()
+                self.trace.rx(self.last_message)
+                iolog.log(level, "<-|%s|", self.last_message)
+                return self.last_message
+
+            except Exception as e:
+                self.metrics.count('timeouts' if isinstance(e, socket.timeout) else 'errors')
+                connlog.warning("Send/Receive error: %s", e)
+                self._connectionLost(e)
+                return None
         
     def test_connection_loss(self):
         interval = 0.0
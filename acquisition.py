@@ -0,0 +1,246 @@
+import time
+
+from PyQt6.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal
+
+import wheel_log
+from Library import Controller
+from poll_scheduler import PollScheduler
+from telemetry import Telemetry, ControllerStatus
+
+log = wheel_log.getLogger("gui")
+
+class AcquisitionWorker(QObject):
+    """Owns the Controller socket and does all the controller I/O in its own QThread.
+
+    The GUI never touches the Controller directly. It queues commands with
+    submit(name, *args), which run in order on the worker thread, and gets
+    back immutable snapshots:
+      telemetryReady(Telemetry)        every poll, only the registers due in
+                                       the PollScheduler are read
+      statusReady(ControllerStatus)    after every command
+      commandFinished(name, result, tag)
+      connectionChanged(bool)
+      connectionEvent(ConnectionEvent) link lost, reconnect attempts and
+                                       reconnects, see connection_manager
+
+    Command names are Controller methods (setSweepSpeed, send_message, ...)
+    or one of the worker commands: connect, disconnect, setState, expect,
+    clearExpectation, setPolling, sleep, shutdown. setState(state) selects
+    the poll rates, expect(eta, keys) polls keys densely around the
+    expected end of a move only, see poll_scheduler and motion_profile.
+    The poll timer is single shot, armed for when the next register is due.
+    """
+    telemetryReady = pyqtSignal(object)
+    statusReady = pyqtSignal(object)
+    commandFinished = pyqtSignal(str, object, str)
+    connectionChanged = pyqtSignal(bool)
+    connectionEvent = pyqtSignal(object)
+
+    _commandRequested = pyqtSignal(str, tuple, str)
+
+    def __init__(self, controller=None, scheduler=None):
+        super().__init__()
+        self.controller = controller if controller is not None else Controller()
+        self.scheduler = scheduler if scheduler is not None else PollScheduler()
+        self.polling = True
+        self.timer = None
+        self._wasConnected = False
+        # called in the ConnectionManager thread, the signal is queued to the GUI
+        self.controller.addConnectionListener(self.connectionEvent.emit)
+
+        self._workerCommands = {
+            'connect': self._connect,
+            'disconnect': self.controller.disconnect,
+            'setState': self._setState,
+            'expect': self._expect,
+            'clearExpectation': self._clearExpectation,
+            'setPolling': self._setPolling,
+            'sleep': time.sleep,
+            'shutdown': self._shutdown,
+        }
+
+        self.workerThread = QThread()
+        self.moveToThread(self.workerThread)
+        self.workerThread.started.connect(self._onStarted)
+        self._commandRequested.connect(self._runCommand)
+
+    #======================================= called from the GUI thread
+    def start(self):
+        self.workerThread.start()
+
+    def submit(self, name, *args, tag=""):
+        self._commandRequested.emit(name, args, tag)
+
+    def shutdown(self, timeout=5000):
+        # runs after every command already queued
+        self.submit('shutdown')
+        self.workerThread.wait(timeout)
+
+    #======================================= worker thread
+    def _onStarted(self):
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer) # the dense polls near the end of a move
+        self.timer.timeout.connect(self._poll)
+        self._armTimer()
+
+    def _armTimer(self):
+        if not self.controller.connected or not self.polling:
+            interval = self.scheduler.tick() # nothing is read, do not spin on the due registers
+        else:
+            interval = self.scheduler.untilNext()
+        self.timer.start(int(interval * 1000)) # milliseconds
+
+    def _connect(self, IP, port):
+        self.controller.Connect(IP, port)
+        self.scheduler.reset()
+        if self.timer is not None:
+            self._armTimer()
+
+    def _setState(self, state):
+        self.scheduler.setState(state)
+        if self.timer is not None:
+            self._armTimer()
+
+    def _expect(self, eta, keys=('RUe1',)):
+        self.scheduler.expect(eta, keys)
+        if self.timer is not None:
+            self._armTimer()
+
+    def _clearExpectation(self):
+        self.scheduler.clearExpectation()
+
+    def _setPolling(self, enable):
+        self.polling = enable
+        if self.timer is not None:
+            self._armTimer()
+
+    def _shutdown(self):
+        if self.timer is not None:
+            self.timer.stop()
+        self.controller.disconnect()
+        self.workerThread.quit()
+
+    def _runCommand(self, name, args, tag):
+        result = None
+        try:
+            if name in self._workerCommands:
+                result = self._workerCommands[name](*args)
+            else:
+                result = getattr(self.controller, name)(*args)
+        except Exception as e:
+            log.warning("Command %s%s failed: %s", name, args, e)
+
+        self._checkConnection()
+        self.statusReady.emit(ControllerStatus.fromController(self.controller))
+        self.controller.isQX4Updated = False
+        self.commandFinished.emit(name, result, tag)
+
+    def _poll(self):
+        try:
+            self._read()
+        finally:
+            self._armTimer()
+
+    def _read(self):
+        if not self.polling:
+            return
+        valid = False
+        keys = []
+        if self.controller.connected:
+            keys = self.scheduler.due()
+            if not keys:
+                return
+            start = time.perf_counter()
+            try:
+                valid = self.controller.getTelemetry(keys)
+            except Exception as e:
+                log.warning("Telemetry poll failed: %s", e)
+            self.controller.metrics.record('poll', time.perf_counter() - start)
+        self._checkConnection()
+        self.telemetryReady.emit(Telemetry.fromController(self.controller, valid, keys if valid else ()))
+
+    def _checkConnection(self):
+        if self.controller.connected != self._wasConnected:
+            self._wasConnected = self.controller.connected
+            self.connectionChanged.emit(self._wasConnected)
+
+
+class DaemonWorker(QObject):
+    """Same interface and signals as AcquisitionWorker, for a GUI that is a client of wheel_daemon.
+
+    The daemon owns the controller link and the polling, the commands are
+    sent as RPC calls and its telemetry, status and connection events are
+    re-emitted here. The signals are emitted from the client reader thread,
+    Qt queues them to the GUI thread. wheel_daemon (and asyncio) is only
+    imported by start(), the GUI without --daemon does not load it.
+    """
+    telemetryReady = pyqtSignal(object)
+    statusReady = pyqtSignal(object)
+    commandFinished = pyqtSignal(str, object, str)
+    connectionChanged = pyqtSignal(bool)
+    connectionEvent = pyqtSignal(object)
+
+    def __init__(self, host, port):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.client = None
+        self.wire = None
+        self._wasConnected = False
+
+    def start(self):
+        import wheel_daemon
+        self.wire = wheel_daemon # the client and the event decoders
+        try:
+            self.client = wheel_daemon.WheelClient(self.host, self.port)
+            self.client.subscribe(self._onEvent)
+        except (OSError, RuntimeError) as e:
+            log.error("Cannot reach the wheel daemon at %s:%s: %s", self.host, self.port, e)
+            self.client = None
+            return
+        self._onStatus(self.client.status())
+
+    def submit(self, name, *args, tag=""):
+        if self.client is None:
+            log.warning("Command %s%s not sent, no wheel daemon.", name, args)
+            return
+        if name in ('disconnect', 'sleep'):
+            return # the daemon keeps the link for the other clients, a sleep would hold up all of them
+        # the daemon is connected to its own controller, a connect only refreshes the status
+        call, callArgs = ('getStatus', ()) if name == 'connect' else (name, args)
+        future = self.client.request('call', name=call, args=callArgs)
+        future.add_done_callback(lambda f: self._onReply(name, args, tag, f))
+
+    def shutdown(self, timeout=5000):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def _onReply(self, name, args, tag, future):
+        result = None
+        try:
+            reply = future.result()
+            if reply['error']:
+                log.warning("Command %s%s failed: %s", name, args, reply['error'])
+            else:
+                result = reply['result']
+            if reply.get('status') is not None:
+                self._onStatus(self.wire.decodeStatus(reply['status']))
+        except ConnectionError as e:
+            log.warning("Command %s%s failed: %s", name, args, e)
+        self.commandFinished.emit(name, result, tag)
+
+    def _onStatus(self, status):
+        if status.connected != self._wasConnected:
+            self._wasConnected = status.connected
+            self.connectionChanged.emit(status.connected)
+        self.statusReady.emit(status)
+
+    def _onEvent(self, event, data):
+        if event == 'telemetry':
+            self.telemetryReady.emit(self.wire.decodeTelemetry(data))
+        elif event == 'status':
+            self._onStatus(self.wire.decodeStatus(data))
+        elif event == 'connection':
+            self.connectionEvent.emit(self.wire.decodeConnectionEvent(data))
@@ -0,0 +1,336 @@
+import asyncio
+import collections
+import logging
+import math
+
+import commands
+import wheel_log
+from Library import (ControllerState, STEP_PER_REVOLUTION, FRAME_HEADER, FRAME_END,
+                     STATUS_KEYS, TELEMETRY_KEYS, QX4_PARAMETER_KEYS)
+
+log = wheel_log.getLogger("controller")
+iolog = wheel_log.getLogger("io")
+connlog = wheel_log.getLogger("conn")
+
+class AsyncController(ControllerState):
+    """asyncio version of Library.Controller.
+
+    Same setters and getters, as coroutines. Every request is written to the
+    stream immediately and its reply is matched in order by a single reader
+    task, so many requests can be in flight at once, e.g.
+
+        ctrl = AsyncController()
+        await ctrl.Connect('192.168.203.68', 7776)
+        pos, temp = await asyncio.gather(ctrl.getPosition(), ctrl.getTemperature())
+
+    Each request has its own timeout (asyncio.TimeoutError is raised) and can
+    be cancelled; a late reply is still consumed so the ordering is kept.
+    """
+    def __init__(self, timeout=1.0):
+        super().__init__()
+        self.IP = '192.168.203.68'
+        self.port = 7776
+        self.timeout = timeout # sec, default per-request timeout
+        self.connected = False
+        self.last_message = None
+
+        self._reader = None
+        self._writer = None
+        self._readTask = None
+        self._pending = collections.deque() # futures waiting for a reply, in send order
+
+    async def Connect(self, IP, port):
+        self.IP = IP
+        self.port = port
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.IP, self.port), self.timeout)
+            self.connected = True
+        except (OSError, asyncio.TimeoutError) as e:
+            connlog.warning("Connect error: %s", e)
+            return
+
+        self._readTask = asyncio.get_running_loop().create_task(self._readLoop())
+        await self.getStatus()
+
+    async def disconnect(self):
+        self.connected = False
+        if self._readTask is not None:
+            self._readTask.cancel()
+            self._readTask = None
+        self._failPending(ConnectionError("disconnected"))
+        if self._writer is not None:
+            try:
+                self._writer.close()
+                await self._writer.wait_closed()
+                connlog.info("Disconnected from server.")
+            except Exception as e:
+                connlog.warning("Error while disconnecting: %s", e)
+        self._reader = None
+        self._writer = None
+
+    async def _readLoop(self):
+        try:
+            while True:
+                frame = await self._reader.readuntil(FRAME_END)
+                if frame[:2] == FRAME_HEADER:
+                    frame = frame[2:]
+                reply = frame[:-1].decode('utf-8', errors='ignore')
+                if not self._pending:
+                    iolog.warning("Unexpected reply: %s", reply)
+                    continue
+                future = self._pending.popleft()
+                if not future.done(): # timed out or cancelled futures just drop their reply
+                    future.set_result(reply)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            connlog.warning("Receive error: %s", e)
+            self.connected = False
+            self._failPending(ConnectionError("connection lost"))
+
+    def _failPending(self, error):
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    def _submit(self, message):
+        # write one frame and queue the future for its reply, no await in between keeps the order
+        if not self.connected:
+            raise ConnectionError("not connected to controller")
+        future = asyncio.get_running_loop().create_future()
+        self._writer.write(commands.frame(message))
+        self._pending.append(future)
+        return future
+
+    async def send_message(self, message, outputMsg = True, timeout=None):
+        if not self.checkValidMessage(message):
+            return "invalid message"
+        level = logging.INFO if outputMsg else logging.DEBUG
+        iolog.log(level, "-> %s", message)
+        future = self._submit(message)
+        await self._writer.drain()
+        reply = await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        iolog.log(level, "<-|%s|", reply)
+        self.last_message = reply
+        return reply
+
+    async def queryNumber(self, message, outputMsg=True, timeout=None):
+        return self.parseNumber(await self.send_message(message, outputMsg, timeout))
+
+    async def queryBatch(self, messages, outputMsg=False, timeout=None):
+        """All queries are written before the first reply is awaited, NaN for invalid ones."""
+        return list(await asyncio.gather(*[self.queryNumber(message, outputMsg, timeout)
+                                           if self.checkValidMessage(message) else self._nan()
+                                           for message in messages]))
+
+    @staticmethod
+    async def _nan():
+        return math.nan
+
+    #======================================= status
+    async def getStatus(self):
+        if self.connected:
+            self._applyStatus(dict(zip(STATUS_KEYS, await self.queryBatch(STATUS_KEYS))))
+
+            # firmware set the minimm sweep speed to 6 rpm
+            if self.sweepSpeed < 6 :
+                self.sweepSpeed = 6.0
+                await self.setSweepSpeed(6.0)
+
+    async def getTelemetry(self, keys=TELEMETRY_KEYS):
+        if not self.connected:
+            return False
+        return self._applyTelemetry(await self.queryBatch(keys), keys)
+
+    async def getIOStatus(self):
+        if self.connected:
+            self.io_status = int(await self.queryNumber('IO', False)) & 0xFF # 8-bit status
+        return self.io_status
+
+    async def getFirmwareProgramStatus(self):
+        if self.connected:
+            self.FWprogram = int(await self.queryNumber('RUp1', False))
+        return self.FWprogram
+
+    async def getPosition(self, outputMsg=True):
+        if not self.connected:
+            return math.nan
+        value = await self.queryNumber('RUe1', outputMsg)
+        if math.isnan(value):
+            return math.nan
+        self.position = int(value)
+        return self.position
+
+    async def getTemperature(self, outputMsg=True):
+        if not self.connected:
+            return math.nan
+        self.temperature = await self.queryNumber('RUt1', outputMsg) / 10 # temperature in C
+        return self.temperature
+
+    async def getEncoderVelocity(self, outputMsg=True):
+        if not self.connected:
+            return math.nan
+        self.encoderVelocity = await self.queryNumber('RUv1', outputMsg) / 4. # in rpm
+        return self.encoderVelocity
+
+    async def getMotorVelocity(self, outputMsg=True):
+        if not self.connected:
+            return math.nan
+        self.motorVelocity = await self.queryNumber('RUw1', outputMsg) / 4. # in rpm
+        return self.motorVelocity
+
+    async def getTorque(self, outputMsg=True):
+        if not self.connected:
+            return math.nan
+        self.torque = await self.queryNumber('RUx1', outputMsg) - self.torque_ref
+        return self.torque
+
+    #======================================= motion
+    async def seekHome(self):
+        if self.connected:
+            log.info("Seeking home position...")
+            direction = -1* math.sin(2*math.pi * self.position / STEP_PER_REVOLUTION)
+            await self.send_message('DI100' if direction >= 0 else 'DI-100')
+
+            await self.getTorque()
+            self.torque_ref = self.torque # set the current torque as the reference
+            self.torque = self.torque - self.torque_ref
+
+            await self.send_message('SHX0H') #seek home
+
+    async def setEncoderPosition(self, position):
+        if self.connected and self.isSpinning == False:
+            log.info("Setting encoder position to %s...", position)
+            await self.send_message(f'EP{position}')
+
+    async def reset(self):
+        if self.connected:
+            log.info("Resetting controller...")
+            await self.send_message('RE')
+            await asyncio.sleep(0.1)
+            await self.seekHome()
+            self.isSpinning = False
+
+    async def setMaxAccel(self, accel):
+        if self.connected:
+            await self.send_message(commands.text('AM', accel))
+            self.maxAccel = accel
+    async def setAccelRate(self, accel):
+        if self.connected:
+            await self.send_message(commands.text('AC', accel))
+            self.accelRate = accel
+    async def setDeaccelRate(self, deaccel):
+        if self.connected:
+            await self.send_message(commands.text('DE', deaccel))
+            self.deaccelRate = deaccel
+    async def setVelocity(self, velocity):
+        if self.connected:
+            await self.send_message(commands.text('VE', velocity))
+            self.velocity = velocity
+    async def setMoveDistance(self, distance : int):
+        if self.connected:
+            await self.send_message(commands.text('DI', distance))
+            self.moveDistance = distance
+
+    async def setJogSpeed(self, speed : float):
+        if self.connected:
+            await self.send_message(commands.text('JS', speed))
+            self.jogSpeed = speed
+    async def setJogAccel(self, accel : float):
+        if self.connected:
+            await self.send_message(commands.text('JA', accel))
+            self.jogAccel = accel
+    async def startSpin(self):
+        if self.connected:
+            log.info("Starting spin...")
+            await self.send_message('CJ')
+            self.isSpinning = True
+    async def stopSpin(self):
+        if self.connected:
+            log.info("Stopping spin...")
+            await self.send_message('SJ')
+            self.isSpinning = False
+
+    #======================================= sweep
+    async def setSweepMask(self, mask : int):
+        if self.connected:
+            self.sweepMask = mask
+            await self.send_message(commands.text('RL1', mask))
+    async def setSpokeWidth(self, width : int):
+        if self.connected:
+            self.spokeWidth = width
+            await self.send_message(commands.text('RL2', width))
+    async def setSpokeOffset(self, width : int):
+        if self.connected:
+            self.spokeOffset = width
+            await self.send_message(commands.text('RL3', width))
+    async def setSweepSpeed(self, speed : float):
+        if self.connected:
+            self.sweepSpeed = speed  # in rpm
+            await self.send_message(commands.text('RL4', int(speed * 4)))
+    async def setSweepCutOff(self, cutoff : float):
+        if self.connected:
+            self.sweepCutOff = cutoff # in rpm
+            await self.send_message(commands.text('RL5', int(cutoff * 4)))
+
+    async def startSpinSweep(self):
+        if self.connected:
+            log.info("Starting spin sweep...")
+            await self.send_message('RMNO') #holding motor current
+            await asyncio.sleep(0.1)
+            await self.send_message('RLO0') #release the motor?
+            await self.send_message('QX1')
+            self.isSpinning = True
+
+    async def stopSpinSweep(self):
+        if self.connected:
+            log.info("Stopping spin sweep...")
+            await self.setSweepSpeed(0)
+
+    #======================================= QX4
+    async def setQX4EncoderDemandPos(self, position):
+        if self.connected:
+            await self.send_message(commands.text('RL6', position))
+            self.qx4EncoderDemandPos = position
+
+    async def setQX4ControUpdate(self, update):
+        if self.connected:
+            await self.send_message(commands.text('RL7', update))
+            self.qx4ControUpdate = update
+
+    async def setQX4SlewSpeed(self, speed):
+        if self.connected:
+            await self.send_message(commands.text('RL8', speed))
+            self.qx4SlewSpeed = speed
+
+    async def setQX4ServoSlewSpeed(self, speed):
+        if self.connected:
+            await self.send_message(commands.text('RL9', speed))
+            self.qx4ServoSlewSpeed = speed
+
+    async def getQX4MotorDemandPos(self):
+        if not self.connected:
+            return math.nan
+        self.qx4MotorDemandPos = int(await self.queryNumber('RU;1', False))
+        return self.qx4MotorDemandPos
+
+    async def getQX4Parameters(self):
+        if self.connected:
+            self._applyQX4Parameters(await self.queryBatch(QX4_PARAMETER_KEYS))
+
+    async def startQX4LockPosition(self):
+        if self.connected:
+            log.info("Starting QX4 Lock Position...")
+            await self.send_message('QX4')
+            await asyncio.sleep(0.1)
+            await self.getQX4Parameters()
+
+    async def stopQX4LockPosition(self):
+        if self.connected:
+            log.info("Stopping QX4 Lock Position...")
+            await self.send_message('SK')
+            await self.send_message('IO7')
+            await self.send_message('RLO0')
+            await self.getQX4Parameters()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Transport benchmark for Library.Controller against the local simulator.
+
+For every injected round trip time it measures
+  - per-command latency (p50/p95/p99) of send_message / queryNumber
+  - full status refreshes (getStatus(full=True)) per second, every register
+    read as before the static key cache, and the default getStatus() that
+    skips the cached static keys, reported apart
+  - acquisition ticks per second (getTelemetry + Telemetry snapshot, what
+    AcquisitionWorker does every poll)
+and writes everything as JSON, so transport changes can be compared over time:
+
+    python3 benchmark.py --rtt 0,1,5,10 --output bench.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from Library import Controller
+from simulator import Simulator
+from telemetry import Telemetry
+
+QUERY_COMMANDS = ['RUe1', 'IO', 'RUt1', 'VE', 'RU41']
+WRITE_COMMANDS = ['VE1.0', 'RL41000']
+
+def latencyStats(samples):
+    ms = np.asarray(samples) * 1000.
+    return {
+        'n': int(ms.size),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+def rate(function, duration):
+    # calls per second of function over about duration seconds
+    count = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return count / elapsed
+
+def benchmarkRTT(rtt, jitter, split, samples, duration):
+    simulator = Simulator(port=0, latency=rtt, jitter=jitter, split=split).start()
+    controller = Controller()
+    try:
+        controller.Connect(*simulator.address)
+        if not controller.connected:
+            raise RuntimeError("cannot connect to the simulator")
+
+        commands = {}
+        for command in QUERY_COMMANDS + WRITE_COMMANDS:
+            times = []
+            for _ in range(samples):
+                start = time.perf_counter()
+                controller.send_message(command, False)
+                times.append(time.perf_counter() - start)
+            commands[command] = latencyStats(times)
+
+        times = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            controller.queryNumber('RUe1', False)
+            times.append(time.perf_counter() - start)
+        queryNumber = latencyStats(times)
+
+        def tick():
+            controller.getTelemetry()
+            Telemetry.fromController(controller)
+
+        return {
+            'rtt_ms': rtt * 1000.,
+            'jitter_ms': jitter * 1000.,
+            'split_bytes': split,
+            'commands': commands,
+            'queryNumber': queryNumber,
+            'status_per_sec': rate(lambda: controller.getStatus(full=True), duration),
+            'cached_status_per_sec': rate(controller.getStatus, duration),
+            'ticks_per_sec': rate(tick, duration),
+        }
+    finally:
+        controller.disconnect()
+        simulator.stop()
+
+def gitRevision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+def main():
+    parser = argparse.ArgumentParser(description="Controller transport benchmark")
+    parser.add_argument('--rtt', default='0,1,5,10', help="comma separated injected round trip times [ms]")
+    parser.add_argument('--jitter', type=float, default=0.0, help="reply jitter [ms]")
+    parser.add_argument('--split', type=int, default=0, help="split replies in chunks of this many bytes")
+    parser.add_argument('--samples', type=int, default=200, help="samples per command")
+    parser.add_argument('--duration', type=float, default=2.0, help="seconds per rate measurement")
+    parser.add_argument('--output', default='-', help="JSON output file, - for stdout")
+    args = parser.parse_args()
+
+    results = []
+    for rtt in [float(x) for x in args.rtt.split(',') if x.strip()]:
+        print(f"Benchmarking RTT {rtt} ms...", file=sys.stderr)
+        result = benchmarkRTT(rtt / 1000., args.jitter / 1000., args.split, args.samples, args.duration)
+        print(f"  RUe1 p50 {result['commands']['RUe1']['p50_ms']:.2f} ms, "
+              f"status {result['status_per_sec']:.1f}/s (cached {result['cached_status_per_sec']:.1f}/s), ticks {result['ticks_per_sec']:.1f}/s", file=sys.stderr)
+        results.append(result)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git': gitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""The eSCL command set used with the controller, built once at import.
+
+Every command the programs send is defined here: the argument-less ones
+(queries like RUe1 and actions like CJ) and the ones that take a number
+(AC10.000, RL424, ...). Library.py, async_controller.py, motor_control.py
+and the GUI "Send CMD" field all validate and encode through this table.
+
+  isValid(message)     O(1) check, a dict lookup by prefix
+  frame(message)       framed bytes, pre-encoded for the fixed queries
+  text(prefix, arg)    message of a typed write, e.g. text('VE', 1.5) == 'VE1.5'
+  encode(prefix, arg)  framed bytes of the same
+"""
+import re
+
+FRAME_HEADER = b'\x00\x07'
+FRAME_END = b'\x0d'
+
+# commands without argument, queries and actions
+QUERY_COMMANDS = [
+    'CM', 'JS', 'JA', 'AM', 'AC', 'DE', 'VE', 'DI',
+    'RUe1', 'CJ', 'SJ', 'SP', 'RE', 'CS',
+    'SHX0H', 'EP', 'RL@1', 'QX1', 'SK', 'FL', 'FP',
+    'RU11', 'RUt1', 'RUv1', 'RUw1', 'RUx1', 'RU51',
+    'RU21', 'RU31', 'RU41', 'RU61', 'RU71', 'RU81', 'RU91', 'RU;1', 'QX4', 'IO', 'RMNO',
+    'RUp1',
+]
+
+# commands followed by a number
+class Command():
+    """A write command: prefix, argument type and format spec, and the register it sets (as read back)."""
+    __slots__ = ('prefix', 'argType', 'spec', 'register', '_head')
+
+    def __init__(self, prefix, argType, spec, register=None):
+        self.prefix = prefix
+        self.argType = argType
+        self.spec = spec
+        self.register = register
+        self._head = FRAME_HEADER + prefix.encode('ascii')
+
+    def text(self, value):
+        return self.prefix + format(self.argType(value), self.spec)
+
+    def encode(self, value):
+        return self._head + format(self.argType(value), self.spec).encode('ascii') + FRAME_END
+
+WRITE_COMMANDS = {command.prefix: command for command in [
+    Command('AM', float, '.3f', 'AM'),  # max acceleration, rev/sec/sec
+    Command('AC', float, '.3f', 'AC'),  # acceleration, rev/sec/sec
+    Command('DE', float, '.3f', 'DE'),  # deceleration, rev/sec/sec
+    Command('VE', float, '.1f', 'VE'),  # velocity, rev/sec
+    Command('DI', float, '.0f', 'DI'),  # move distance, steps
+    Command('JS', float, '.1f', 'JS'),  # jog speed, rev/sec
+    Command('JA', float, '.3f', 'JA'),  # jog acceleration, rev/sec/sec
+    Command('EP', int, 'd', 'RUe1'),    # encoder position, steps
+    Command('SP', int, 'd'),
+    Command('CS', int, 'd'),
+    Command('QX1', int, 'd'),
+    Command('RL1', int, 'd', 'RU11'),   # sweep mask
+    Command('RL2', int, 'd', 'RU21'),   # spoke width, steps
+    Command('RL3', int, 'd', 'RU31'),   # spoke offset, steps
+    Command('RL4', int, 'd', 'RU41'),   # sweep speed, 0.25 rpm/unit
+    Command('RL5', int, 'd', 'RU51'),   # sweep cut off, 0.25 rpm/unit
+    Command('RL6', int, 'd', 'RU61'),   # QX4 encoder demand position, steps
+    Command('RL7', int, 'd', 'RU71'),   # QX4 control update, 100 us/unit
+    Command('RL8', int, 'd', 'RU81'),   # QX4 slew speed, 0.25 rpm/unit
+    Command('RL9', int, 'd', 'RU91'),   # QX4 servo slew speed, 0.25 rpm/unit
+    Command('RLO', int, 'd'),
+    Command('RUp', int, 'd'),
+    Command('IO', int, 'd', 'IO'),      # output bits
+]}
+
+# commands after which any register may have changed: reset, and the
+# Q programs, which run their own commands on the controller
+INVALIDATE_ALL = ('RE', 'QX', 'SK')
+
+_QUERIES = frozenset(QUERY_COMMANDS)
+_NUMBER = re.compile(r'-?\d+|\d+\.\d*|\d*\.\d+')
+_FRAMES = {name: FRAME_HEADER + name.encode('ascii') + FRAME_END for name in QUERY_COMMANDS}
+
+def names():
+    return sorted(_QUERIES | WRITE_COMMANDS.keys())
+
+def lookup(message):
+    """(Command, argument text) of a write command, (None, None) otherwise."""
+    for command in (WRITE_COMMANDS.get(message[:3]), WRITE_COMMANDS.get(message[:2])):
+        if command is not None and len(message) > len(command.prefix):
+            argument = message[len(command.prefix):]
+            if _NUMBER.fullmatch(argument):
+                return command, argument
+    return None, None
+
+def mnemonic(message):
+    """The command of a message without its argument, e.g. 'RL6' for 'RL61024', for the metrics."""
+    if message in _QUERIES:
+        return message
+    command, _ = lookup(message)
+    return command.prefix if command is not None else message
+
+def isValid(message):
+    return message in _QUERIES or lookup(message)[0] is not None
+
+def frame(message):
+    """The framed bytes of any message, the fixed queries are pre-encoded."""
+    cached = _FRAMES.get(message)
+    if cached is not None:
+        return cached
+    return FRAME_HEADER + message.encode('utf-8') + FRAME_END
+
+def text(prefix, value):
+    """The message of a typed write, e.g. text('RL4', 24) == 'RL424'."""
+    return WRITE_COMMANDS[prefix].text(value)
+
+def encode(prefix, value):
+    return WRITE_COMMANDS[prefix].encode(value)
+
+def writtenRegister(message):
+    """(register, value) set by a write command, (None, None) for other commands."""
+    command, argument = lookup(message)
+    if command is None or command.register is None:
+        return None, None
+    return command.register, float(argument)
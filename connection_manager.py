@@ -0,0 +1,120 @@
+import socket
+import threading
+import time
+from dataclasses import dataclass
+
+import wheel_log
+
+log = wheel_log.getLogger("conn")
+
+CONNECTED = 'connected'
+DISCONNECTED = 'disconnected'
+RECONNECTING = 'reconnecting'
+
+@dataclass(frozen=True)
+class ConnectionEvent:
+    """Passed to the connection listeners, see Controller.addConnectionListener."""
+    state: str # CONNECTED, DISCONNECTED or RECONNECTING
+    timestamp: float = 0.0 # time.monotonic()
+    attempt: int = 0 # reconnect attempts since the link was lost
+    delay: float = 0.0 # sec until the next attempt, RECONNECTING only
+    downtime: float = 0.0 # sec since the link was lost, CONNECTED after a reconnect
+    error: str = ""
+
+def tuneSocket(sock, keepalive_idle=5, keepalive_interval=2, keepalive_count=3):
+    """TCP_NODELAY for the small command frames, and keepalive so a dead link is noticed by the OS."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # per socket keepalive timing, where the platform has it
+    for option, value in (('TCP_KEEPIDLE', keepalive_idle), ('TCP_KEEPALIVE', keepalive_idle),
+                          ('TCP_KEEPINTVL', keepalive_interval), ('TCP_KEEPCNT', keepalive_count)):
+        if hasattr(socket, option):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+            except OSError:
+                pass
+
+
+class ConnectionManager(threading.Thread):
+    """Keeps a Controller connected from a background thread.
+
+    When the link is lost (Controller._connectionLost) the controller only
+    closes the socket and wakes this thread, which reconnects with
+    exponential backoff, min_delay doubling up to max_delay. Nobody else
+    blocks on a connect meanwhile: requests fail fast while disconnected.
+    While connected, a heartbeat query is sent when the link has been idle
+    for heartbeat_interval, so a dead link is found even when nothing polls.
+
+    Every state change is passed to controller.connectionListeners as a
+    ConnectionEvent, in the thread that noticed it.
+    """
+    def __init__(self, controller, min_delay=0.5, max_delay=30.0, heartbeat_interval=2.0):
+        super().__init__(daemon=True)
+        self.controller = controller
+        self.min_delay = min_delay # sec
+        self.max_delay = max_delay # sec
+        self.heartbeat_interval = heartbeat_interval # sec
+        self.attempt = 0
+        self.lostSince = None # time.monotonic() when the link was lost
+        self._wake = threading.Event()
+        self._stopEvent = threading.Event()
+
+    #======================================= any thread
+    def notify(self, state, **info):
+        event = ConnectionEvent(state, time.monotonic(), **info)
+        for callback in list(self.controller.connectionListeners):
+            try:
+                callback(event)
+            except Exception as e:
+                log.warning("Connection listener failed: %s", e)
+
+    def connectionLost(self, error=""):
+        if self.lostSince is None:
+            self.lostSince = time.monotonic()
+            self.notify(DISCONNECTED, error=str(error))
+        self._wake.set()
+
+    def connectionMade(self):
+        downtime = 0.0 if self.lostSince is None else time.monotonic() - self.lostSince
+        self.lostSince = None
+        self.attempt = 0
+        self.notify(CONNECTED, downtime=downtime)
+
+    def stop(self, timeout=2.0):
+        self._stopEvent.set()
+        self._wake.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    #======================================= manager thread
+    def run(self):
+        while not self._stopEvent.is_set():
+            controller = self.controller
+            if controller.connected:
+                idle = time.monotonic() - controller.lastActivity
+                if idle >= self.heartbeat_interval:
+                    controller.heartbeat()
+                    idle = 0.0
+                self._wait(self.heartbeat_interval - idle)
+                continue
+
+            self.attempt += 1
+            if controller._open():
+                if self._stopEvent.is_set():
+                    break # disconnect() closes the socket
+                controller.getStatus() # the controller may have been restarted
+                if controller.connected:
+                    controller.metrics.count('reconnects')
+                    self.connectionMade()
+                    continue
+                # lost again during the status refresh, a failed attempt, the backoff is not skipped
+                if not self._stopEvent.is_set():
+                    self._wake.clear()
+            controller.metrics.count('retries')
+            delay = min(self.max_delay, self.min_delay * 2 ** (self.attempt - 1))
+            self.notify(RECONNECTING, attempt=self.attempt, delay=delay)
+            self._wait(delay)
+
+    def _wait(self, timeout):
+        self._wake.wait(max(0.0, timeout))
+        self._wake.clear()
@@ -0,0 +1,127 @@
+import collections
+import math
+import time
+
+import numpy as np
+
+class PID():
+    """Discrete PID on the position error, integral over the last history_length errors."""
+    def __init__(self, Kp=0.5, Ki=0.0, Kd=0.1, history_length=10, limit=None):
+        self.Kp = Kp
+        self.Ki = Ki
+        self.Kd = Kd
+        self.limit = limit # |output| is clipped to this, None for no limit
+        self.history = collections.deque(maxlen=history_length)
+        self.previous_error = 0.0
+
+    def reset(self):
+        self.history.clear()
+        self.previous_error = 0.0
+
+    def update(self, error):
+        self.history.append(error)
+        integral = sum(self.history)
+        derivative = error - self.previous_error
+        self.previous_error = error
+
+        output = self.Kp * error + self.Ki * integral + self.Kd * derivative
+        if self.limit is not None:
+            output = max(-self.limit, min(self.limit, output))
+        return output
+
+
+class LoopStats():
+    """Per iteration timing of a ControlLoop, the last `size` iterations are kept.
+
+    jitter  : sec the iteration started after its deadline
+    latency : sec spent in the iteration, i.e. the I/O with the controller
+    overruns: iterations that took longer than the period, the missed deadlines are skipped
+    """
+    def __init__(self, size=10000):
+        self.jitter = collections.deque(maxlen=size)
+        self.latency = collections.deque(maxlen=size)
+        self.iterations = 0
+        self.overruns = 0
+
+    def record(self, jitter, latency):
+        self.jitter.append(jitter)
+        self.latency.append(latency)
+        self.iterations += 1
+
+    def summary(self):
+        """{'jitter': {...}, 'latency': {...}} in ms, mean, p50, p95, p99 and max."""
+        result = {'iterations': self.iterations, 'overruns': self.overruns}
+        for name in ('jitter', 'latency'):
+            values = np.asarray(getattr(self, name)) * 1e3
+            if len(values) == 0:
+                result[name] = {}
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[name] = {'mean': float(values.mean()), 'p50': float(p50), 'p95': float(p95),
+                            'p99': float(p99), 'max': float(values.max())}
+        return result
+
+    def __str__(self):
+        s = self.summary()
+        text = f"{s['iterations']} iterations, {s['overruns']} overruns"
+        for name in ('latency', 'jitter'):
+            if s[name]:
+                text += f", {name} mean {s[name]['mean']:.2f} p95 {s[name]['p95']:.2f} max {s[name]['max']:.2f} ms"
+        return text
+
+
+class ControlLoop():
+    """Calls step(iteration) every period seconds on monotonic deadlines.
+
+    The deadlines are start + n * period, so the rate does not drift with the
+    time spent in step(). When an iteration overruns, the deadlines it
+    missed are skipped instead of running the following iterations back to
+    back. The loop ends when step() returns True, or when should_stop()
+    returns True, which is checked before every iteration (cooperative
+    cancellation, e.g. lambda: controller.stop_PID_control).
+    """
+    def __init__(self, period=0.05, stats=None):
+        self.period = period # sec
+        self.stats = stats if stats is not None else LoopStats()
+
+    def run(self, step, should_stop=None, max_iterations=-1):
+        """Returns the number of iterations run."""
+        period = self.period
+        start = time.monotonic()
+        deadline = start
+        iteration = 0
+        while max_iterations == -1 or iteration < max_iterations:
+            if should_stop is not None and should_stop():
+                break
+
+            now = time.monotonic()
+            if now < deadline:
+                time.sleep(deadline - now)
+            begin = time.monotonic()
+            done = step(iteration)
+            end = time.monotonic()
+            self.stats.record(begin - deadline, end - begin)
+            iteration += 1
+            if done:
+                break
+
+            deadline += period
+            if end > deadline:
+                self.stats.overruns += 1
+                deadline = start + math.ceil((end - start) / period) * period
+        return iteration
+
+def moveTime(distance, velocity, accel, decel=None):
+    """sec of a trapezoidal (triangular when short) move, distance in rev, velocity in rev/sec, accel/decel in rev/sec/sec."""
+    distance = abs(distance)
+    decel = accel if decel is None else decel
+    if distance == 0:
+        return 0.0
+    if velocity <= 0 or accel <= 0 or decel <= 0:
+        return math.inf
+    # distance to reach velocity and to stop again
+    ramp = velocity**2 / 2 * (1 / accel + 1 / decel)
+    if distance >= ramp:
+        return velocity / accel + velocity / decel + (distance - ramp) / velocity
+    peak = math.sqrt(2 * distance / (1 / accel + 1 / decel))
+    return peak / accel + peak / decel
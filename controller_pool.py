@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""Several wheels driven concurrently from one asyncio event loop.
+
+Each wheel is an AsyncController with its own PollScheduler, so the poll
+rates follow the state of that wheel only, and its own telemetry stream.
+All the sockets are served by the one event loop: no thread per
+controller, and a poll of N wheels costs N pipelined batches in flight at
+the same time instead of N round trips one after the other.
+
+    pool = ControllerPool.fromSettings("programSettings.json")
+    queue = pool["wheel1"].subscribe()         # (name, Telemetry) items
+    pool["wheel2"].subscribe(lambda name, telemetry: ...)
+    await pool.start()
+    await pool.call("wheel1", "setSweepSpeed", 12.0)
+    pool["wheel1"].scheduler.setState(SWEEP)
+    ...
+    await pool.stop()
+
+The wheels are listed in programSettings.json under "controllers", see
+loadControllers().
+"""
+import argparse
+import asyncio
+import json
+
+import wheel_log
+from async_controller import AsyncController
+from poll_scheduler import PollScheduler
+from telemetry import Telemetry
+
+log = wheel_log.getLogger("conn")
+
+RECONNECT_MIN_DELAY = 0.5 # sec, doubled on every failed attempt, as in connection_manager
+RECONNECT_MAX_DELAY = 30.0 # sec
+
+def loadControllers(fileName="programSettings.json"):
+    """[{"name", "IP", "Port"}, ...] from the "controllers" list, or the single IP/Port of the GUI."""
+    with open(fileName, "r") as file:
+        data = json.load(file)[0]
+    controllers = data.get("controllers")
+    if not controllers:
+        return [{"name": "wheel", "IP": data["IP"], "Port": data["Port"]}]
+    return [{"name": entry.get("name", f"wheel{i}"), "IP": entry["IP"], "Port": int(entry.get("Port", 7776))}
+            for i, entry in enumerate(controllers)]
+
+
+class Wheel():
+    """One controller of a ControllerPool, its poll schedule and telemetry subscribers."""
+    def __init__(self, name, IP, port, scheduler=None, timeout=1.0):
+        self.name = name
+        self.IP = IP
+        self.port = port
+        self.controller = AsyncController(timeout)
+        self.scheduler = scheduler if scheduler is not None else PollScheduler()
+        self.callbacks = [] # callback(name, Telemetry)
+        self.queues = [] # asyncio.Queue of (name, Telemetry)
+        self.polls = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.attempted = None # asyncio.Event, set after the first connection attempt
+
+    def subscribe(self, callback=None, maxsize=100):
+        """callback(name, telemetry) on every poll, or, without callback, a new asyncio.Queue.
+
+        A full queue drops its oldest sample, a slow consumer does not hold up the polling.
+        """
+        if callback is not None:
+            self.callbacks.append(callback)
+            return callback
+        queue = asyncio.Queue(maxsize)
+        self.queues.append(queue)
+        return queue
+
+    def unsubscribe(self, subscriber):
+        for subscribers in (self.callbacks, self.queues):
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+
+    def publish(self, telemetry):
+        for callback in list(self.callbacks):
+            try:
+                callback(self.name, telemetry)
+            except Exception as e:
+                log.warning("[%s] telemetry callback failed: %s", self.name, e)
+        for queue in self.queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((self.name, telemetry))
+
+
+class ControllerPool():
+    """Wheels by name, all polled from the running event loop, see the module doc."""
+    def __init__(self, wheels=()):
+        self.wheels = {}
+        self._tasks = {}
+        for wheel in wheels:
+            self.wheels[wheel.name] = wheel
+
+    @classmethod
+    def fromSettings(cls, fileName="programSettings.json", timeout=1.0):
+        return cls(Wheel(entry["name"], entry["IP"], entry["Port"], timeout=timeout)
+                   for entry in loadControllers(fileName))
+
+    def __getitem__(self, name):
+        return self.wheels[name]
+
+    def __iter__(self):
+        return iter(self.wheels.values())
+
+    def __len__(self):
+        return len(self.wheels)
+
+    def add(self, name, IP, port, scheduler=None, timeout=1.0):
+        wheel = Wheel(name, IP, port, scheduler, timeout)
+        self.wheels[name] = wheel
+        if self._tasks: # already started
+            wheel.attempted = asyncio.Event()
+            self._tasks[name] = asyncio.get_running_loop().create_task(self._run(wheel))
+        return wheel
+
+    async def start(self):
+        """Connect and poll every wheel in its own task, returns after the first connection attempt of each.
+
+        A wheel that does not connect is retried with the backoff of _run,
+        it does not hold up the others.
+        """
+        loop = asyncio.get_running_loop()
+        for wheel in self:
+            wheel.attempted = asyncio.Event()
+            self._tasks[wheel.name] = loop.create_task(self._run(wheel))
+        await asyncio.gather(*[wheel.attempted.wait() for wheel in self])
+
+    async def stop(self):
+        tasks, self._tasks = list(self._tasks.values()), {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*[wheel.controller.disconnect() for wheel in self], return_exceptions=True)
+
+    async def call(self, name, method, *args):
+        """await wheels[name].controller.method(*args), e.g. call("wheel1", "seekHome")."""
+        return await getattr(self.wheels[name].controller, method)(*args)
+
+    async def broadcast(self, method, *args):
+        """The same call on every wheel at once, {name: result or exception}."""
+        names = list(self.wheels)
+        results = await asyncio.gather(*[self.call(name, method, *args) for name in names],
+                                       return_exceptions=True)
+        return dict(zip(names, results))
+
+    #======================================= per wheel tasks
+    async def _connect(self, wheel):
+        """True when connected, a controller that accepts the connection but does not answer is a failed attempt."""
+        try:
+            await wheel.controller.Connect(wheel.IP, wheel.port)
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            log.warning("[%s] connection failed: %s", wheel.name, str(e) or type(e).__name__)
+            await wheel.controller.disconnect()
+            return False
+        finally:
+            if wheel.attempted is not None:
+                wheel.attempted.set()
+        wheel.scheduler.reset()
+        return wheel.controller.connected
+
+    async def _run(self, wheel):
+        attempt = 0
+        while True:
+            if not wheel.controller.connected:
+                await wheel.controller.disconnect() # drop the dead stream
+                if await self._connect(wheel):
+                    attempt = 0
+                    wheel.reconnects += 1
+                else:
+                    attempt += 1
+                    wheel.publish(Telemetry.fromController(wheel.controller, False, ()))
+                    await asyncio.sleep(min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** (attempt - 1)))
+                    continue
+
+            keys = wheel.scheduler.due()
+            if keys:
+                valid = False
+                try:
+                    valid = await wheel.controller.getTelemetry(keys)
+                except (ConnectionError, asyncio.TimeoutError) as e:
+                    log.warning("[%s] poll failed: %s", wheel.name, str(e) or type(e).__name__)
+                wheel.polls += 1
+                if not valid:
+                    wheel.failures += 1
+                wheel.publish(Telemetry.fromController(wheel.controller, valid, keys if valid else ()))
+            await asyncio.sleep(wheel.scheduler.untilNext())
+
+#======================================= command line
+async def _monitor(pool, duration):
+    def show(name, telemetry):
+        print(f"{name:>10s} {telemetry.timestamp:12.3f} {'ok' if telemetry.valid else '--'}"
+              f" pos {telemetry.position:8d} {telemetry.motorVelocity:8.2f} rpm {','.join(telemetry.updated)}")
+    for wheel in pool:
+        wheel.subscribe(show)
+    await pool.start()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        await pool.stop()
+    for wheel in pool:
+        print(f"{wheel.name}: {wheel.polls} polls, {wheel.failures} failed, {wheel.reconnects} reconnects")
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll every controller listed in the settings file.")
+    parser.add_argument("--settings", default="programSettings.json")
+    parser.add_argument("--duration", type=float, default=10.0, help="sec")
+    args = parser.parse_args()
+    asyncio.run(_monitor(ControllerPool.fromSettings(args.settings), args.duration))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import os
+import queue
+import threading
+import time
+
+import wheel_log
+
+log = wheel_log.getLogger("influx")
+
+DEFAULT_SPOOL_FILE = "influx_spool.lp"
+
+def _escape(text, chars):
+    for c in chars:
+        text = text.replace(c, '\\' + c)
+    return text
+
+def _fieldValue(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return f'{value}i'
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + _escape(str(value), '\\"') + '"'
+
+def toLineProtocol(measurement, fields, tags=None, timestamp_ns=None):
+    """One InfluxDB line protocol record, NaN fields are skipped."""
+    line = _escape(measurement, ', ')
+    if tags:
+        line += ''.join(f",{_escape(k, ',= ')}={_escape(str(v), ',= ')}" for k, v in sorted(tags.items()))
+    field_set = ','.join(f"{_escape(k, ',= ')}={_fieldValue(v)}" for k, v in fields.items()
+                         if not (isinstance(v, float) and v != v))
+    if not field_set:
+        return None
+    line += ' ' + field_set
+    if timestamp_ns is not None:
+        line += f' {timestamp_ns}'
+    return line
+
+
+class InfluxWriter(threading.Thread):
+    """Background InfluxDB writer, the GUI never waits for the server.
+
+    write() only formats one line protocol record and puts it on a bounded
+    queue. When the queue is full the oldest record is dropped (and counted)
+    rather than blocking the caller. The thread sends the records in gzip
+    compressed batches, every batch_size records or flush_interval seconds.
+    While the server is unreachable the batches are appended to a spool file
+    and replayed once a ping succeeds again.
+    """
+    def __init__(self, url, org, bucket, token, batch_size=500, flush_interval=1.0,
+                 queue_size=10000, spool_file=DEFAULT_SPOOL_FILE, retry_interval=10.0,
+                 max_spool_bytes=100 * 1024 * 1024):
+        super().__init__(daemon=True)
+        self.url = url
+        self.org = org
+        self.bucket = bucket
+        self.token = token
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval # sec
+        self.spool_file = spool_file
+        self.retry_interval = retry_interval # sec
+        self.max_spool_bytes = max_spool_bytes
+
+        self.online = False
+        self.probed = threading.Event() # set once the first connect and ping are done, online or not
+        self.dropped = 0 # records lost to a full queue or a full spool
+        self.written = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopEvent = threading.Event()
+        self._client = None
+        self._write_api = None
+        self._nextRetry = 0.0
+
+    #======================================= any thread
+    def write(self, measurement, fields, tags=None):
+        line = toLineProtocol(measurement, fields, tags, time.time_ns())
+        if line is None:
+            return
+        while True:
+            try:
+                self._queue.put_nowait(line)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait() # backpressure, drop the oldest record
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def writeTelemetry(self, telemetry):
+        self.write("TargetWheel", {
+            "position": int(telemetry.position),
+            "io_status": int(telemetry.io_status),
+            "temperature": float(telemetry.temperature),
+            "encoderVelocity": float(telemetry.encoderVelocity),
+            "motorVelocity": float(telemetry.motorVelocity),
+            "torque": float(telemetry.torque),
+        })
+        self.write("Torque", {"value": float(telemetry.torque)}) # kept for the existing dashboards
+
+    def stop(self, timeout=5.0):
+        self._stopEvent.set()
+        self.join(timeout)
+
+    #======================================= writer thread
+    def run(self):
+        self._connect()
+        self.probed.set()
+        lines = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                lines.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                pass
+
+            stopping = self._stopEvent.is_set()
+            if len(lines) >= self.batch_size or time.monotonic() >= deadline or stopping:
+                if stopping: # drain whatever is left
+                    while True:
+                        try:
+                            lines.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            break
+                if lines:
+                    self._flush(lines)
+                    lines = []
+                if not self.online and time.monotonic() >= self._nextRetry:
+                    self._retry()
+                deadline = time.monotonic() + self.flush_interval
+            if stopping:
+                break
+
+        if self._client is not None:
+            self._client.close()
+
+    def _connect(self):
+        self._retry() # creates the client, then pings
+
+    def _createClient(self):
+        # heavy import, only done in the writer thread
+        from influxdb_client import InfluxDBClient
+        from influxdb_client.client.write_api import SYNCHRONOUS
+        try:
+            self._client = InfluxDBClient(url=self.url, org=self.org, token=self.token, enable_gzip=True)
+            self._write_api = self._client.write_api(write_options=SYNCHRONOUS)
+        except Exception as e:
+            log.error("InfluxDB: cannot create client for %s: %s", self.url, e)
+            self._client = None
+            self._write_api = None
+            return False
+        return True
+
+    def _send(self, lines):
+        if self._write_api is None:
+            raise ConnectionError("no InfluxDB client")
+        self._write_api.write(bucket=self.bucket, org=self.org, record=lines)
+        self.written += len(lines)
+
+    def _flush(self, lines):
+        if self.online:
+            try:
+                self._send(lines)
+                return
+            except Exception as e:
+                log.warning("InfluxDB: write failed, spooling to %s: %s", self.spool_file, e)
+                self.online = False
+                self._nextRetry = time.monotonic() + self.retry_interval
+        self._spool(lines)
+
+    def _spool(self, lines):
+        try:
+            size = os.path.getsize(self.spool_file) if os.path.exists(self.spool_file) else 0
+            if size > self.max_spool_bytes:
+                self.dropped += len(lines)
+                return
+            with open(self.spool_file, "a") as file:
+                file.write('\n'.join(lines) + '\n')
+        except OSError as e:
+            log.error("InfluxDB: cannot spool to %s: %s", self.spool_file, e)
+            self.dropped += len(lines)
+
+    def _retry(self):
+        self._nextRetry = time.monotonic() + self.retry_interval
+        if self._write_api is None and not self._createClient(): # e.g. DNS not up yet at startup
+            return
+        try:
+            if not self._client.ping():
+                return
+        except Exception:
+            return
+        log.info("InfluxDB: server reachable.")
+        self.online = True
+        self._replaySpool()
+
+    def _replaySpool(self):
+        if not os.path.exists(self.spool_file):
+            return
+        with open(self.spool_file, "r") as file:
+            lines = [line for line in file.read().splitlines() if line]
+        log.info("InfluxDB: replaying %s spooled records.", len(lines))
+        for i in range(0, len(lines), self.batch_size):
+            try:
+                self._send(lines[i:i + self.batch_size])
+            except Exception as e:
+                log.warning("InfluxDB: replay failed: %s", e)
+                self.online = False
+                with open(self.spool_file, "w") as file:
+                    file.write('\n'.join(lines[i:]) + '\n')
+                return
+        os.remove(self.spool_file)
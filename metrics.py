@@ -0,0 +1,137 @@
+"""Latency histograms and event counters of the controller I/O and the GUI slots.
+
+Controller.send_message records the round trip of every command under its
+mnemonic (RUe1, RL6, QX4, ..., see commands.mnemonic). queryBatch records
+the time from the batch send to each reply under "batch:" + mnemonic, and
+the whole batch as "batch"; in a pipelined batch a reply has no round trip
+of its own. The acquisition worker the time of each telemetry poll ("poll"), and the
+GUI the time spent in Update_Position ("gui.update") and in repainting
+("gui.render"). The counters are the NaN replies, the timeouts and other
+send/receive errors, the reconnects and the failed reconnect attempts
+("retries").
+
+Recording is a few dict and list operations under a lock, cheap enough
+for every command. The GUI metrics panel shows REGISTRY.snapshot() and
+writeInflux() exports it as the measurements "WheelLatency" (one point
+per mnemonic, tag "command") and "WheelCounters".
+"""
+import math
+import threading
+
+MIN_LATENCY = 1e-6 # sec, the first bucket
+MAX_LATENCY = 100.0 # sec, the last bucket, longer ones are counted there
+BUCKET_RATIO = 1.05 # width of a bucket relative to its lower edge, i.e. 5% resolution
+BATCH_PREFIX = "batch:" # replies of a queryBatch, timed from the batch send
+COUNTERS = ('nan_replies', 'timeouts', 'errors', 'reconnects', 'retries')
+
+_LOG_RATIO = math.log(BUCKET_RATIO)
+_BUCKETS = int(math.ceil(math.log(MAX_LATENCY / MIN_LATENCY) / _LOG_RATIO)) + 1
+
+class LatencyHistogram():
+    """Log-bucketed histogram, as in HdrHistogram: a fixed relative precision from 1 us to 100 s.
+
+    record() is O(1) and the memory is fixed (about 380 buckets), whatever
+    the number of samples, so it can run for the whole session. The
+    percentiles are the upper edge of their bucket, within BUCKET_RATIO.
+    """
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.clear()
+
+    def clear(self):
+        for i in range(_BUCKETS):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= MIN_LATENCY:
+            index = 0
+        else:
+            index = min(_BUCKETS - 1, int(math.log(seconds / MIN_LATENCY) / _LOG_RATIO) + 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """sec below which q percent of the samples are, NaN when empty."""
+        if self.count == 0:
+            return math.nan
+        rank = max(1, math.ceil(self.count * q / 100.0))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.max, MIN_LATENCY * BUCKET_RATIO ** index)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def summary(self):
+        """{'count', 'mean', 'p50', 'p90', 'p99', 'max'}, the times in ms."""
+        return {'count': self.count,
+                'mean': self.mean * 1e3,
+                'p50': self.percentile(50) * 1e3,
+                'p90': self.percentile(90) * 1e3,
+                'p99': self.percentile(99) * 1e3,
+                'max': self.max * 1e3 if self.count else math.nan}
+
+
+class Metrics():
+    """Latency histograms by name and event counters, safe to record from any thread."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {} # name : LatencyHistogram
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def record(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """({name: summary}, {counter: value}), for the display or the export."""
+        with self._lock:
+            return ({name: histogram.summary() for name, histogram in self.histograms.items()},
+                    dict(self.counters))
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def format(self):
+        latencies, counters = self.snapshot()
+        lines = [f"{'':<12s} {'count':>8s} {'mean':>8s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s}  [ms]"]
+        for name in sorted(latencies, key=lambda name: -latencies[name]['count']):
+            s = latencies[name]
+            lines.append(f"{name:<12s} {s['count']:8d} {s['mean']:8.2f} {s['p50']:8.2f} {s['p90']:8.2f} "
+                         f"{s['p99']:8.2f} {s['max']:8.2f}")
+        lines.append(", ".join(f"{name} {value}" for name, value in counters.items()))
+        return "\n".join(lines)
+
+    def writeInflux(self, writer, tags=None):
+        """Queue the snapshot on an InfluxWriter."""
+        latencies, counters = self.snapshot()
+        for name, summary in latencies.items():
+            writer.write("WheelLatency", summary, dict(tags or {}, command=name))
+        writer.write("WheelCounters", counters, tags)
+
+
+REGISTRY = Metrics() # shared by the Controllers, the acquisition worker and the GUI
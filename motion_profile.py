@@ -0,0 +1,151 @@
+import math
+import time
+from dataclasses import dataclass
+
+from Library import STEP_PER_REVOLUTION
+from control_loop import moveTime
+
+@dataclass(frozen=True)
+class Move:
+    """Trapezoidal point to point move, as run by FL, SHX0H and the QX4 slew.
+
+    Accelerates at accel to velocity, cruises and decelerates at decel to
+    stop after distance steps, or peaks below velocity when the move is
+    short. Times are time.monotonic().
+    """
+    start: float = 0.0 # sec
+    startPosition: float = 0.0 # steps
+    distance: float = 0.0 # steps, signed
+    velocity: float = 0.0 # rev/sec
+    accel: float = 0.0 # rev/sec/sec
+    decel: float = 0.0 # rev/sec/sec
+
+    @property
+    def duration(self):
+        return moveTime(self.distance / STEP_PER_REVOLUTION, self.velocity, self.accel, self.decel)
+
+    @property
+    def eta(self):
+        return self.start + self.duration
+
+    @property
+    def endPosition(self):
+        return self.startPosition + self.distance
+
+    def remaining(self, now=None):
+        """sec until the move should have finished, 0 once it has."""
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.eta - now)
+
+    def progress(self, now=None):
+        """0 at the start, 1 at the end, by distance."""
+        if self.distance == 0:
+            return 1.0
+        return (self.positionAt(now) - self.startPosition) / self.distance
+
+    def _phases(self):
+        # (peak velocity, accel time, cruise time, decel time), rev/sec and sec
+        distance = abs(self.distance) / STEP_PER_REVOLUTION
+        ramp = self.velocity**2 / 2 * (1 / self.accel + 1 / self.decel)
+        if distance >= ramp:
+            return self.velocity, self.velocity / self.accel, (distance - ramp) / self.velocity, self.velocity / self.decel
+        peak = math.sqrt(2 * distance / (1 / self.accel + 1 / self.decel))
+        return peak, peak / self.accel, 0.0, peak / self.decel
+
+    def velocityAt(self, now=None):
+        """Expected velocity [rev/sec, signed] at time now."""
+        now = time.monotonic() if now is None else now
+        if not math.isfinite(self.duration) or self.distance == 0:
+            return 0.0
+        peak, t1, t2, t3 = self._phases()
+        t = now - self.start
+        if t <= 0 or t >= t1 + t2 + t3:
+            return 0.0
+        if t < t1:
+            v = self.accel * t
+        elif t < t1 + t2:
+            v = peak
+        else:
+            v = peak - self.decel * (t - t1 - t2)
+        return math.copysign(v, self.distance)
+
+    def positionAt(self, now=None):
+        """Expected position [steps] at time now."""
+        now = time.monotonic() if now is None else now
+        if not math.isfinite(self.duration) or self.distance == 0:
+            return self.startPosition
+        peak, t1, t2, t3 = self._phases()
+        t = min(max(0.0, now - self.start), t1 + t2 + t3)
+        if t < t1:
+            rev = self.accel * t**2 / 2
+        elif t < t1 + t2:
+            rev = self.accel * t1**2 / 2 + peak * (t - t1)
+        else:
+            td = t - t1 - t2
+            rev = self.accel * t1**2 / 2 + peak * t2 + peak * td - self.decel * td**2 / 2
+        return self.startPosition + math.copysign(rev * STEP_PER_REVOLUTION, self.distance)
+
+
+@dataclass(frozen=True)
+class Ramp:
+    """Jog velocity change at constant acceleration, the spin up (CJ) and spin down (SJ)."""
+    start: float = 0.0 # sec
+    startVelocity: float = 0.0 # rev/sec
+    endVelocity: float = 0.0 # rev/sec
+    accel: float = 0.0 # rev/sec/sec
+
+    @property
+    def duration(self):
+        dv = abs(self.endVelocity - self.startVelocity)
+        if dv == 0:
+            return 0.0
+        return dv / self.accel if self.accel > 0 else math.inf
+
+    @property
+    def eta(self):
+        return self.start + self.duration
+
+    def remaining(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.eta - now)
+
+    def velocityAt(self, now=None):
+        now = time.monotonic() if now is None else now
+        t = now - self.start
+        if t <= 0:
+            return self.startVelocity
+        if t >= self.duration:
+            return self.endVelocity
+        return self.startVelocity + math.copysign(self.accel * t, self.endVelocity - self.startVelocity)
+
+#======================================= from the controller parameters
+# state: a Controller or a ControllerStatus snapshot, the attribute names are the same
+def flMove(state, distance, now=None):
+    """FL of distance steps at VE, AC and DE."""
+    now = time.monotonic() if now is None else now
+    return Move(now, state.position, distance, state.velocity, state.accelRate, state.deaccelRate)
+
+def seekHomeMove(state, now=None):
+    """SHX0H, to the next full revolution in the direction Controller.seekHome picks."""
+    position = state.position
+    if -math.sin(2 * math.pi * position / STEP_PER_REVOLUTION) >= 0:
+        home = math.ceil(position / STEP_PER_REVOLUTION) * STEP_PER_REVOLUTION
+    else:
+        home = math.floor(position / STEP_PER_REVOLUTION) * STEP_PER_REVOLUTION
+    return flMove(state, home - position, now)
+
+def qx4Slew(state, target, servo=False, now=None):
+    """QX4 move to the encoder demand position target (modulo one revolution).
+
+    The QX4 program slews at qx4SlewSpeed, servo=True for the small
+    corrections while locked, at qx4ServoSlewSpeed. Both in 0.25 rpm/unit.
+    """
+    now = time.monotonic() if now is None else now
+    speed = state.qx4ServoSlewSpeed if servo else state.qx4SlewSpeed
+    distance = state.ConvertModPositionToAbsolute(target) - state.position
+    return Move(now, state.position, distance, speed / 4. / 60., state.accelRate, state.deaccelRate)
+
+def jogRamp(state, startVelocity, endVelocity, now=None):
+    """CJ / SJ velocity change at JA, velocities in rev/sec."""
+    now = time.monotonic() if now is None else now
+    return Ramp(now, abs(startVelocity), abs(endVelocity), state.jogAccel)
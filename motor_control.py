@@ -1,8 +1,16 @@
+import argparse
+import math
 import socket
+import struct
+import sys
 import threading
 import time
 #import keyboard
 
+import commands
+from Library import FrameReader, ControllerState
+from connection_manager import tuneSocket
+
 # Define the server address and port
 #SERVER_ADDRESS = '192.168.0.40'  # Change this to the target system's IP
 SERVER_ADDRESS = '192.168.203.68'  # Change this to the target system's IP 
@@ -11,21 +19,12 @@ SERVER_PORT = 7775
 
 def receive_messages(sock):
     """Function to receive messages from the server."""
+    reader = FrameReader(sock)
     while True:
         try:
             sock.settimeout(2)
-            message = b""
-            while True:
-                chunk = sock.recv(1)
-                if not chunk:
-                    # Connection closed by peer
-                    break
-                message += chunk
-                if b'\r' in message:
-                    break
-            # Decode the message while ignoring the binary prefix and suffix
-            decoded_message = message[2:-1].decode('utf-8', errors='ignore')
-            print("<- {}".format(decoded_message))
+            # the reader strips the binary prefix and suffix
+            print("<- {}".format(reader.readMessage()))
         except Exception as e:
             break
 
@@ -35,12 +34,11 @@ def send_messages(message, sock, server_address):
         if message.lower() == 'exit':
             print("Exiting...")
             break
+        if not commands.isValid(message):
+            print("Warning: {} is not in the command table, sent anyway.".format(message))
         try:
-            # Prepend the binary bytes 0x00 and 0x07, and append 0x0D to the message
-            binary_prefix = b'\x00\x07'
-            binary_suffix = b'\x0d'
-            full_message = binary_prefix + message.encode('utf-8') + binary_suffix
-            sock.sendto(bytes(full_message), server_address)
+            # framed as b'\x00\x07' + message + b'\x0d', see commands.py
+            sock.sendto(commands.frame(message), server_address)
             #hex_array = [x.encode("hex") for x in full_message]
             #print("Sent message: {}".format(hex_array))
             break
@@ -48,59 +46,83 @@ def send_messages(message, sock, server_address):
             print("Error sending message: {}".format(e))
             break
 
-def receive_mon_messages(sock):
-    """Function to receive messages from the server."""
-    print ("<- ", end=""),
-    while True:
-        try:
-            sock.settimeout(0.050)
-            message = b""
-            while True:
-                chunk = sock.recv(1)
-                if not chunk:
-                    # Connection closed by peer
-                    break
-                if chunk == "?":
-                    sock.recv(2)
-                    break
-                message += chunk
-                if chunk == b'\r':
-                    break
-            if chunk == "?":
+MON_REGISTERS = ['RUt1', 'RUv1', 'RUw1', 'RUx1', 'RUe1']
+MON_MAGIC = b'N126MON1' # first line of the binary output, then the register names
+
+def monitor(address, registers=MON_REGISTERS, rate=10.0, output=sys.stdout, fmt='csv', count=0, stop=None):
+    """Sample the registers at rate [Hz] on one persistent connection.
+
+    Every sample is one pipelined batch, all the queries in a single send
+    and the replies read back in order, so a sample costs one round trip.
+    Samples are timed on monotonic deadlines, a late sample skips the
+    deadlines it missed. fmt 'csv' writes "time,<registers>" lines, fmt
+    'binary' writes MON_MAGIC, the comma separated register names and a
+    newline, then one little endian float64 record per sample: the time
+    [sec since start] and the values, NaN for a failed read. Runs until
+    count samples (0 for no limit) or the stop Event is set.
+    """
+    record = struct.Struct('<' + 'd' * (len(registers) + 1))
+    payload = b''.join(commands.frame(register) for register in registers)
+    if fmt == 'binary':
+        output.write(MON_MAGIC + b' ' + ','.join(registers).encode('ascii') + b'\n')
+    else:
+        output.write('time,' + ','.join(registers) + '\n')
+
+    period = 1.0 / rate
+    samples = 0
+    sock = None
+    start = time.monotonic()
+    deadline = start
+    lastFlush = start
+    try:
+        while (count == 0 or samples < count) and not (stop is not None and stop.is_set()):
+            if sock is None:
+                try:
+                    sock = socket.create_connection(address, timeout=2)
+                    tuneSocket(sock)
+                    reader = FrameReader(sock)
+                except OSError as e:
+                    print("Connect error: {}, retrying...".format(e), file=sys.stderr)
+                    sock = None
+                    time.sleep(1.0)
+                    deadline = time.monotonic()
+                    continue
+
+            now = time.monotonic()
+            if now < deadline:
+                time.sleep(deadline - now)
+            timestamp = time.monotonic() - start
+            try:
+                sock.sendall(payload)
+                values = [ControllerState.parseNumber(reader.readMessage()) for _ in registers]
+            except OSError as e:
+                print("Connection lost: {}".format(e), file=sys.stderr)
+                sock.close()
+                sock = None
                 continue
-            # Decode the message while ignoring the binary prefix and suffix
-            decoded_message = message[2:-1].decode('utf-8', errors='ignore')
-            print (f"{format(decoded_message):9}, ", end="") 
-        except Exception as e:
-            print("\r")
-            break
 
-def send_mon_messages(sock, server_address):
-    """Function to send messages to the server."""
-    msg_list = list()
-    msg_list.append('RUt1')
-    msg_list.append('RUv1')
-    msg_list.append('RUw1')
-    msg_list.append('RUx1')
-    msg_list.append('RUe1')
-    for msg in msg_list:
-        try:
-            # Prepend the binary bytes 0x00 and 0x07, and append 0x0D to the message
-            binary_prefix = b'\x00\x07'
-            binary_suffix = b'\x0d'
-            full_message = binary_prefix + msg.encode('utf-8') + binary_suffix
-            sock.sendto(full_message, server_address)
-            time.sleep(0.010)
-        except Exception as e:
-            break
+            if fmt == 'binary':
+                output.write(record.pack(timestamp, *values))
+            else:
+                output.write('{:.4f},'.format(timestamp) + ','.join('{:g}'.format(v) for v in values) + '\n')
+            samples += 1
 
-global KeyPressed #the almighty global variable that monitors whether the keyboard was pressed or not.
+            now = time.monotonic()
+            if now - lastFlush >= 1.0:
+                output.flush()
+                lastFlush = now
+            deadline += period
+            if now > deadline:
+                deadline = start + math.ceil((now - start) / period) * period
+    finally:
+        output.flush()
+        if sock is not None:
+            sock.close()
+    return samples
 
-def input_thread():
-    global KeyPressed
+def wait_enter(stop):
     input()             # use input() in Python3
-    KeyPressed = True
-    return 
+    stop.set()
 
 #def handle_key(event):
 #    global KeyPressed
@@ -108,45 +130,62 @@ def input_thread():
 #    #print("KeyPressed is now:", event.name) #in case you want to know what did you pressed.
 #    return 
 
+def run_monitor(args):
+    registers = [register.strip() for register in args.registers.split(',') if register.strip()]
+    for register in registers:
+        if not commands.isValid(register):
+            print("Warning: {} is not in the command table, sent anyway.".format(register), file=sys.stderr)
+    binary = args.format == 'binary'
+    if args.output in (None, '-'):
+        output = sys.stdout.buffer if binary else sys.stdout
+    else:
+        output = open(args.output, 'wb' if binary else 'w')
+    stop = threading.Event()
+    if args.interactive:
+        threading.Thread(target=wait_enter, args=(stop,), daemon=True).start()
+    print("Monitoring {} at {:g} Hz, press {} to stop.".format(
+        ','.join(registers), args.rate, 'Enter' if args.interactive else 'Ctrl-C'), file=sys.stderr)
+    try:
+        samples = monitor((args.ip, args.port), registers, args.rate, output, args.format, args.count, stop)
+        print("{} samples.".format(samples), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output not in (sys.stdout, sys.stdout.buffer):
+            output.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Send commands to the controller, or monitor its registers.")
+    parser.add_argument('command', nargs='?', choices=['mon'], help="mon: monitor, without it the commands are read from stdin")
+    parser.add_argument('--ip', default=SERVER_ADDRESS)
+    parser.add_argument('--port', type=int, default=7776)
+    parser.add_argument('--rate', type=float, default=10.0, help="samples per second")
+    parser.add_argument('--registers', default=','.join(MON_REGISTERS), help="comma separated, e.g. RUe1,RUw1")
+    parser.add_argument('--format', choices=['csv', 'binary'], default='csv')
+    parser.add_argument('--output', default='-', help="file, - for stdout")
+    parser.add_argument('--count', type=int, default=0, help="samples, 0 until stopped")
+    args = parser.parse_args(argv)
+    args.interactive = False
+    return args
+
 def main():
+    args = parse_args()
+    if args.command == 'mon':
+        run_monitor(args)
+        return
+
     print("V0.1\r")
-    global KeyPressed
     #keyboard.hook(lambda event: handle_key(event))
     while True:
         #message = input("")
         message = input("")
         time.sleep(0.250)
-        KeyPressed = False 
         
         if message.lower() == 'mon':
-	    # Start the keypress monitor
-            key_press_thread = threading.Thread(target=input_thread)
-            key_press_thread.daemon = True
-            key_press_thread.start()
-            while True:
-
-                if KeyPressed:
-                    break
-                # Create a UDP socket
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                
-                # Connect to the server
-                sock.connect((SERVER_ADDRESS, 7776))
-               
-                # Start the receiving thread
-                mon_receive_thread = threading.Thread(target=receive_mon_messages, args=(sock,))
-                mon_receive_thread.daemon = True
-                mon_receive_thread.start()
-                
-                # Start the sending thread
-                mon_send_thread = threading.Thread(target=send_mon_messages, args=(sock, (SERVER_ADDRESS, SERVER_PORT)))
-                mon_send_thread.start()
-                
-                # Wait for the send thread to finish
-                mon_receive_thread.join()
-                
-                # Close the socket
-                sock.close()
+            # until Enter, on one connection, see monitor()
+            args = parse_args([])
+            args.interactive = True
+            run_monitor(args)
         else:
             # Create a UDP socket
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
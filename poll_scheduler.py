@@ -0,0 +1,124 @@
+import time
+from dataclasses import dataclass
+
+# same numbering as TargetWheelControl.state
+IDLE = 0
+SPIN = 1
+SWEEP = 2
+QX4_LOCK = 3
+SEEK_HOME = 4
+
+# register : (priority, {state : period [sec]}), lower priority number is polled first
+DEFAULT_SCHEDULE = {
+    'RUe1': (0, {IDLE: 1.0,  SPIN: 0.3,  SWEEP: 0.3,  QX4_LOCK: 0.1,  SEEK_HOME: 0.2}),  # position
+    'IO':   (1, {IDLE: 1.0,  SPIN: 1.0,  SWEEP: 0.3,  QX4_LOCK: 1.0,  SEEK_HOME: 0.6}),  # sweep stop bits
+    'RUw1': (2, {IDLE: 2.0,  SPIN: 0.3,  SWEEP: 0.3,  QX4_LOCK: 0.5,  SEEK_HOME: 0.6}),  # motor velocity
+    'RUv1': (2, {IDLE: 2.0,  SPIN: 0.3,  SWEEP: 0.3,  QX4_LOCK: 0.5,  SEEK_HOME: 0.6}),  # encoder velocity
+    'RUx1': (3, {IDLE: 2.0,  SPIN: 0.6,  SWEEP: 0.6,  QX4_LOCK: 0.5,  SEEK_HOME: 0.6}),  # torque
+    'RUt1': (4, {IDLE: 10.0, SPIN: 10.0, SWEEP: 10.0, QX4_LOCK: 10.0, SEEK_HOME: 10.0}), # temperature
+}
+
+MIN_WAIT = 0.005 # sec, shortest sleep of the poll timer
+
+@dataclass(frozen=True)
+class Expectation:
+    eta: float # time.monotonic() the move should finish
+    keys: tuple # registers to poll around the eta
+    window: float # sec before the eta the dense polling starts
+    dense: float # sec, poll period around the eta
+    sparse: float # sec, poll period before the window
+    grace: float # sec after the eta the dense polling goes on, for a late finish
+
+class PollScheduler():
+    """Decides which telemetry registers to read on each poll.
+
+    Every register has its own period per wheel state and a priority. The
+    poll runs on a base tick, the shortest period of the current state, and
+    a register is read on the first tick after its period has elapsed, so
+    slow registers (temperature) are read on a few ticks only and the link
+    is left to the fast ones (position during a QX4 lock). A register is
+    considered due half a tick early, which keeps the registers of equal
+    period on the same tick.
+
+    max_per_tick limits the number of registers per batch, registers left
+    out stay due and are taken first on the next tick.
+
+    expect(eta) announces a move expected to finish at eta (motion_profile):
+    its registers are read every `sparse` sec through the predictable part
+    of the move, every `dense` sec from `window` sec before the eta until
+    `grace` sec after it, then the schedule applies again. untilNext() is
+    how long the poll timer can sleep.
+    """
+    def __init__(self, schedule=DEFAULT_SCHEDULE, state=IDLE, max_per_tick=None):
+        self.schedule = schedule
+        self.state = state
+        self.max_per_tick = max_per_tick
+        self._lastPoll = {key: None for key in schedule} # time.monotonic() of the last read
+        self.expectation = None # Expectation of the move in progress
+
+    def setState(self, state):
+        # the last poll times are kept, a register whose new period has already
+        # elapsed is read on the next tick
+        self.state = state
+
+    def period(self, register, now=None):
+        base = self.schedule[register][1][self.state]
+        expectation = self.expectation
+        if expectation is None or register not in expectation.keys:
+            return base
+        now = time.monotonic() if now is None else now
+        if now < expectation.eta - expectation.window:
+            return max(base, expectation.sparse)
+        if now <= expectation.eta + expectation.grace:
+            return min(base, expectation.dense)
+        return base
+
+    def tick(self, now=None):
+        """Base poll period of the current state [sec]."""
+        return min(self.period(key, now) for key in self.schedule)
+
+    def expect(self, eta, keys=('RUe1',), window=0.3, dense=0.05, sparse=1.0, grace=1.0):
+        """Poll keys densely around eta (time.monotonic()) only, see the class doc."""
+        self.expectation = Expectation(eta, tuple(keys), window, dense, sparse, grace)
+
+    def clearExpectation(self):
+        self.expectation = None
+
+    def untilNext(self, now=None):
+        """sec until the next register is due, at least MIN_WAIT."""
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        # registers due within the slack are taken along, see due()
+        wait = min((last + self.period(key, now) - now) if last is not None else 0.0
+                   for key, last in self._lastPoll.items())
+        expectation = self.expectation
+        if expectation is not None and now < expectation.eta - expectation.window:
+            wait = min(wait, expectation.eta - expectation.window - now) # wake up for the dense part
+        return max(MIN_WAIT, wait)
+
+    def reset(self):
+        """Read every register on the next tick, e.g. after a (re)connect."""
+        for key in self._lastPoll:
+            self._lastPoll[key] = None
+
+    def due(self, now=None):
+        """Registers to read now, by priority, and mark them as read."""
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        slack = self.tick(now) / 2
+        due = []
+        for key, last in self._lastPoll.items():
+            if last is None or now + slack >= last + self.period(key, now):
+                due.append(key)
+        # overdue registers first within the same priority
+        due.sort(key=lambda k: (self.schedule[k][0], self._lastPoll[k] or 0.0))
+        if self.max_per_tick is not None:
+            due = due[:self.max_per_tick]
+        for key in due:
+            self._lastPoll[key] = now
+        return due
+
+    def _expire(self, now):
+        expectation = self.expectation
+        if expectation is not None and now > expectation.eta + expectation.grace:
+            self.expectation = None
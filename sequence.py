@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""Target sequences for unattended runs.
+
+A schedule is a list of steps in a JSON file, or YAML when PyYAML is
+installed:
+
+    [
+      {"target": 3, "dwell": 600},
+      {"target": "Au 2", "dwell": 300},
+      {"sweep_mask": [0, 1, 2, 3], "sweep_speed": 12, "dwell": 1800},
+      {"target": 0, "dwell": 60}
+    ]
+
+A target step (index or name, see TargetIndex) locks the wheel on the
+target with QX4 for dwell sec. A sweep step sweeps the targets of
+sweep_mask (indices or names, or the RL1 bit mask) at sweep_speed [rpm]
+for dwell sec. The absolute target positions are precomputed by plan(),
+each from the previous one with ConvertModPositionToAbsolute.
+
+SequenceRunner starts every step on the completion of the previous one,
+the position within tolerance and stable, the sweep at speed, the sweep
+stop bits, instead of fixed sleeps, and QX4 is kept running between
+consecutive target steps. It is driven by the telemetry stream through
+a WaiterRegistry, in the GUI (Run Sequence) or headless:
+
+    python3 sequence.py schedule.json --targets targets.json --dry-run
+    python3 sequence.py schedule.json --targets targets.json --ip 192.168.203.36
+"""
+import argparse
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass, replace
+
+import wheel_log
+from Library import Controller
+from motion_profile import Move, qx4Slew, jogRamp
+from poll_scheduler import PollScheduler, IDLE, SWEEP, QX4_LOCK
+from target_index import TargetIndex
+from telemetry import ControllerStatus, Telemetry
+from waiters import WaiterRegistry, allOf, after, ioBitsEqual, positionStable, qx4ErrorWithin, velocityNear
+
+log = wheel_log.getLogger("controller")
+
+POSITION_TOLERANCE = 5 # steps
+SETTLE_SAMPLES = 3 # position reads without motion before the dwell starts
+MOVE_TIMEOUT_MARGIN = 10.0 # sec over twice the predicted move time
+SWEEP_START_TIMEOUT = 60.0 # sec to reach the sweep speed
+SWEEP_STOP_TIMEOUT = 60.0 # sec for QX1 to end after the stop
+SWEEP_STOP_IO = 0b111 # IO bits set by QX1 when the sweep ended
+
+@dataclass(frozen=True)
+class Step:
+    dwell: float = 0.0 # sec
+    target: int = None # target index, target step
+    sweepMask: int = None # RL1 bits, sweep step
+    sweepSpeed: float = None # rpm, None keeps the current sweep speed
+
+    @property
+    def isSweep(self):
+        return self.sweepMask is not None
+
+@dataclass(frozen=True)
+class PlannedStep:
+    step: Step
+    position: int = None # absolute target position [steps], None when it depends on where a sweep ends
+    move: Move = None # predicted QX4 slew from the previous position
+
+#======================================= schedule
+def _targetIndex(value, targets):
+    if isinstance(value, str):
+        index = targets.find(value)
+        if index is None:
+            raise ValueError(f"unknown target name '{value}'")
+        return index
+    index = int(value)
+    if not 0 <= index < len(targets):
+        raise ValueError(f"target index {index} out of range")
+    return index
+
+def stepFromDict(entry, targets):
+    dwell = float(entry.get("dwell", 0.0))
+    if ("target" in entry) == ("sweep_mask" in entry):
+        raise ValueError(f"a step needs either target or sweep_mask: {entry}")
+    if "target" in entry:
+        return Step(dwell, target=_targetIndex(entry["target"], targets))
+    mask = entry["sweep_mask"]
+    if isinstance(mask, list): # target i is bit 15 - i, as in the GUI check boxes
+        mask = sum(1 << (15 - _targetIndex(value, targets)) for value in set(mask))
+    speed = entry.get("sweep_speed")
+    return Step(dwell, sweepMask=int(mask), sweepSpeed=None if speed is None else float(speed))
+
+def loadSchedule(fileName, targets):
+    """[Step, ...] from a JSON or YAML schedule, a list of steps or {"steps": [...]}."""
+    with open(fileName, "r") as file:
+        if fileName.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("YAML schedules need PyYAML, pip install pyyaml, or use JSON")
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+    if isinstance(data, dict):
+        data = data.get("steps", [])
+    return [stepFromDict(entry, targets) for entry in data]
+
+def plan(steps, status, targets):
+    """[PlannedStep, ...], the absolute positions and moves from status (ControllerStatus) on."""
+    planned = []
+    known = True
+    for step in steps:
+        if step.isSweep:
+            planned.append(PlannedStep(step))
+            known = False
+            continue
+        if not known:
+            planned.append(PlannedStep(step))
+            continue
+        mod = int(targets.positions[step.target])
+        move = qx4Slew(status, mod, now=0.0)
+        position = int(status.ConvertModPositionToAbsolute(mod))
+        planned.append(PlannedStep(step, position, move))
+        status = replace(status, position=position)
+    return planned
+
+def describe(planned, targets):
+    """One line per step for a dry run, with the absolute positions and the predicted times."""
+    lines = []
+    clock = 0.0 # sec from the start, None once it depends on where a sweep ends
+    for i, item in enumerate(planned):
+        step = item.step
+        if step.isSweep:
+            speed = "current speed" if step.sweepSpeed is None else f"{step.sweepSpeed:g} rpm"
+            text = f"{i:3d}  sweep 0x{step.sweepMask:04X} at {speed}, dwell {step.dwell:g} s"
+            clock = None
+        else:
+            text = f"{i:3d}  target {step.target} '{targets.name(step.target)}'"
+            if item.position is not None:
+                text += f" at {item.position} steps, move {item.move.distance:+.0f} steps"
+                if math.isfinite(item.move.duration):
+                    text += f" in {item.move.duration:.2f} s"
+                    clock = None if clock is None else clock + item.move.duration
+                else:
+                    clock = None
+            else:
+                text += ", position after the sweep"
+            text += f", dwell {step.dwell:g} s"
+        if clock is not None:
+            clock += step.dwell
+            text += f", done at {clock:.1f} s"
+        lines.append(text)
+    return lines
+
+#======================================= runner
+class SequenceRunner():
+    """Runs the steps back to back, see the module doc.
+
+    submit(name, *args)  queues a Controller method or worker command, e.g. AcquisitionWorker.submit
+    waiters              the WaiterRegistry fed with every telemetry sample
+    status()             the current ControllerStatus
+    set_state(state)     poll rates, default submit('setState', state)
+    on_step(index, PlannedStep) when a step starts, on_finished(ok, reason) at the end
+    qx4                  True when the QX4 lock is already running
+
+    The QX4 lock is left running after the last target step.
+    """
+    def __init__(self, steps, targets, submit, waiters, status, set_state=None,
+                 on_step=None, on_finished=None, tolerance=POSITION_TOLERANCE, settle=SETTLE_SAMPLES, qx4=False):
+        self.steps = list(steps)
+        self.targets = targets
+        self.submit = submit
+        self.waiters = waiters
+        self.status = status
+        self.set_state = set_state if set_state is not None else (lambda state: submit('setState', state))
+        self.on_step = on_step
+        self.on_finished = on_finished
+        self.tolerance = tolerance
+        self.settle = settle
+        self.running = False
+        self.index = -1
+        self.qx4 = qx4 # QX4 lock running
+        self.sweeping = False
+        self.cancelled = False
+        self._sweepSpeed = 0.0
+        self.planned = []
+        self.deadTimes = [] # sec from the start of a step to the start of its dwell
+        self._future = None
+        self._stepStart = 0.0
+
+    def start(self):
+        self.running = True
+        self.cancelled = False
+        self.index = -1
+        self.deadTimes = []
+        self.planned = plan(self.steps, self.status(), self.targets)
+        self._next()
+
+    def cancel(self):
+        if not self.running:
+            return
+        self.cancelled = True
+        if self._future is not None:
+            self._future.cancel()
+        if self.sweeping: # ramp down and end QX1 as a sweep step does, then finish
+            self._stopSweep()
+            return
+        self._finish(False, "cancelled")
+
+    def _finish(self, ok, reason):
+        self.running = False
+        self.submit('clearExpectation')
+        if self.on_finished is not None:
+            self.on_finished(ok, reason)
+
+    def _wait(self, predicate, timeout, then, what):
+        self._future = self.waiters.wait(predicate, timeout, what)
+        self._future.add_done_callback(lambda future: self._done(future, then, what))
+
+    def _done(self, future, then, what):
+        if future.cancelled() or not self.running:
+            return
+        if future.exception() is not None:
+            log.warning("Sequence step %s: %s timed out, sequence stopped.", self.index, what)
+            if self.sweeping: # force the stop, as StopSweep in the GUI
+                self.submit('finishSpinSweep', self._sweepSpeed)
+                self.sweeping = False
+                self.set_state(IDLE)
+            self._finish(False, f"{what} timed out")
+            return
+        then()
+
+    def _dwell(self, seconds, then=None):
+        now = time.monotonic()
+        self.deadTimes.append(now - self._stepStart)
+        self._wait(after(now + seconds), None, then if then is not None else self._next, "dwell")
+
+    def _next(self):
+        self.index += 1
+        if self.index >= len(self.planned):
+            self._finish(True, "done")
+            return
+        if not self.planned[self.index].step.isSweep and self.planned[self.index].position is None:
+            # after a sweep, plan the rest from where the wheel stopped
+            self.planned[self.index:] = plan(self.steps[self.index:], self.status(), self.targets)
+        item = self.planned[self.index]
+        self._stepStart = time.monotonic()
+        if self.on_step is not None:
+            self.on_step(self.index, item)
+        if item.step.isSweep:
+            self._startSweep(item.step)
+        else:
+            self._startTarget(item)
+
+    #======================================= target step
+    def _startTarget(self, item):
+        mod = int(self.targets.positions[item.step.target])
+        self.submit('setQX4EncoderDemandPos', mod)
+        if not self.qx4:
+            self.submit('startQX4LockPosition') # heads for the demand position set just before
+            self.qx4 = True
+            self.set_state(QX4_LOCK)
+        move = qx4Slew(self.status(), mod)
+        timeout = MOVE_TIMEOUT_MARGIN
+        if math.isfinite(move.duration):
+            self.submit('expect', move.eta, ('RUe1',))
+            timeout += 2 * move.duration
+        # the firmware may take the other way round than the planned absolute position, the check is modular
+        self._wait(allOf(qx4ErrorWithin(self.tolerance, mod), positionStable(self.settle)),
+                   timeout, lambda: self._dwell(item.step.dwell), f"move to target {item.step.target}")
+
+    #======================================= sweep step
+    def _startSweep(self, step):
+        if self.qx4:
+            self.submit('stopQX4LockPosition')
+            self.qx4 = False
+        speed = step.sweepSpeed if step.sweepSpeed is not None else self.status().sweepSpeed
+        self.submit('setSweepMask', step.sweepMask)
+        self.submit('setSweepSpeed', speed)
+        self.set_state(SWEEP)
+        self.submit('send_message', "DI100")
+        self.submit('startSpinSweep')
+        self.sweeping = True
+        self._sweepSpeed = speed
+        self._wait(velocityNear(speed), SWEEP_START_TIMEOUT, lambda: self._dwell(step.dwell, self._stopSweep), "sweep start")
+
+    def _stopSweep(self):
+        self.submit('stopSpinSweep')
+        status = self.status()
+        ramp = jogRamp(status, status.motorVelocity / 60., 0)
+        if math.isfinite(ramp.eta):
+            self.submit('expect', ramp.eta, ('RUw1', 'IO'))
+        self._wait(ioBitsEqual(SWEEP_STOP_IO), SWEEP_STOP_TIMEOUT, self._sweepStopped, "sweep stop")
+
+    def _sweepStopped(self):
+        self.submit('finishSpinSweep', self._sweepSpeed)
+        self.submit('clearExpectation')
+        self.sweeping = False
+        self.set_state(IDLE)
+        if self.cancelled:
+            self._finish(False, "cancelled")
+        else:
+            self._next()
+
+#======================================= headless
+def runHeadless(controller, steps, targets, scheduler=None, stop=None):
+    """Runs the sequence on a connected Controller from this thread, polling on the PollScheduler.
+
+    stop, a threading.Event, or Ctrl+C cancels the sequence. Returns the finished SequenceRunner.
+    """
+    scheduler = scheduler if scheduler is not None else PollScheduler()
+    stop = stop if stop is not None else threading.Event()
+    waiters = WaiterRegistry()
+    commands = {'setState': scheduler.setState,
+                'expect': scheduler.expect,
+                'clearExpectation': scheduler.clearExpectation}
+
+    def submit(name, *args):
+        if name in commands:
+            commands[name](*args)
+        else:
+            getattr(controller, name)(*args)
+
+    def onStep(index, item):
+        log.info("Sequence step %s: %s", index, describe([item], targets)[0][5:])
+
+    def onFinished(ok, reason):
+        log.info("Sequence %s.", reason)
+
+    controller.getStatus(full=True)
+    controller.getQX4Parameters()
+    runner = SequenceRunner(steps, targets, submit, waiters, lambda: ControllerStatus.fromController(controller),
+                            on_step=onStep, on_finished=onFinished)
+    scheduler.reset()
+    runner.start()
+    while runner.running:
+        try:
+            if stop.is_set() and not runner.cancelled:
+                runner.cancel() # a sweep still ramps down before the runner ends
+            keys = scheduler.due()
+            if keys:
+                valid = controller.getTelemetry(keys)
+                waiters.feed(Telemetry.fromController(controller, valid, keys if valid else ()))
+            else:
+                waiters.checkTimeouts()
+            time.sleep(scheduler.untilNext())
+        except KeyboardInterrupt:
+            if runner.cancelled:
+                raise # a second Ctrl+C
+            stop.set()
+    return runner
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a target sequence, see sequence.py.")
+    parser.add_argument("schedule", help="JSON or YAML schedule")
+    parser.add_argument("--settings", default="programSettings.json")
+    parser.add_argument("--targets", help="targets file, default the target_file of the settings")
+    parser.add_argument("--ip")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--dry-run", action="store_true", help="print the plan from the current position and exit")
+    args = parser.parse_args()
+
+    with open(args.settings, "r") as file:
+        settings = json.load(file)[0]
+    targets = TargetIndex.fromFile(args.targets or settings["target_file"])
+    steps = loadSchedule(args.schedule, targets)
+
+    controller = Controller()
+    controller.Connect(args.ip or settings["IP"], args.port or int(settings["Port"]))
+    if not controller.connected:
+        log.error("Cannot connect to the controller.")
+        return
+    try:
+        if args.dry_run:
+            controller.getStatus(full=True)
+            controller.getQX4Parameters()
+            for line in describe(plan(steps, ControllerStatus.fromController(controller), targets), targets):
+                log.info("%s", line)
+            return
+        runner = runHeadless(controller, steps, targets) # Ctrl+C cancels
+        if runner.deadTimes:
+            log.info("Dead time between dwells: mean %.2f s, max %.2f s",
+                     sum(runner.deadTimes) / len(runner.deadTimes), max(runner.deadTimes))
+    finally:
+        controller.disconnect()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Applied Motion controller.
+
+Speaks the same b'\\x00\\x07<cmd>\\r' framing on TCP and implements the
+commands in README.md: the parameter queries/writes, the RU/RL registers,
+CJ/SJ/FL/SHX0H/SK/RE, the QX1 sweep and QX4 lock programs, EP, IO, ...
+The wheel motion is integrated in between commands, so positions,
+velocities and IO bits behave roughly like the real wheel.
+
+Replies can be delayed (latency and jitter) and split into small TCP
+segments, to exercise the Controller transport and the GUI polling loop
+without the beamline hardware:
+
+    python3 simulator.py --port 7776 --latency 2 --jitter 1 --split 3
+"""
+import argparse
+import heapq
+import math
+import random
+import socket
+import socketserver
+import threading
+import time
+
+from Library import FrameReader, FRAME_HEADER, FRAME_END, STEP_PER_REVOLUTION
+
+PARAMETER_DEFAULTS = {
+    'JS': 1.0,    # rev/sec
+    'JA': 10.0,   # rev/sec/sec
+    'AM': 100.0,  # rev/sec/sec
+    'AC': 10.0,   # rev/sec/sec
+    'DE': 10.0,   # rev/sec/sec
+    'VE': 1.0,    # rev/sec
+    'DI': 100,    # steps
+}
+REGISTER_DEFAULTS = {
+    '1': 0,    # sweep mask
+    '2': 128,  # spoke width
+    '3': 0,    # spoke offset
+    '4': 24,   # sweep speed, 0.25 rpm/unit
+    '5': 4,    # sweep cut off, 0.25 rpm/unit
+    '6': 0,    # QX4 encoder demand position
+    '7': 1000, # QX4 control update, 100 us/unit
+    '8': 40,   # QX4 slew speed, 0.25 rpm/unit
+    '9': 20,   # QX4 servo slew speed, 0.25 rpm/unit
+    ';': 0,    # QX4 motor demand position
+    'O': 0,
+    '@': 0,
+}
+IDLE_IO = 0b111
+SUBSTEP = 0.001 # sec, motion integration step
+
+class WheelModel():
+    """Registers and a simple kinematic model of the wheel, thread safe."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.position = 0.0 # steps
+        self.reset()
+
+    def reset(self):
+        self.parameters = dict(PARAMETER_DEFAULTS)
+        self.registers = dict(REGISTER_DEFAULTS)
+        self.velocity = 0.0 # steps/sec
+        self.mode = 'idle'  # idle, jog, stopjog, move, qx1, qx4
+        self.target = None  # steps, for move and qx4
+        self.io = IDLE_IO
+        self.torque_offset = 12.0
+        self.last_update = time.monotonic()
+
+    #======================================= motion
+    def advance(self, now=None):
+        now = time.monotonic() if now is None else now
+        dt = now - self.last_update
+        self.last_update = now
+        while dt > 0:
+            step = min(dt, SUBSTEP)
+            self._integrate(step)
+            dt -= step
+
+    def _ramp(self, target_velocity, accel, dt):
+        dv = target_velocity - self.velocity
+        limit = accel * dt
+        self.velocity += max(-limit, min(limit, dv))
+
+    def _integrate(self, dt):
+        rev = STEP_PER_REVOLUTION
+        if self.mode == 'jog':
+            direction = 1 if self.parameters['DI'] >= 0 else -1
+            self._ramp(direction * self.parameters['JS'] * rev, self.parameters['JA'] * rev, dt)
+        elif self.mode == 'stopjog':
+            self._ramp(0.0, self.parameters['JA'] * rev, dt)
+            if self.velocity == 0.0:
+                self.mode = 'idle'
+        elif self.mode == 'qx1':
+            sweep = self.registers['4'] / 4. / 60. * rev # steps/sec
+            self._ramp(sweep, self.parameters['JA'] * rev, dt)
+            if self.registers['4'] == 0 and self.velocity == 0.0:
+                self.mode = 'idle'
+                self.io = IDLE_IO
+        elif self.mode in ('move', 'qx4'):
+            if self.mode == 'qx4':
+                self.target = self._nearest(self.registers['6'])
+                self.registers[';'] = int(self.target)
+                vmax = self.registers['8'] / 4. / 60. * rev
+            else:
+                vmax = self.parameters['VE'] * rev
+            self._moveTowards(self.target, vmax, self.parameters['AC'] * rev, self.parameters['DE'] * rev, dt)
+        self.position += self.velocity * dt
+
+    def _moveTowards(self, target, vmax, accel, decel, dt):
+        remaining = target - self.position
+        if abs(remaining) < 0.5 and abs(self.velocity) < decel * dt * 2:
+            self.position = target
+            self.velocity = 0.0
+            if self.mode == 'move':
+                self.mode = 'idle'
+            return
+        direction = 1 if remaining > 0 else -1
+        stopping = self.velocity * self.velocity / (2 * decel)
+        if stopping >= abs(remaining) and self.velocity * direction > 0:
+            self._ramp(0.0, decel, dt)
+        else:
+            self._ramp(direction * vmax, accel, dt)
+        # do not overshoot within one substep
+        if abs(self.velocity * dt) > abs(remaining):
+            self.velocity = remaining / dt
+
+    def _nearest(self, mod_position):
+        diff = mod_position - self.position % STEP_PER_REVOLUTION
+        if diff > STEP_PER_REVOLUTION / 2:
+            diff -= STEP_PER_REVOLUTION
+        elif diff < -STEP_PER_REVOLUTION / 2:
+            diff += STEP_PER_REVOLUTION
+        return round(self.position + diff)
+
+    def program(self):
+        return {'qx1': 1, 'qx4': 4}.get(self.mode, 0)
+
+    #======================================= commands
+    def handle(self, message):
+        with self.lock:
+            self.advance()
+            try:
+                return self._handle(message)
+            except ValueError:
+                return '?'
+
+    def _handle(self, message):
+        rev = STEP_PER_REVOLUTION
+        if message in PARAMETER_DEFAULTS:
+            return f'{message}={self.parameters[message]:g}'
+        if message[:2] in PARAMETER_DEFAULTS and len(message) > 2:
+            value = float(message[2:])
+            self.parameters[message[:2]] = int(value) if message[:2] == 'DI' else value
+            return '%'
+        if message == 'CM':
+            return 'CM=21'
+        if message == 'IO':
+            return f'IO={self.io}'
+        if message.startswith('IO'):
+            self.io = int(message[2:]) & 0xFF
+            return '%'
+        if message.startswith('EP'):
+            self.position = float(int(message[2:]))
+            return '%'
+        if message.startswith('RU') and len(message) == 4:
+            return f'RU{message[2]}={self._readRegister(message[2])}'
+        if message.startswith('RL') and len(message) > 3:
+            if message[2] not in self.registers:
+                return '?'
+            self.registers[message[2]] = int(message[3:])
+            return '%'
+        if message == 'CJ':
+            self.mode = 'jog'
+            return '%'
+        if message == 'SJ':
+            if self.mode == 'jog':
+                self.mode = 'stopjog'
+            return '%'
+        if message == 'FL':
+            self.target = self.position + self.parameters['DI']
+            self.mode = 'move'
+            return '%'
+        if message == 'SHX0H':
+            # home is the next full revolution in the DI direction
+            if self.parameters['DI'] >= 0:
+                self.target = math.ceil(self.position / rev) * rev
+            else:
+                self.target = math.floor(self.position / rev) * rev
+            self.mode = 'move'
+            return '%'
+        if message == 'QX1':
+            self.mode = 'qx1'
+            self.io = 0
+            return '%'
+        if message == 'QX4':
+            self.mode = 'qx4'
+            return '%'
+        if message == 'SK':
+            self.mode = 'idle'
+            self.velocity = 0.0
+            return '%'
+        if message == 'RE':
+            position = self.position
+            self.reset()
+            self.position = position
+            return '%'
+        if message in ('RMNO', 'CS', 'SP', 'FP'):
+            return '%'
+        return '?'
+
+    def _readRegister(self, register):
+        rev = STEP_PER_REVOLUTION
+        if register == 'e':
+            return int(round(self.position))
+        if register == 't':
+            return 315 + random.randint(-2, 2) # 0.1 C/unit
+        if register == 'v':
+            return int(round(self.velocity / rev * 60 * 4)) # 0.25 rpm/unit
+        if register == 'w':
+            return int(round(self.velocity / rev * 60 * 4)) + random.randint(-1, 1)
+        if register == 'x':
+            return int(self.torque_offset + random.randint(-3, 3))
+        if register == 'p':
+            return self.program()
+        return self.registers.get(register, 0)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        replies = [] # heap of (due time, sequence, frame)
+        condition = threading.Condition()
+        closed = False
+
+        def sender():
+            while True:
+                with condition:
+                    while not replies and not closed:
+                        condition.wait()
+                    if not replies and closed:
+                        return
+                    due, _, frame = replies[0]
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        condition.wait(delay)
+                        continue
+                    heapq.heappop(replies)
+                try:
+                    self._send(frame)
+                except OSError:
+                    return
+
+        thread = threading.Thread(target=sender, daemon=True)
+        thread.start()
+
+        with server.lock:
+            server.connections.add(self.request)
+
+        reader = FrameReader(self.request)
+        sequence = 0
+        last_due = 0.0
+        try:
+            while True:
+                message = reader.readMessage()
+                reply = server.model.handle(message)
+                delay = server.latency + random.uniform(-server.jitter, server.jitter)
+                # replies never overtake each other
+                last_due = max(time.monotonic() + max(0.0, delay), last_due)
+                with condition:
+                    heapq.heappush(replies, (last_due, sequence, FRAME_HEADER + reply.encode('utf-8') + FRAME_END))
+                    sequence += 1
+                    condition.notify()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with server.lock:
+                server.connections.discard(self.request)
+            with condition:
+                closed = True
+                condition.notify()
+            thread.join(1.0)
+
+    def _send(self, frame):
+        split = self.server.split
+        if split <= 0:
+            self.request.sendall(frame)
+            return
+        for i in range(0, len(frame), split):
+            self.request.sendall(frame[i:i + split])
+            time.sleep(0.0005)
+
+
+class Simulator(socketserver.ThreadingTCPServer):
+    """Threaded TCP server around one WheelModel, port=0 picks a free port.
+
+    latency and jitter are in seconds and delay every reply, split > 0 sends
+    the replies in chunks of that many bytes.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=7776, latency=0.0, jitter=0.0, split=0, model=None):
+        super().__init__((host, port), _Handler)
+        self.model = model if model is not None else WheelModel()
+        self.latency = latency
+        self.jitter = jitter
+        self.split = split
+        self.lock = threading.Lock()
+        self.connections = set() # client sockets being served
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server_address[0], self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.dropConnections()
+
+    def dropConnections(self):
+        """Reset every client connection, like a cable pull or a controller restart."""
+        with self.lock:
+            connections = list(self.connections)
+        for sock in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Applied Motion controller simulator")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7776)
+    parser.add_argument('--latency', type=float, default=0.0, help="reply delay [ms]")
+    parser.add_argument('--jitter', type=float, default=0.0, help="uniform +/- reply jitter [ms]")
+    parser.add_argument('--split', type=int, default=0, help="send replies in chunks of this many bytes")
+    args = parser.parse_args()
+
+    simulator = Simulator(args.host, args.port, args.latency / 1000., args.jitter / 1000., args.split)
+    print(f"Simulated controller listening on {simulator.address[0]}:{simulator.address[1]}")
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.server_close()
+
+if __name__ == "__main__":
+    main()
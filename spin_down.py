@@ -0,0 +1,123 @@
+import time
+from dataclasses import dataclass
+
+# states
+IDLE = 'idle'
+RUNNING = 'running'
+FINISHED = 'finished'
+
+# how a spin down ended
+STOPPED = 'stopped'     # IO bits set / velocity below threshold
+STALLED = 'stalled'     # velocity stopped changing well above zero, the caller should force a stop
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+
+@dataclass(frozen=True)
+class SpinDownProgress:
+    elapsed: float = 0.0 # sec since start
+    velocity: float = 0.0 # rpm
+    io_status: int = 0
+    fraction: float = 0.0 # 0 at the start velocity, 1 when stopped
+
+@dataclass(frozen=True)
+class SpinDownResult:
+    reason: str = STOPPED
+    duration: float = 0.0 # sec from start to stop, interpolated between samples
+    startVelocity: float = 0.0 # rpm
+    samples: int = 0 # velocity samples seen
+
+
+class SpinDown():
+    """Event driven wait for the wheel to spin down, fed with Telemetry.
+
+    start() after the stop command, then feed() every telemetry sample and
+    call checkTimeout() from a timer, so the timeout also fires when no
+    telemetry arrives. It finishes once when
+      - the io_mask bits are all set (QX1 sweep ended), or, without io_mask,
+        |velocity| < velocity_threshold,
+      - the velocity stays above stall_velocity and changes by less than
+        stall_tolerance between two samples (the wheel does not slow down),
+      - timeout seconds passed,
+    and calls on_complete(SpinDownResult). on_progress(SpinDownProgress) is
+    called on every new velocity sample. Only registers a poll actually read
+    (Telemetry.updated) are used, so stale values do not look like a stall.
+    """
+    def __init__(self, on_progress=None, on_complete=None, timeout=60.0, io_mask=None,
+                 velocity_threshold=0.1, stall_tolerance=0.1, stall_velocity=1.0):
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.timeout = timeout # sec
+        self.io_mask = io_mask
+        self.velocity_threshold = velocity_threshold # rpm
+        self.stall_tolerance = stall_tolerance # rpm, None to disable the stall check
+        self.stall_velocity = stall_velocity # rpm
+        self.state = IDLE
+        self.result = None
+        self._start = 0.0
+        self._startVelocity = 0.0
+        self._samples = [] # (timestamp, velocity)
+
+    def isRunning(self):
+        return self.state == RUNNING
+
+    def start(self, velocity, now=None):
+        self._start = time.monotonic() if now is None else now
+        self._startVelocity = abs(velocity)
+        self._samples = []
+        self.result = None
+        self.state = RUNNING
+
+    def cancel(self):
+        if self.state == RUNNING:
+            self._finish(CANCELLED, time.monotonic())
+
+    def checkTimeout(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.state == RUNNING and now - self._start >= self.timeout:
+            self._finish(TIMEOUT, now)
+
+    def feed(self, telemetry):
+        """Returns True once the spin down has finished."""
+        if self.state != RUNNING or not telemetry.valid:
+            return self.state == FINISHED
+        now = telemetry.timestamp
+
+        if 'RUw1' in telemetry.updated:
+            velocity = abs(telemetry.motorVelocity)
+            self._samples.append((now, velocity))
+            if self.on_progress is not None:
+                fraction = 1.0 - velocity / self._startVelocity if self._startVelocity > 0 else 1.0
+                self.on_progress(SpinDownProgress(now - self._start, velocity, telemetry.io_status,
+                                                  min(1.0, max(0.0, fraction))))
+            if self.io_mask is None and velocity < self.velocity_threshold:
+                self._finish(STOPPED, now)
+                return True
+
+        if self.io_mask is not None and 'IO' in telemetry.updated \
+                and int(telemetry.io_status) & self.io_mask == self.io_mask:
+            self._finish(STOPPED, now)
+            return True
+
+        if self.stall_tolerance is not None and len(self._samples) >= 2:
+            (_, old), (_, new) = self._samples[-2:]
+            if new > self.stall_velocity and abs(new - old) < self.stall_tolerance:
+                self._finish(STALLED, now)
+                return True
+
+        self.checkTimeout(now)
+        return self.state == FINISHED
+
+    def _stopTime(self, now):
+        # when the velocity crossed the threshold, linear between the last two samples around it
+        samples = self._samples
+        for (t0, v0), (t1, v1) in zip(samples, samples[1:]):
+            if v0 >= self.velocity_threshold > v1:
+                return t0 + (t1 - t0) * (v0 - self.velocity_threshold) / (v0 - v1)
+        return now
+
+    def _finish(self, reason, now):
+        self.state = FINISHED
+        stop = self._stopTime(now) if reason == STOPPED else now
+        self.result = SpinDownResult(reason, stop - self._start, self._startVelocity, len(self._samples))
+        if self.on_complete is not None:
+            self.on_complete(self.result)
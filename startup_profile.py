@@ -0,0 +1,46 @@
+import json
+import time
+
+# the GUI imports this module first, so that the import time of the rest is counted
+PROCESS_START = time.perf_counter()
+
+class StartupProfile():
+    """Time from the start of GUI.py to each startup milestone, for GUI.py --startup-time.
+
+    mark(name) records the first time a milestone is reached. Once all the
+    expected milestones are in, on_complete() is called, e.g. to print the
+    report and quit. save() appends the run to a JSON lines file, one line
+    per run, to follow the startup time across versions.
+    """
+    def __init__(self, expected=(), on_complete=None, start=PROCESS_START):
+        self.start = start
+        self.expected = list(expected)
+        self.on_complete = on_complete
+        self.marks = {} # name : sec since start
+
+    def mark(self, name):
+        if name in self.marks:
+            return
+        self.marks[name] = time.perf_counter() - self.start
+        if self.on_complete is not None and self.isComplete():
+            on_complete, self.on_complete = self.on_complete, None
+            on_complete()
+
+    def isComplete(self):
+        return all(name in self.marks for name in self.expected)
+
+    def missing(self):
+        return [name for name in self.expected if name not in self.marks]
+
+    def report(self):
+        lines = ["Startup time:"]
+        for name, t in sorted(self.marks.items(), key=lambda item: item[1]):
+            lines.append(f"  {name:>12s} {t * 1000:8.1f} ms")
+        for name in self.missing():
+            lines.append(f"  {name:>12s}      n/a")
+        return "\n".join(lines)
+
+    def save(self, fileName):
+        with open(fileName, "a") as file:
+            file.write(json.dumps({"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                   "marks": {name: round(t, 4) for name, t in self.marks.items()}}) + "\n")
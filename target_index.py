@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+
+from Library import STEP_PER_REVOLUTION
+
+class TargetIndex():
+    """Nearest target lookup over one revolution of the wheel.
+
+    The target positions (steps, modulo one revolution) are kept in a NumPy
+    array, and for every one of the STEP_PER_REVOLUTION positions a lookup
+    table holds the nearest target and its circular distance. The table is
+    rebuilt by setPositions() only, so nearest() is an O(1) lookup of
+    position % STEP_PER_REVOLUTION per tick. Used by the GUI and by the
+    headless scripts, e.g.
+
+        index = TargetIndex.fromFile("targets.json")
+        i, distance = index.nearest(controller.position)
+    """
+    def __init__(self, positions=(), names=None):
+        self.names = list(names) if names is not None else []
+        self.setPositions(positions)
+
+    @classmethod
+    def fromFile(cls, fileName):
+        """From a targets file saved by the GUI, [{"index", "name", "position"}, ...]."""
+        with open(fileName, "r") as file:
+            data = sorted(json.load(file), key=lambda item: item["index"])
+        return cls([int(item["position"]) for item in data], [item["name"] for item in data])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def setPositions(self, positions):
+        self.positions = np.asarray(positions, dtype=np.int64) % STEP_PER_REVOLUTION
+        if len(self.positions) == 0:
+            self._nearest = np.full(STEP_PER_REVOLUTION, -1, dtype=np.int16)
+            self._distance = np.full(STEP_PER_REVOLUTION, STEP_PER_REVOLUTION, dtype=np.int32)
+            return
+        steps = np.arange(STEP_PER_REVOLUTION, dtype=np.int64)
+        distance = np.abs(steps[:, None] - self.positions[None, :])
+        distance = np.minimum(distance, STEP_PER_REVOLUTION - distance) # circular
+        self._nearest = np.argmin(distance, axis=1).astype(np.int16)
+        self._distance = distance[steps, self._nearest].astype(np.int32)
+
+    def nearest(self, position):
+        """(index, distance in steps) of the target nearest to an absolute position, index -1 if no targets."""
+        mod = int(position) % STEP_PER_REVOLUTION
+        return int(self._nearest[mod]), int(self._distance[mod])
+
+    def within(self, position, tolerance):
+        """Index of the target within tolerance steps of position, or None."""
+        i, distance = self.nearest(position)
+        return i if i >= 0 and distance <= tolerance else None
+
+    def name(self, i):
+        return self.names[i] if i < len(self.names) else str(i)
+
+    def find(self, name):
+        """Index of the target called name, or None."""
+        return self.names.index(name) if name in self.names else None
@@ -0,0 +1,152 @@
+import time
+from dataclasses import dataclass, fields, replace
+
+import numpy as np
+
+from Library import ControllerState, TELEMETRY_KEYS
+
+TELEMETRY_DTYPE = np.dtype([
+    ('timestamp', 'f8'),       # time.monotonic()
+    ('position', 'i8'),        # steps
+    ('encoderVelocity', 'f4'), # rpm
+    ('motorVelocity', 'f4'),   # rpm
+    ('torque', 'f4'),
+    ('temperature', 'f4'),     # C
+    ('io_status', 'u1'),
+])
+
+@dataclass(frozen=True)
+class Telemetry:
+    """One poll of the fast changing registers, see Controller.getTelemetry."""
+    timestamp: float = 0.0 # time.monotonic() of the poll
+    connected: bool = False
+    valid: bool = False # False when the poll failed, values are then the last known ones
+    position: int = 0 # steps
+    io_status: int = 0
+    temperature: float = 0.0 # C
+    encoderVelocity: float = 0.0 # rpm
+    motorVelocity: float = 0.0 # rpm
+    torque: float = 0.0
+    qx4EncoderDemandPos: float = 0
+    updated: tuple = () # registers read by this poll, the others are the last known values
+
+    @classmethod
+    def fromController(cls, controller, valid=True, updated=TELEMETRY_KEYS):
+        return cls(timestamp=time.monotonic(),
+                   connected=controller.connected,
+                   valid=valid,
+                   updated=tuple(updated),
+                   position=controller.position,
+                   io_status=controller.io_status,
+                   temperature=controller.temperature,
+                   encoderVelocity=controller.encoderVelocity,
+                   motorVelocity=controller.motorVelocity,
+                   torque=controller.torque,
+                   qx4EncoderDemandPos=controller.qx4EncoderDemandPos)
+
+
+@dataclass(frozen=True)
+class ControllerStatus:
+    """Immutable copy of all the Controller parameters, safe to hand to another thread."""
+    connected: bool = False
+    isSpinning: bool = False
+    commandMode: float = None
+    jogSpeed: float = 0.0 # rev/sec
+    jogAccel: float = 0.0 # rev/sec/sec
+    io_status: int = 0
+    FWprogram: int = 0
+    maxAccel: float = 0.0 # rev/sec/sec
+    accelRate: float = 0.0 # rev/sec/sec
+    velocity: float = 0.0 # rev/sec
+    deaccelRate: float = 0.0 # rev/sec/sec
+    moveDistance: float = 0 # steps
+    position: int = 0 # steps
+    sweepMask: int = 0x0000
+    spokeOffset: int = 0 # steps
+    spokeWidth: int = 0 # steps
+    sweepSpeed: float = 0 # rpm
+    sweepCutOff: float = 0 # rpm
+    temperature: float = 0.0 # C
+    encoderVelocity: float = 0.0 # rpm
+    motorVelocity: float = 0.0 # rpm
+    torque: float = 0.0
+    isQX4Updated: bool = False # QX4 parameters were read since the previous snapshot
+    qx4EncoderDemandPos: float = 0
+    qx4ControUpdate: float = 0
+    qx4SlewSpeed: float = 0
+    qx4ServoSlewSpeed: float = 0
+    qx4MotorDemandPos: float = 0
+
+    ConvertModPositionToAbsolute = ControllerState.ConvertModPositionToAbsolute
+
+    @classmethod
+    def fromController(cls, controller):
+        return cls(**{f.name: getattr(controller, f.name) for f in fields(cls)})
+
+    def withTelemetry(self, telemetry):
+        return replace(self,
+                       connected=telemetry.connected,
+                       position=telemetry.position,
+                       io_status=telemetry.io_status,
+                       temperature=telemetry.temperature,
+                       encoderVelocity=telemetry.encoderVelocity,
+                       motorVelocity=telemetry.motorVelocity,
+                       torque=telemetry.torque,
+                       isQX4Updated=False)
+
+
+class TelemetryHistory():
+    """Fixed capacity ring buffer of Telemetry samples in a NumPy structured array.
+
+    The storage is preallocated at twice the capacity and every sample is
+    written at i and i + capacity, so the latest n samples are always one
+    contiguous slice: window() and since() return views, nothing is copied
+    or allocated per tick. Views are only valid until the slot is overwritten.
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=TELEMETRY_DTYPE)
+        self._head = 0 # next slot to write, 0 <= head < capacity
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self._head = 0
+        self.count = 0
+
+    def append(self, telemetry):
+        row = (telemetry.timestamp, telemetry.position, telemetry.encoderVelocity,
+               telemetry.motorVelocity, telemetry.torque, telemetry.temperature, telemetry.io_status)
+        self._data[self._head] = row
+        self._data[self._head + self.capacity] = row
+        self._head = (self._head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def window(self, n=None):
+        """The latest n samples (all when n is None), oldest first."""
+        n = self.count if n is None else min(n, self.count)
+        end = self._head + self.capacity
+        return self._data[end - n:end]
+
+    def since(self, start):
+        """Samples with timestamp >= start (time.monotonic())."""
+        samples = self.window()
+        return samples[np.searchsorted(samples['timestamp'], start):]
+
+    def latest(self):
+        if self.count == 0:
+            return None
+        return self._data[self._head + self.capacity - 1]
+
+    def rate(self, field, n=2):
+        """Average rate of change of field over the latest n samples, per second."""
+        samples = self.window(n)
+        if len(samples) < 2:
+            return 0.0
+        dt = samples['timestamp'][-1] - samples['timestamp'][0]
+        if dt <= 0:
+            return 0.0
+        return float(samples[field][-1] - samples[field][0]) / dt
@@ -0,0 +1,124 @@
+"""Completion waiters over the telemetry stream.
+
+A wait is a predicate over Telemetry samples plus a timeout. Waits are
+registered on one WaiterRegistry, which is fed every telemetry sample of
+the shared poll, so any number of waits run at the same time without any
+extra polling:
+
+    waiters = WaiterRegistry()
+    future = waiters.wait(positionStable(5), timeout=10)
+    future.add_done_callback(...)     # or future.result() from another thread
+    ...
+    waiters.feed(telemetry)           # every telemetry sample
+    waiters.checkTimeouts()           # from a timer, when no telemetry arrives
+
+The future's result is the sample that satisfied the predicate, a wait that
+timed out raises TimeoutError. Predicates are called with every valid
+sample and may keep state, the factories below return a fresh one per wait.
+"""
+import collections
+import time
+from concurrent.futures import Future
+
+from Library import STEP_PER_REVOLUTION
+
+class WaiterRegistry():
+    def __init__(self):
+        self._waits = [] # [future, predicate, deadline, name]
+
+    def __len__(self):
+        return len(self._waits)
+
+    def wait(self, predicate, timeout=None, name=""):
+        """Future resolved with the first sample where predicate(sample) is true."""
+        future = Future() # left pending, so the owner can cancel() it
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._waits.append([future, predicate, deadline, name])
+        return future
+
+    def feed(self, telemetry):
+        if not self._waits or not telemetry.valid:
+            self.checkTimeouts()
+            return
+        for entry in list(self._waits):
+            future, predicate = entry[0], entry[1]
+            if future.done(): # cancelled by the owner
+                self._remove(entry)
+                continue
+            try:
+                if predicate(telemetry):
+                    self._remove(entry)
+                    future.set_result(telemetry)
+            except Exception as e:
+                self._remove(entry)
+                future.set_exception(e)
+        self.checkTimeouts()
+
+    def checkTimeouts(self, now=None):
+        now = time.monotonic() if now is None else now
+        for entry in list(self._waits):
+            future, _, deadline, name = entry
+            if future.done():
+                self._remove(entry)
+            elif deadline is not None and now >= deadline:
+                self._remove(entry)
+                future.set_exception(TimeoutError(f"wait {name} timed out"))
+
+    def cancelAll(self):
+        waits, self._waits = self._waits, []
+        for future, *_ in waits:
+            future.cancel()
+
+    def _remove(self, entry):
+        if entry in self._waits:
+            self._waits.remove(entry)
+
+#======================================= predicate factories
+def positionStable(samples=5):
+    """True when the last samples position reads (samples + 1 readings) did not move."""
+    positions = collections.deque(maxlen=samples + 1)
+    def predicate(telemetry):
+        if 'RUe1' in telemetry.updated:
+            positions.append(telemetry.position)
+        return len(positions) == positions.maxlen and max(positions) == min(positions)
+    return predicate
+
+def velocityNear(target, fraction=0.1, field='motorVelocity'):
+    """True when the velocity [rpm] is within fraction of target, e.g. the sweep speed."""
+    def predicate(telemetry):
+        return target > 0 and abs(getattr(telemetry, field) - target) < fraction * target
+    return predicate
+
+def ioBitsEqual(mask, value=None):
+    """True when io_status & mask == value, all the mask bits set when value is None."""
+    value = mask if value is None else value
+    def predicate(telemetry):
+        return 'IO' in telemetry.updated and int(telemetry.io_status) & mask == value
+    return predicate
+
+def qx4ErrorWithin(tolerance=10, demand=None):
+    """True when the position is within tolerance steps of the QX4 demand position (modulo one revolution)."""
+    def predicate(telemetry):
+        target = telemetry.qx4EncoderDemandPos if demand is None else demand
+        diff = (telemetry.position - target) % STEP_PER_REVOLUTION
+        return min(diff, STEP_PER_REVOLUTION - diff) <= tolerance
+    return predicate
+
+def positionWithin(position, tolerance=5):
+    """True when the absolute position [steps] is within tolerance, e.g. a move precomputed with ConvertModPositionToAbsolute."""
+    def predicate(telemetry):
+        return 'RUe1' in telemetry.updated and abs(telemetry.position - position) <= tolerance
+    return predicate
+
+def after(deadline):
+    """True on the first sample at or after deadline (time.monotonic()), a dwell."""
+    def predicate(telemetry):
+        return telemetry.timestamp >= deadline
+    return predicate
+
+def allOf(*predicates):
+    """True when all predicates are true on the same sample, each one still sees every sample."""
+    def predicate(telemetry):
+        results = [p(telemetry) for p in predicates]
+        return all(results)
+    return predicate
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""Headless service that owns the controller connection.
+
+The daemon keeps the one Controller socket, polls it on a PollScheduler
+and serves a JSON-lines RPC on localhost, so the GUI, motor scripts and
+monitors can all use the wheel at the same time without interleaving
+replies on the controller link:
+
+    python3 wheel_daemon.py --ip 192.168.203.36 --port 7776 --rpc-port 7780
+    python3 GUI.py --daemon 127.0.0.1:7780
+
+Every request is one JSON line, {"id": n, "method": ..., "params": {...}},
+answered by {"id": n, "result": ..., "error": null}:
+
+  call       {"name", "args"}  a Controller method of CALLS (setSweepSpeed, send_message, ...)
+                               or setState, expect, clearExpectation, setPolling,
+                               the reply also has the "status" after the call
+  status     {}                last ControllerStatus, no controller I/O
+  telemetry  {}                last Telemetry, no controller I/O
+  subscribe  {"events"}        push {"event", "data"} lines for telemetry, status,
+                               connection; all three by default
+  unsubscribe {}
+
+All the controller I/O runs in one thread, in the order it was requested:
+one poll stream for every client, and identical reads already queued
+(getStatus, ...) are shared. Subscribers get every poll, a client that
+does not keep up loses telemetry lines, never replies.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import socket
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, replace
+
+import wheel_log
+from Library import Controller
+from connection_manager import ConnectionEvent
+from poll_scheduler import PollScheduler
+from telemetry import Telemetry, ControllerStatus
+
+log = wheel_log.getLogger("conn")
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7780
+EVENTS = ('telemetry', 'status', 'connection')
+SHARED_READS = frozenset(['getStatus', 'getTelemetry', 'getQX4Parameters', 'getIOStatus',
+                          'getFirmwareProgramStatus', 'getPosition', 'getTemperature',
+                          'getEncoderVelocity', 'getMotorVelocity', 'getTorque'])
+# the non-blocking queries and writes a client may call, not Connect / disconnect, the
+# PID loop or anything else that would hold up the controller thread for every client
+CALLS = SHARED_READS | frozenset(['heartbeat', 'seekHome', 'setEncoderPosition',
+                                  'setSweepMask', 'setSpokeWidth', 'setSpokeOffset', 'setSweepSpeed',
+                                  'setSweepCutOff', 'startSpinSweep', 'stopSpinSweep', 'finishSpinSweep',
+                                  'setMaxAccel', 'setAccelRate', 'setDeaccelRate', 'setVelocity',
+                                  'setMoveDistance', 'setJogSpeed', 'setJogAccel', 'startSpin', 'stopSpin',
+                                  'setQX4EncoderDemandPos', 'setQX4ControUpdate', 'setQX4SlewSpeed',
+                                  'setQX4ServoSlewSpeed', 'getQX4MotorDemandPos', 'startQX4LockPosition',
+                                  'stopQX4LockPosition', 'send_message'])
+QX4_READS = frozenset(['getStatus', 'getQX4Parameters'])
+MAX_BACKLOG = 1000 # lines queued for a client before its telemetry is dropped
+
+def _encode(message):
+    return (json.dumps(message, default=str) + '\n').encode('utf-8')
+
+def decodeTelemetry(data):
+    return Telemetry(**dict(data, updated=tuple(data.get('updated', ()))))
+
+def decodeStatus(data):
+    return ControllerStatus(**data)
+
+def decodeConnectionEvent(data):
+    return ConnectionEvent(**data)
+
+
+class _Client():
+    # one RPC connection, lines are written by its own task in order
+    def __init__(self, writer):
+        self.writer = writer
+        self.events = set()
+        self.queue = asyncio.Queue()
+        self.dropped = 0
+        self.task = asyncio.get_running_loop().create_task(self._writeLoop())
+
+    def send(self, message, droppable=False):
+        if droppable and self.queue.qsize() >= MAX_BACKLOG:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(_encode(message))
+
+    async def _writeLoop(self):
+        while True:
+            line = await self.queue.get()
+            self.writer.write(line)
+            if self.queue.empty():
+                await self.writer.drain()
+
+
+class WheelDaemon():
+    """Owns a Controller and serves it to the RPC clients, see the module doc."""
+    def __init__(self, IP, port, host=DEFAULT_HOST, rpc_port=DEFAULT_PORT, controller=None, scheduler=None):
+        self.IP = IP
+        self.port = port
+        self.host = host
+        self.rpc_port = rpc_port
+        self.controller = controller if controller is not None else Controller()
+        self.scheduler = scheduler if scheduler is not None else PollScheduler()
+        self.executor = ThreadPoolExecutor(max_workers=1) # every controller I/O, in request order
+        self.clients = set()
+        self.telemetry = None # last Telemetry
+        self.server = None
+        self._inflight = {} # (name, args) : asyncio future of a shared read
+        self._wake = None # asyncio.Event, set when the poll schedule changed
+        self._commands = {
+            'setState': self._setState,
+            'expect': self._expect,
+            'clearExpectation': self.scheduler.clearExpectation,
+            'setPolling': lambda enable: None, # every client sees the same poll stream
+        }
+
+    async def serve(self):
+        """Connect, poll and serve until cancelled."""
+        self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self.controller.addConnectionListener(
+            lambda event: self.loop.call_soon_threadsafe(self._publish, 'connection', asdict(event)))
+        await self._io(self._connect, self.IP, self.port)
+        self.server = await asyncio.start_server(self._handle, self.host, self.rpc_port)
+        log.info("Wheel daemon on %s:%s, controller %s:%s", self.host, self.rpc_port, self.IP, self.port)
+        poll = self.loop.create_task(self._pollLoop())
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            poll.cancel()
+            await self._io(self.controller.disconnect)
+            self.executor.shutdown()
+
+    #======================================= controller thread
+    async def _io(self, function, *args):
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    def _connect(self, IP, port):
+        if self.controller.connected and (IP, port) == (self.controller.IP, self.controller.port):
+            return
+        self.controller.Connect(IP, port)
+        self.scheduler.reset()
+
+    def _setState(self, state):
+        self.scheduler.setState(state)
+        self.loop.call_soon_threadsafe(self._wake.set)
+
+    def _expect(self, eta, keys=('RUe1',)):
+        self.scheduler.expect(eta, keys)
+        self.loop.call_soon_threadsafe(self._wake.set)
+
+    def _run(self, name, args):
+        # (result, status after) of a command
+        if name in self._commands:
+            result = self._commands[name](*args)
+        else:
+            result = getattr(self.controller, name)(*args)
+        # the QX4 parameters are new to the clients after the calls that read them only
+        status = replace(ControllerStatus.fromController(self.controller), isQX4Updated=name in QX4_READS)
+        return result, status
+
+    def _read(self, keys):
+        valid = False
+        try:
+            valid = self.controller.getTelemetry(keys)
+        except Exception as e:
+            log.warning("Telemetry poll failed: %s", e)
+        return Telemetry.fromController(self.controller, valid, keys if valid else ())
+
+    async def _pollLoop(self):
+        while True:
+            wait = self.scheduler.tick()
+            if self.controller.connected:
+                keys = self.scheduler.due()
+                if keys:
+                    self.telemetry = await self._io(self._read, keys)
+                    self._publish('telemetry', asdict(self.telemetry))
+                wait = self.scheduler.untilNext()
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    #======================================= RPC
+    async def _handle(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    client.send({'id': None, 'result': None, 'error': "invalid JSON"})
+                    continue
+                # started in order, so the calls of a client reach the controller thread in order
+                self.loop.create_task(self._dispatch(client, request))
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            client.task.cancel()
+            writer.close()
+
+    async def _dispatch(self, client, request):
+        request_id = request.get('id')
+        method = request.get('method')
+        params = request.get('params') or {}
+        reply = {'id': request_id, 'result': None, 'error': None}
+        try:
+            if method == 'call':
+                name = params['name']
+                args = tuple(params.get('args', ()))
+                if name not in self._commands and name not in CALLS:
+                    raise ValueError(f"{name} is not available through the daemon")
+                reply['result'], status = await self._call(name, args)
+                reply['status'] = asdict(status)
+                self._publish('status', reply['status'], exclude=client)
+            elif method == 'status':
+                reply['result'] = asdict(ControllerStatus.fromController(self.controller))
+            elif method == 'telemetry':
+                reply['result'] = asdict(self.telemetry) if self.telemetry is not None else None
+            elif method == 'subscribe':
+                events = params.get('events') or EVENTS
+                client.events.update(events)
+                reply['result'] = sorted(client.events)
+            elif method == 'unsubscribe':
+                client.events.clear()
+                reply['result'] = True
+            else:
+                raise ValueError(f"unknown method {method}")
+        except Exception as e:
+            reply['error'] = f"{type(e).__name__}: {e}"
+        client.send(reply)
+
+    def _call(self, name, args):
+        # handed to the executor right away, not from a task a loop step later, so the calls keep their order
+        if name not in SHARED_READS:
+            return self.loop.run_in_executor(self.executor, self._run, name, args)
+        key = (name, args)
+        future = self._inflight.get(key)
+        if future is None:
+            future = self.loop.run_in_executor(self.executor, self._run, name, args)
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._inflight.pop(key, None))
+        return asyncio.shield(future)
+
+    def _publish(self, event, data, exclude=None):
+        message = {'event': event, 'data': data}
+        for client in list(self.clients):
+            if event in client.events and client is not exclude:
+                client.send(message, droppable=(event == 'telemetry'))
+
+
+class WheelClient():
+    """Blocking client of a WheelDaemon, usable from any thread.
+
+    client = WheelClient()
+    client.setSweepSpeed(12)            # a Controller method of CALLS, by name
+    status = client.status()            # ControllerStatus
+    client.subscribe(lambda event, data: ...)
+
+    request() returns a concurrent.futures.Future of the whole reply, the
+    subscribe callbacks run in the client reader thread.
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=5.0):
+        self.timeout = timeout # sec, for call() and the other blocking helpers
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(None)
+        self.listeners = [] # callback(event, data)
+        self._file = self.sock.makefile('rb')
+        self._pending = {} # id : Future
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._readLoop, daemon=True)
+        self._reader.start()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args: self.call(name, *args)
+
+    def request(self, method, **params):
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            try:
+                self.sock.sendall(_encode({'id': request_id, 'method': method, 'params': params}))
+            except OSError as e:
+                del self._pending[request_id]
+                future.set_exception(ConnectionError(str(e)))
+        return future
+
+    def _result(self, future):
+        reply = future.result(self.timeout)
+        if reply['error']:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def call(self, name, *args):
+        return self._result(self.request('call', name=name, args=args))
+
+    def status(self):
+        return decodeStatus(self._result(self.request('status')))
+
+    def telemetry(self):
+        data = self._result(self.request('telemetry'))
+        return decodeTelemetry(data) if data is not None else None
+
+    def subscribe(self, callback, events=EVENTS):
+        self.listeners.append(callback)
+        return self._result(self.request('subscribe', events=list(events)))
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._reader.join(1.0)
+
+    def _readLoop(self):
+        try:
+            for line in self._file:
+                message = json.loads(line)
+                if 'event' in message:
+                    for callback in list(self.listeners):
+                        try:
+                            callback(message['event'], message['data'])
+                        except Exception as e:
+                            log.warning("Daemon event listener failed: %s", e)
+                    continue
+                future = self._pending.pop(message.get('id'), None)
+                if future is not None:
+                    future.set_result(message)
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("daemon connection closed"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Own the controller connection and serve it on a local RPC port.")
+    parser.add_argument("--ip", help="controller IP, default from programSettings.json")
+    parser.add_argument("--port", type=int, help="controller port, default from programSettings.json")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="RPC address, keep it local")
+    parser.add_argument("--rpc-port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    IP, port = args.ip, args.port
+    if IP is None or port is None:
+        with open("programSettings.json", "r") as file:
+            data = json.load(file)[0]
+        IP = IP if IP is not None else data["IP"]
+        port = port if port is not None else int(data["Port"])
+    try:
+        asyncio.run(WheelDaemon(IP, port, args.host, args.rpc_port).serve())
+    except KeyboardInterrupt:
+        log.info("Wheel daemon stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Logging for the controller and the GUI, off the command path.
+
+Every module logs to a category, getLogger("io") is the logger
+"wheel.io". The records go through a queue to one listener thread that
+does the formatting and the writing. A slow terminal, or a pipe, then
+never holds up a round trip with the controller. Categories:
+
+    io          the TX/RX lines, "-> RUe1" / "<-|e=1234|" (DEBUG for the polling)
+    controller  the Controller commands, "Starting spin..."
+    conn        connect, disconnect, connection lost
+    pid         PID_pos_control, the iterations are DEBUG
+    gui         the GUI, the acquisition worker, the sequences
+    influx      the InfluxDB writer
+
+The level of each category is set with setLevels({"io": "WARNING", ...}),
+from the "log_levels" of programSettings.json in the GUI, or from the
+environment for the scripts, WHEEL_LOG="io=WARNING,pid=DEBUG". Repeated
+messages are rate limited per call site, see RateLimitFilter.
+
+TraceBuffer keeps the last TX/RX of a Controller in memory whatever the
+levels are, for the post mortem of a connection loss.
+"""
+import atexit
+import collections
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+ROOT = "wheel"
+DEFAULT_LEVELS = {'io': 'INFO', 'controller': 'INFO', 'conn': 'INFO', 'pid': 'INFO', 'gui': 'INFO', 'influx': 'INFO'}
+RATE = 20.0 # records/sec per call site, on average
+BURST = 50 # records per call site let through at once
+TRACE_SIZE = 256 # TX/RX lines kept by a TraceBuffer
+FORMAT = "%(asctime)s.%(msecs)03d %(levelname).1s %(name)s: %(message)s"
+DATE_FORMAT = "%H:%M:%S"
+
+_lock = threading.Lock()
+_listener = None
+_handler = None
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per (logger, message format), rate records/sec with bursts of up to burst.
+
+    The records over the limit are dropped before they are queued. The next
+    one let through from the same call site tells how many were dropped.
+    """
+    def __init__(self, rate=RATE, burst=BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.suppressed = 0 # total
+        self._buckets = {} # key : [tokens, last time, suppressed since the last record]
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now, 0]
+        bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1.0:
+            bucket[2] += 1
+            self.suppressed += 1
+            return False
+        bucket[0] -= 1.0
+        if bucket[2]:
+            record.msg = f"{record.msg} [{bucket[2]} similar suppressed]"
+            bucket[2] = 0
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # the records are formatted in the listener thread, not by the caller
+    def prepare(self, record):
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+
+class TraceBuffer():
+    """Ring buffer of the last size TX/RX lines, (time.time(), direction, text)."""
+    def __init__(self, size=TRACE_SIZE):
+        self.lines = collections.deque(maxlen=size)
+
+    def tx(self, message):
+        self.lines.append((time.time(), '->', message))
+
+    def rx(self, reply):
+        self.lines.append((time.time(), '<-', reply))
+
+    def recent(self, n=None):
+        lines = list(self.lines) # one C call, safe while the I/O thread appends
+        return lines if n is None else lines[-n:]
+
+    def format(self, n=None):
+        return "\n".join(f"{time.strftime('%H:%M:%S', time.localtime(t))}.{int(t * 1000) % 1000:03d} {d} {text}"
+                         for t, d, text in self.recent(n))
+
+    def clear(self):
+        self.lines.clear()
+
+#======================================= configuration
+def parseLevels(text):
+    """{"io": "WARNING", ...} from "io=WARNING,pid=DEBUG"."""
+    levels = {}
+    for item in text.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setLevels(levels):
+    for category, level in levels.items():
+        logger = logging.getLogger(f"{ROOT}.{category}")
+        try:
+            logger.setLevel(level.upper() if isinstance(level, str) else level)
+        except ValueError as e:
+            logger.warning("Log level ignored: %s", e)
+
+def setup(levels=None, stream=None, fileName=None, rate=RATE, burst=BURST):
+    """Starts the listener thread, once. The levels are DEFAULT_LEVELS, then WHEEL_LOG, then levels."""
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            formatter = logging.Formatter(FORMAT, DATE_FORMAT)
+            handlers = [logging.StreamHandler(stream if stream is not None else sys.stdout)]
+            if fileName:
+                handlers.append(logging.FileHandler(fileName))
+            for handler in handlers:
+                handler.setFormatter(formatter)
+
+            records = queue.SimpleQueue()
+            _handler = _QueueHandler(records)
+            _handler.addFilter(RateLimitFilter(rate, burst))
+            root = logging.getLogger(ROOT)
+            root.addHandler(_handler)
+            root.propagate = False
+            _listener = logging.handlers.QueueListener(records, *handlers)
+            _listener.start()
+            atexit.register(stop)
+
+            setLevels(DEFAULT_LEVELS)
+            setLevels(parseLevels(os.environ.get("WHEEL_LOG", "")))
+    if levels:
+        setLevels(levels)
+
+def stop():
+    """Writes what is still queued and ends the listener thread, later records are written directly."""
+    global _handler
+    with _lock:
+        if _listener is None or _handler is None:
+            return
+        _listener.stop()
+        root = logging.getLogger(ROOT)
+        root.removeHandler(_handler)
+        for handler in _listener.handlers: # e.g. Controller.__del__ at the interpreter exit
+            root.addHandler(handler)
+        _handler = None
+
+def getLogger(category):
+    setup()
+    return logging.getLogger(f"{ROOT}.{category}")
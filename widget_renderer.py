@@ -0,0 +1,42 @@
+class WidgetRenderer():
+    """Change driven widget updates for the per-tick displays.
+
+    The telemetry slots only record what each widget should show with
+    setText() / setStyleSheet(), the latest value per widget wins. flush()
+    then compares against what the widget actually displays and calls the
+    Qt setter only when the formatted text or style differ, so an unchanged
+    value costs no repaint and an unchanged style no re-polish. Calling
+    flush() from a QTimer caps the repaint rate independently of the
+    acquisition rate.
+    """
+    def __init__(self):
+        self._pending = {} # (widget, kind) : value
+        self.applied = 0 # widget updates done
+        self.skipped = 0 # widget updates saved
+
+    def setText(self, widget, text):
+        self._pending[(widget, 'text')] = text
+
+    def setStyleSheet(self, widget, style):
+        self._pending[(widget, 'style')] = style
+
+    def isDirty(self):
+        return bool(self._pending)
+
+    def flush(self):
+        pending = self._pending
+        if not pending:
+            return
+        self._pending = {}
+        for (widget, kind), value in pending.items():
+            if kind == 'text':
+                if widget.text() == value:
+                    self.skipped += 1
+                    continue
+                widget.setText(value)
+            else:
+                if widget.styleSheet() == value:
+                    self.skipped += 1
+                    continue
+                widget.setStyleSheet(value)
+            self.applied += 1